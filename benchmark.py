@@ -0,0 +1,283 @@
+""" Benchmarks of reading, writing, cell access, map algebra and filtering.
+
+Run as a script to time each benchmark on synthetic rasters and print the
+results, optionally saving them as JSON and comparing them with a saved
+baseline, e.g.
+
+    python benchmark.py --rows 1000 --columns 1000 --output results.json
+    python benchmark.py --baseline results.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from array import array
+
+import focal
+from raster import Raster, convert_values, data_typecode
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BYTE_ORDERS = ('LITTLE_ENDIAN', 'BIG_ENDIAN')
+
+
+def synthetic_raster(filename, rows, columns, data_type='float', byte_order='LITTLE_ENDIAN',
+                     nodata=-32768.0, seed=1):
+    """ Write a .dep/.tas raster of a smooth random surface, between 0 and
+    1000 and rounded to whole numbers for the integer data types, with
+    about one cell in a hundred nodata (255 for bytes). The same seed gives
+    the same raster.
+    """
+    random.seed(seed)
+    if data_type == 'byte':
+        nodata = 255.0
+    r = Raster.create(filename, rows, columns, nodata, data_type)
+    r.byte_order = byte_order
+
+    # a few random waves, plus noise
+    waves = [(random.uniform(0.001, 0.05), random.uniform(0.001, 0.05), random.uniform(0, math.pi))
+             for _ in range(4)]
+    top = 250.0 if data_type == 'byte' else 1000.0
+    for row in range(rows):
+        line = [0.0] * columns
+        for fy, fx, phase in waves:
+            line = [z + math.sin(row * fy + col * fx + phase) for z, col in zip(line, range(columns))]
+        line = [(z + 4.0) / 8.0 * top + random.random() for z in line]
+        for col in range(columns):
+            if random.random() < 0.01:
+                line[col] = nodata
+        r._values[row * columns:(row + 1) * columns] = convert_values(array('d', line), r._values.typecode)
+    r.calculate_min_and_max()
+    r.write()
+    return r
+
+
+def _read(filename):
+    return lambda: Raster.from_file(filename)
+
+
+def _read_mmap(filename):
+    def run():
+        Raster.from_file(filename, mmap=True).close()
+    return run
+
+
+def _write(filename, directory):
+    r = Raster.from_file(filename)
+    r._set_filenames(os.path.join(directory, 'written.dep'))
+    return r.write
+
+
+def _get_cells(filename):
+    r = Raster.from_file(filename)
+
+    def run():
+        total = 0.0
+        for row in range(r.rows):
+            for col in range(r.columns):
+                total += r[row, col]
+    return run
+
+
+def _set_cells(filename):
+    r = Raster.from_file(filename)
+
+    def run():
+        for row in range(r.rows):
+            for col in range(r.columns):
+                r[row, col] = 1.0
+    return run
+
+
+def _algebra(filename):
+    r = Raster.from_file(filename)
+
+    def run():
+        (r + r) * 2.0 - r / 3.0
+    return run
+
+
+def _min_and_max(filename):
+    r = Raster.from_file(filename)
+
+    def run():
+        r._statistics = None
+        r.calculate_min_and_max()
+    return run
+
+
+def _filter(filename, directory):
+    r = Raster.from_file(filename, mmap=True)
+    output = os.path.join(directory, 'filtered.dep')
+    return lambda: focal.edge_preserving_filter(r, size=7, threshold=10.0, output=output)
+
+
+# name of each benchmark, with its setup function (taking the input file and
+# a scratch directory and returning the function to time) and the number of
+# passes over the cells that function makes, for throughput
+BENCHMARKS = (
+    ('read', lambda f, d: _read(f), 1),
+    ('read_mmap', lambda f, d: _read_mmap(f), 1),
+    ('write', _write, 1),
+    ('getitem', lambda f, d: _get_cells(f), 1),
+    ('setitem', lambda f, d: _set_cells(f), 1),
+    ('algebra', lambda f, d: _algebra(f), 4),
+    ('min_and_max', lambda f, d: _min_and_max(f), 1),
+    ('filter_7x7', _filter, 1),
+)
+
+
+def run(rows=512, columns=512, data_types=('float',), byte_orders=('LITTLE_ENDIAN',),
+        benchmarks=None, repeat=3, directory=None, progress=None):
+    """ Time the benchmarks, all of BENCHMARKS or those named in benchmarks,
+    on synthetic rasters of each data type and byte order. Each is run
+    repeat times and the fastest run is kept; its peak memory is measured
+    by an extra run under tracemalloc. Returns a dict of the settings and
+    platform, with a list of results giving the seconds, cells/s, MB/s
+    and peak Python memory of each benchmark. progress, when given, is
+    called with each result as it is made.
+    """
+    names = [name for name, _, _ in BENCHMARKS]
+    for name in benchmarks or ():
+        if name not in names:
+            raise Exception("Unknown benchmark '{}'.".format(name))
+    own_directory = directory is None
+    if own_directory:
+        directory = tempfile.mkdtemp()
+
+    results = []
+    try:
+        for data_type in data_types:
+            for byte_order in byte_orders:
+                filename = os.path.join(directory, 'synthetic.dep')
+                synthetic_raster(filename, rows, columns, data_type, byte_order)
+                cells = rows * columns
+                size = cells * array(data_typecode(data_type)).itemsize
+                for name, setup, passes in BENCHMARKS:
+                    if benchmarks and name not in benchmarks:
+                        continue
+                    func = setup(filename, directory)
+                    seconds = min(_timed(func) for _ in range(max(1, repeat)))
+                    tracemalloc.start()
+                    try:
+                        func()
+                        peak = tracemalloc.get_traced_memory()[1]
+                    finally:
+                        tracemalloc.stop()
+                    result = {
+                        'name': name,
+                        'data_type': data_type,
+                        'byte_order': byte_order,
+                        'seconds': seconds,
+                        'cells_per_second': passes * cells / seconds if seconds else None,
+                        'mb_per_second': passes * size / seconds / 1e6 if seconds else None,
+                        'peak_memory': peak,
+                    }
+                    results.append(result)
+                    if progress is not None:
+                        progress(result)
+    finally:
+        if own_directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'rows': rows,
+        'columns': columns,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'max_rss': _max_rss(),
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """ The benchmarks of results (as returned by run, or loaded from its
+    JSON) that are slower than in baseline by more than the fraction
+    tolerance, as a list of (result, baseline seconds, ratio). Benchmarks
+    missing from either are skipped.
+    """
+    if (results['rows'], results['columns']) != (baseline['rows'], baseline['columns']):
+        raise Exception("The results and baseline are for rasters of different sizes.")
+    before = dict((_key(b), b['seconds']) for b in baseline['results'])
+    slower = []
+    for result in results['results']:
+        seconds = before.get(_key(result))
+        if seconds and result['seconds'] > seconds * (1.0 + tolerance):
+            slower.append((result, seconds, result['seconds'] / seconds))
+    return slower
+
+
+def _key(result):
+    return result['name'], result['data_type'], result['byte_order']
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _max_rss():
+    """ Peak resident memory of the process in bytes, where known
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _format(result):
+    return "{:<12} {:<7} {:<14} {:>9.4f} s {:>12.0f} cells/s {:>9.1f} MB/s {:>9.1f} MB peak".format(
+        result['name'], result['data_type'], result['byte_order'], result['seconds'],
+        result['cells_per_second'] or 0.0, result['mb_per_second'] or 0.0,
+        result['peak_memory'] / 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark raster reading, writing, access, "
+                                                 "algebra and filtering.")
+    parser.add_argument('--rows', type=int, default=512)
+    parser.add_argument('--columns', type=int, default=512)
+    parser.add_argument('--data-types', nargs='+', default=['float'],
+                        choices=['float', 'double', 'integer', 'byte', 'i32'])
+    parser.add_argument('--byte-orders', nargs='+', default=['LITTLE_ENDIAN'], choices=BYTE_ORDERS)
+    parser.add_argument('--benchmarks', nargs='+', choices=[name for name, _, _ in BENCHMARKS])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="file to save the results to as JSON")
+    parser.add_argument('--baseline', help="JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="fraction slower than the baseline counted as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.columns, args.data_types, args.byte_orders,
+                  args.benchmarks, args.repeat, progress=lambda result: print(_format(result)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, args.tolerance)
+        for result, seconds, ratio in slower:
+            print("Slower: {} {} {}: {:.4f} s against {:.4f} s ({:.2f}x)".format(
+                result['name'], result['data_type'], result['byte_order'],
+                result['seconds'], seconds, ratio))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
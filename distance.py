@@ -0,0 +1,160 @@
+import math
+import heapq
+from array import array
+
+from raster import D8, Array2D, cell_values, finish_output
+
+_INF = float('inf')
+
+# nodata value of back-link grids
+_LINK_NODATA = 255
+
+
+def euclidean_distance(raster, output=None):
+    """ Exact Euclidean distance from each cell to the nearest target cell,
+    the valid non-zero cells of raster, measured between cell centres with
+    resolution_x and resolution_y so that rectangular cells are allowed
+    for. Nodata cells are nodata in the result, as are all cells when there
+    are no targets. Uses the two-pass linear-time transform of
+    Felzenszwalb and Huttenlocher: distances to the nearest target in each
+    column, then the lower envelope of parabolas along each row. The result
+    is a 'float' raster, returned or, when output is a file name, written.
+    """
+    rows, columns = raster.rows, raster.columns
+    nodata = raster.nodata
+    values = cell_values(raster)
+    none = rows + columns + 1
+
+    # cells to the nearest target up or down the column, going down...
+    reach = array('i')
+    previous = [none] * columns
+    for start in range(0, rows * columns, columns):
+        previous = [0 if v != 0 and v != nodata else min(p + 1, none)
+                    for v, p in zip(values[start:start + columns], previous)]
+        reach.extend(previous)
+    # ...then up
+    below = [none] * columns
+    for start in reversed(range(0, rows * columns, columns)):
+        below = [min(g, b + 1) for g, b in zip(reach[start:start + columns], below)]
+        reach[start:start + columns] = array('i', below)
+
+    result = raster._new_like('float')
+    spacing = raster.resolution_x
+    for start in range(0, rows * columns, columns):
+        squared = [_INF if g >= none else (g * raster.resolution_y) ** 2
+                   for g in reach[start:start + columns]]
+        distances = _lower_envelope(squared, spacing)
+        result._values.extend([nodata if v == nodata or d == _INF else math.sqrt(d)
+                               for v, d in zip(values[start:start + columns], distances)])
+    return finish_output(result, output)
+
+
+def cost_distance(sources, cost):
+    """ Least accumulated cost of travelling from the nearest source, the
+    valid non-zero cells of sources, to each cell across a cost surface,
+    by Dijkstra's algorithm with a binary heap over flat cell indices.
+    Moving between neighbouring cells costs the distance between their
+    centres times the mean of their costs; nodata and negative cost cells
+    are barriers. Returns (distance, links) as Array2D grids: the float64
+    accumulated costs, and the uint8 D8 pointer (in Whitebox order) of the
+    neighbour each cell is reached from, 0 at the sources. Cells that are
+    barriers or cannot be reached are nodata in both, which for links is
+    255.
+    """
+    rows, columns = cost.rows, cost.columns
+    if (sources.rows, sources.columns) != (rows, columns):
+        raise Exception("The sources and costs must have the same dimensions.")
+    c = cell_values(cost)
+    s = cell_values(sources)
+    cost_nodata = cost.nodata
+    source_nodata = sources.nodata
+
+    distance = Array2D.create(rows, columns, cost_nodata, _INF, dtype='float64')
+    links = Array2D.create(rows, columns, _LINK_NODATA, dtype='uint8')
+    d = distance._values
+    b = links._values
+
+    heap = []
+    for i in range(rows * columns):
+        if s[i] != 0 and s[i] != source_nodata and c[i] != cost_nodata and c[i] >= 0.0:
+            d[i] = 0.0
+            b[i] = 0
+            heap.append((0.0, i))
+    heapq.heapify(heap)
+
+    # for each move: index offset, row and column offsets, length, and the
+    # pointer leading back from the cell moved to
+    pointers = dict(((dy, dx), pointer) for pointer, dy, dx in D8)
+    moves = [(dy * columns + dx, dy, dx,
+              math.hypot(dy * cost.resolution_y, dx * cost.resolution_x),
+              pointers[-dy, -dx]) for _, dy, dx in D8]
+    interior = [(offset, length, back) for offset, _, _, length, back in moves]
+
+    while heap:
+        dc, i = heapq.heappop(heap)
+        if dc > d[i]:
+            continue
+        half = c[i] / 2.0
+        row, column = divmod(i, columns)
+        if 0 < row < rows - 1 and 0 < column < columns - 1:
+            steps = interior
+        else:
+            steps = [(offset, length, back) for offset, dy, dx, length, back in moves
+                     if 0 <= row + dy < rows and 0 <= column + dx < columns]
+        for offset, length, back in steps:
+            n = i + offset
+            cn = c[n]
+            if cn == cost_nodata or cn < 0.0:
+                continue
+            dn = dc + length * (half + cn / 2.0)
+            if dn < d[n]:
+                d[n] = dn
+                b[n] = back
+                heapq.heappush(heap, (dn, n))
+
+    for i in range(rows * columns):
+        if d[i] == _INF:
+            d[i] = cost_nodata
+    return distance, links
+
+
+def _lower_envelope(squared, spacing):
+    """ For each position p along a row, the least squared[q] + ((p - q) *
+    spacing) ** 2 over all q, from the lower envelope of those parabolas
+    """
+    n = len(squared)
+    vertices = [0] * n
+    bounds = [0.0] * (n + 1)
+    k = -1
+    for q in range(n):
+        fq = squared[q]
+        if fq == _INF:
+            continue
+        xq = q * spacing
+        while True:
+            if k < 0:
+                s = -_INF
+                break
+            r = vertices[k]
+            xr = r * spacing
+            s = ((fq + xq * xq) - (squared[r] + xr * xr)) / (2.0 * (xq - xr))
+            if s <= bounds[k]:
+                k -= 1
+            else:
+                break
+        k += 1
+        vertices[k] = q
+        bounds[k] = s
+        bounds[k + 1] = _INF
+    if k < 0:
+        return [_INF] * n
+
+    result = []
+    k = 0
+    for p in range(n):
+        xp = p * spacing
+        while bounds[k + 1] < xp:
+            k += 1
+        r = vertices[k]
+        result.append((xp - r * spacing) ** 2 + squared[r])
+    return result
@@ -0,0 +1,24 @@
+import atexit, shutil, tempfile
+from raster import Raster
+
+def make_raster(rows, columns, cell, nodata=-32768.0, data_type='float', cell_size=(1.0, 1.0),
+                origin=(0.0, 0.0)):
+    """An in-memory raster with no file, of rows x columns cells of cell_size (x, y)
+    with its south-west corner at origin (x, y), holding cell(row, col) in each cell
+    """
+    r = Raster.create(None, rows, columns, nodata, data_type=data_type)
+    r.resolution_x, r.resolution_y = cell_size
+    r.west, r.south = origin
+    r.east = r.west + columns * r.resolution_x
+    r.north = r.south + rows * r.resolution_y
+    for row in range(rows):
+        for col in range(columns):
+            r[row, col] = cell(row, col)
+    return r
+
+def temporary_directory():
+    """A new directory for test output, removed when the tests finish
+    """
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, True)
+    return directory
@@ -0,0 +1,273 @@
+import operator
+from array import array
+from bisect import bisect_left, insort
+from itertools import accumulate
+
+from raster import open_output, data_typecode
+
+_NAN = float('nan')
+_INF = float('inf')
+
+STATISTICS = ('mean', 'sum', 'count', 'std', 'min', 'max', 'range', 'median')
+
+
+def focal_statistics(raster, statistic='mean', size=3, output=None, block_rows=256):
+    """ Moving-window statistic over a size x size neighbourhood. The
+    statistic is one of STATISTICS. Nodata cells and cells beyond the edges
+    are left out of each window, and nodata cells stay nodata. Mean, sum,
+    count and std use running window sums, and min, max and range use the
+    van Herk/Gil-Werman algorithm, so their cost per cell does not depend
+    on size. The result is returned as a new Raster or, when output is a
+    file name, streamed to that file.
+    """
+    if statistic not in STATISTICS:
+        raise Exception("Unknown statistic '{}'.".format(statistic))
+    radius = _radius(size)
+
+    def kernel(rows, first, count):
+        if statistic in ('mean', 'sum', 'count', 'std'):
+            return _window_moments(rows, first, count, radius, radius, statistic)
+        if statistic == 'median':
+            return _window_median(rows, first, count, radius)
+        return _window_extremes(rows, first, count, radius, statistic)
+
+    return _run(raster, kernel, radius, radius, output, block_rows)
+
+
+def focal_kernel(raster, kernel, normalize=True, output=None, block_rows=256):
+    """ Convolve raster with a user-supplied kernel, given as a list of rows
+    of weights with odd dimensions. With normalize, each result is divided
+    by the sum of the weights of the valid cells in its window, so nodata
+    and edges are handled as if they were not part of the kernel.
+    """
+    radius_y = _radius(len(kernel))
+    radius_x = _radius(len(kernel[0]))
+    weights = [(dy, dx, w) for dy, kernel_row in enumerate(kernel)
+               for dx, w in enumerate(kernel_row) if w != 0]
+
+    def convolve(rows, first, count):
+        n = len(rows[0]) - 2 * radius_x
+        values = []
+        for i in range(first, first + count):
+            total = [0.0] * n
+            weight = [0.0] * n
+            for dy, dx, w in weights:
+                window = rows[i - radius_y + dy][dx:dx + n]
+                total = [t + w * z if z == z else t for t, z in zip(total, window)]
+                if normalize:
+                    weight = [s + w if z == z else s for s, z in zip(weight, window)]
+            if normalize:
+                total = [t / s if s else _NAN for t, s in zip(total, weight)]
+            values.extend(_mask_centre(total, rows[i], radius_x))
+        return values
+
+    return _run(raster, convolve, radius_y, radius_x, output, block_rows)
+
+
+def edge_preserving_filter(raster, size=7, threshold=10.0, output=None, block_rows=256):
+    """ Edge-preserving smoothing filter. Each neighbour within threshold of
+    the centre cell is weighted by 1 - difference / threshold and the cell
+    becomes the weighted mean of its neighbourhood; neighbours that differ
+    by threshold or more are ignored.
+    """
+    radius = _radius(size)
+    inverse = 1.0 / threshold
+
+    def smooth(rows, first, count):
+        n = len(rows[0]) - 2 * radius
+        values = []
+        for i in range(first, first + count):
+            centre = rows[i][radius:radius + n]
+            sum_w = [0.0] * n
+            sum_zw = [0.0] * n
+            for yn in range(i - radius, i + radius + 1):
+                for dx in range(size):
+                    window = rows[yn][dx:dx + n]
+                    # NaN neighbours give max(0.0, NaN) == 0.0, i.e. no weight
+                    w = [max(0.0, 1.0 - abs(zn - z) * inverse)
+                         for zn, z in zip(window, centre)]
+                    sum_w = list(map(operator.add, sum_w, w))
+                    sum_zw = [s + (wn and zn * wn)
+                              for s, wn, zn in zip(sum_zw, w, window)]
+            values.extend(_mask_centre(
+                [s / w if w else _NAN for s, w in zip(sum_zw, sum_w)], rows[i], radius))
+        return values
+
+    return _run(raster, smooth, radius, radius, output, block_rows)
+
+
+def _radius(size):
+    if size < 1 or size % 2 == 0:
+        raise Exception("Filter dimensions must be odd and positive.")
+    return size // 2
+
+
+def _run(raster, kernel, radius_y, radius_x, output, block_rows):
+    """ Apply kernel to each band of rows of raster. The kernel receives the
+    band as lists of values with NaN for nodata and radius_x NaN columns of
+    padding on either side, plus the index and count of the rows to filter,
+    and returns the filtered values of those rows with NaN for nodata.
+    """
+    data_type = 'double' if raster.data_type.lower() == 'double' else 'float'
+    typecode = data_typecode(data_type)
+    nodata = raster.nodata
+    padding = [_NAN] * radius_x
+    with open_output(output, raster, data_type) as writer:
+        for first_row, last_row, block in raster.iter_blocks(block_rows, radius_y):
+            rows = []
+            for row in range(block.rows):
+                values = block._values[row * block.columns:(row + 1) * block.columns]
+                rows.append(padding + [_NAN if z == nodata else z for z in values] + padding)
+
+            values = [nodata if z != z else z for z in kernel(
+                rows, radius_y, last_row - first_row)]
+            writer.write_rows(array(typecode, values), last_row - first_row)
+
+    if output is None:
+        return writer.raster
+
+
+def _mask_centre(values, row, radius):
+    """ Set results to NaN wherever the centre cell is NaN
+    """
+    return [_NAN if z != z else v for v, z in zip(values, row[radius:len(row) - radius])]
+
+
+def _window_moments(rows, first, count, radius_y, radius_x, statistic):
+    """ Window count, sum, mean or std from running row and column sums
+    """
+    k = 2 * radius_x + 1
+    n = len(rows[0]) - 2 * radius_x
+    ones = [[1.0 if z == z else 0.0 for z in row] for row in rows]
+
+    # values are shifted by a typical value before squaring, which keeps the
+    # variance from being lost to rounding when the mean is large
+    shift = 0.0
+    for row in rows:
+        for z in row:
+            if z == z:
+                shift = z
+                break
+        else:
+            continue
+        break
+    zeros = [[z - shift if z == z else 0.0 for z in row] for row in rows]
+    squares = [[z * z for z in row] for row in zeros]
+
+    def window_sums(grid):
+        # sum over the window rows, updated as the window moves down...
+        column_sums = [sum(column) for column in zip(*grid[first - radius_y:first + radius_y + 1])]
+        sums = []
+        for i in range(first, first + count):
+            if i > first:
+                column_sums = [s + a - b for s, a, b in zip(
+                    column_sums, grid[i + radius_y], grid[i - radius_y - 1])]
+            # ...then across the window columns with a prefix sum
+            prefix = [0.0] + list(accumulate(column_sums))
+            sums.append(list(map(operator.sub, prefix[k:], prefix[:-k])))
+        return sums
+
+    counts = window_sums(ones)
+    values = []
+    if statistic == 'count':
+        for i, c in enumerate(counts):
+            values.extend(_mask_centre(c, rows[first + i], radius_x))
+        return values
+
+    totals = window_sums(zeros)
+    if statistic == 'std':
+        totals_sq = window_sums(squares)
+    for i in range(count):
+        c, t = counts[i], totals[i]
+        if statistic == 'sum':
+            v = [s + shift * m if m else _NAN for s, m in zip(t, c)]
+        elif statistic == 'mean':
+            v = [s / m + shift if m else _NAN for s, m in zip(t, c)]
+        else:
+            v = [max(0.0, q / m - (s / m) ** 2) ** 0.5 if m else _NAN
+                 for s, q, m in zip(t, totals_sq[i], c)]
+        values.extend(_mask_centre(v, rows[first + i], radius_x))
+    return values
+
+
+def _sliding(sequence, k, func):
+    """ func (min or max) over each window of k items, by van Herk/Gil-Werman
+    """
+    prefix = []
+    suffix = []
+    for start in range(0, len(sequence), k):
+        chunk = sequence[start:start + k]
+        prefix.extend(accumulate(chunk, func))
+        suffix.extend(reversed(list(accumulate(reversed(chunk), func))))
+    return list(map(func, suffix[:len(sequence) - k + 1], prefix[k - 1:]))
+
+
+def _sliding_rows(rows, k, func):
+    """ Element-wise func (min or max) over each run of k rows
+    """
+    prefix = []
+    suffix = []
+    for start in range(0, len(rows), k):
+        chunk = rows[start:start + k]
+        running = chunk[0]
+        for row in chunk:
+            running = list(map(func, running, row))
+            prefix.append(running)
+        running = chunk[-1]
+        reverse = []
+        for row in reversed(chunk):
+            running = list(map(func, running, row))
+            reverse.append(running)
+        suffix.extend(reversed(reverse))
+    return [list(map(func, suffix[i], prefix[i + k - 1]))
+            for i in range(len(rows) - k + 1)]
+
+
+def _window_extremes(rows, first, count, radius, statistic):
+    """ Window min, max or range in O(1) per cell
+    """
+    k = 2 * radius + 1
+    band = rows[first - radius:first + count + radius]
+    results = {}
+    for func, empty in ((min, _INF), (max, -_INF)):
+        if statistic in (func.__name__, 'range'):
+            filled = [[z if z == z else empty for z in row] for row in band]
+            horizontal = [_sliding(row, k, func) for row in filled]
+            results[func.__name__] = _sliding_rows(horizontal, k, func)
+
+    values = []
+    for i in range(count):
+        if statistic == 'range':
+            v = [b - a if a != _INF else _NAN
+                 for a, b in zip(results['min'][i], results['max'][i])]
+        else:
+            v = [z if abs(z) != _INF else _NAN for z in results[statistic][i]]
+        values.extend(_mask_centre(v, rows[first + i], radius))
+    return values
+
+
+def _window_median(rows, first, count, radius):
+    """ Window median, from a sorted window updated as it slides across
+    """
+    k = 2 * radius + 1
+    values = []
+    for i in range(first, first + count):
+        columns = [[z for z in column if z == z]
+                   for column in zip(*rows[i - radius:i + radius + 1])]
+        window = sorted(z for column in columns[:k] for z in column)
+        medians = []
+        for x in range(len(columns) - k + 1):
+            if x > 0:
+                for z in columns[x - 1]:
+                    del window[bisect_left(window, z)]
+                for z in columns[x + k - 1]:
+                    insort(window, z)
+            m = len(window)
+            if m == 0:
+                medians.append(_NAN)
+            elif m % 2:
+                medians.append(window[m // 2])
+            else:
+                medians.append((window[m // 2 - 1] + window[m // 2]) / 2.0)
+        values.extend(_mask_centre(medians, rows[i], radius))
+    return values
@@ -0,0 +1,240 @@
+import math
+import heapq
+import struct
+from array import array
+from collections import deque
+
+from raster import (D8, Array2D, as_array, cell_values, convert_values, data_typecode,
+                    finish_output, open_output)
+
+_INF = float('inf')
+_NAN = float('nan')
+
+# nodata value of pointer rasters
+_POINTER_NODATA = -32768.0
+
+# backlink of cells that drain straight out of the raster
+_OUTLET = 255
+
+
+def fill_depressions(dem, epsilon=0.0, breach=False, output=None):
+    """ Remove the depressions of a DEM by Priority-Flood (Barnes et al.,
+    2014). Cells are visited inwards from the outlets, the raster edges and
+    nodata cells, in order of elevation, so each cell is reached over its
+    lowest spill point and cells below it are raised to it. A positive
+    epsilon raises them to above it instead, by epsilon per cell (and at
+    least one step of the output precision), leaving no flats so that
+    every cell drains. With breach a channel is cut from each depression
+    cell back to its outlet instead, lowering the cells on the way. Runs
+    in O(n log n) for n cells. The result is a 'float' raster, or 'double'
+    for a double DEM, returned or, when output is a file name, written.
+    """
+    data_type = 'double' if dem.data_type.lower() == 'double' else 'float'
+    typecode = data_typecode(data_type)
+    rows, columns = dem.rows, dem.columns
+    nodata = dem.nodata
+    values = cell_values(dem)
+    z = convert_values(as_array(values[0:len(values)]), typecode)
+
+    closed = Array2D.create(rows, columns, 0, dtype='uint8')._values
+    if breach:
+        links = Array2D.create(rows, columns, _OUTLET, dtype='uint8')._values
+    offsets = [dy * columns + dx for _, dy, dx in D8]
+    directions = list(enumerate(offsets))
+
+    # nodata cells drain everything next to them, and edge cells drain out
+    pit = deque()
+    for i in range(rows * columns):
+        if z[i] == nodata:
+            closed[i] = 1
+            pit.append(i)
+    heap = []
+    for i in _edge_cells(rows, columns):
+        if not closed[i]:
+            closed[i] = 1
+            heap.append((z[i], i))
+    heapq.heapify(heap)
+
+    while pit or heap:
+        if pit:
+            c = pit.popleft()
+            zc = z[c]
+            if zc == nodata:
+                zc = -_INF
+        else:
+            zc, c = heapq.heappop(heap)
+
+        row, column = divmod(c, columns)
+        if 0 < row < rows - 1 and 0 < column < columns - 1:
+            neighbours = directions
+        else:
+            neighbours = _edge_directions(row, column, rows, columns, offsets)
+        for k, offset in neighbours:
+            n = c + offset
+            if closed[n]:
+                continue
+            closed[n] = 1
+            zn = z[n]
+            if zn == nodata:
+                pit.append(n)
+            elif zn > zc:
+                heapq.heappush(heap, (zn, n))
+                if breach and zc != -_INF:
+                    links[n] = k
+            elif breach:
+                # lower the path from c back to its outlet below n
+                p = c
+                target = zn
+                while True:
+                    target = _step(target, epsilon, typecode, down=True)
+                    if z[p] <= target:
+                        break
+                    z[p] = target
+                    if links[p] == _OUTLET:
+                        break
+                    p -= offsets[links[p]]
+                links[n] = k
+                heapq.heappush(heap, (zn, n))
+            else:
+                z[n] = _step(zc, epsilon, typecode) if epsilon > 0.0 else zc
+                pit.append(n)
+
+    result = dem._new_like(data_type)
+    result._values = z
+    return finish_output(result, output)
+
+
+def flow_direction(dem, output=None, block_rows=256):
+    """ D8 flow pointers of a DEM: each cell points to its neighbour of
+    steepest descent, allowing for the cell size and the longer diagonals,
+    as the Whitebox pointer values 1 (north-east), 2 (east), 4, 8, 16, 32,
+    64 and 128 (north) clockwise. Cells with no lower neighbour, such as
+    pits and flats, get 0; fill the DEM with a positive epsilon first to
+    route flow across them. The pointers are an 'integer' raster, built
+    a band of block_rows rows at a time, and are returned or, when output
+    is a file name, streamed to it.
+    """
+    columns = dem.columns
+    nodata = dem.nodata
+    nodata_pointer = int(_POINTER_NODATA)
+    lengths = {(0, 1): dem.resolution_x, (1, 0): dem.resolution_y,
+               (1, 1): math.hypot(dem.resolution_x, dem.resolution_y)}
+
+    with open_output(output, dem, 'integer', _POINTER_NODATA) as writer:
+        for first_row, last_row, block in dem.iter_blocks(block_rows, 1):
+            padded = [[_NAN] + [_NAN if v == nodata else v for v in
+                                block._values[r * columns:(r + 1) * columns]] + [_NAN]
+                      for r in range(block.rows)]
+            values = array('h')
+            for r in range(1, block.rows - 1):
+                centre = padded[r][1:columns + 1]
+                steepest = [0.0] * columns
+                pointers = [0] * columns
+                for pointer, dy, dx in D8:
+                    distance = lengths[abs(dy), abs(dx)]
+                    neighbours = padded[r + dy][1 + dx:1 + dx + columns]
+                    # NaN drops, at nodata or beyond the edges, never win
+                    drops = [(a - b) / distance for a, b in zip(centre, neighbours)]
+                    pointers = [pointer if d > s else p
+                                for d, s, p in zip(drops, steepest, pointers)]
+                    steepest = [d if d > s else s for d, s in zip(drops, steepest)]
+                values.extend([p if a == a else nodata_pointer for p, a in zip(pointers, centre)])
+
+            writer.write_rows(values, last_row - first_row)
+
+    if output is None:
+        return writer.raster
+
+
+def flow_accumulation(pointers, out_type='cells', output=None):
+    """ D8 flow accumulation from a pointer raster made by flow_direction:
+    the number of cells draining through each cell, itself included, or
+    for out_type 'area' their area and for 'sca' that area per unit of
+    contour width (the cell size). Cells are visited in topological order,
+    from the ridges down, using a queue of cells whose upslope cells are
+    all done, in O(n). The result is a 'double' raster, returned or, when
+    output is a file name, written.
+    """
+    if out_type not in ('cells', 'area', 'sca'):
+        raise Exception("Unknown output type '{}'.".format(out_type))
+    rows, columns = pointers.rows, pointers.columns
+    p = cell_values(pointers)
+    nodata = pointers.nodata
+    targets = dict((pointer, (dy * columns + dx, dy, dx)) for pointer, dy, dx in D8)
+
+    def downslope(i):
+        """ The cell i drains to, or -1 """
+        target = targets.get(p[i])
+        if target is None:
+            return -1
+        offset, dy, dx = target
+        row, column = divmod(i, columns)
+        if not (0 <= row + dy < rows and 0 <= column + dx < columns):
+            return -1
+        n = i + offset
+        return -1 if p[n] == nodata else n
+
+    # count the cells draining into each cell
+    inflows = Array2D.create(rows, columns, 0, dtype='uint8')._values
+    for i in range(rows * columns):
+        if p[i] != nodata:
+            n = downslope(i)
+            if n >= 0:
+                inflows[n] += 1
+
+    accumulation = array('d', [1.0]) * (rows * columns)
+    queue = deque(i for i in range(rows * columns) if inflows[i] == 0 and p[i] != nodata)
+    while queue:
+        i = queue.popleft()
+        n = downslope(i)
+        if n >= 0:
+            accumulation[n] += accumulation[i]
+            inflows[n] -= 1
+            if inflows[n] == 0:
+                queue.append(n)
+
+    scale = 1.0
+    if out_type != 'cells':
+        scale = pointers.resolution_x * pointers.resolution_y
+        if out_type == 'sca':
+            scale /= pointers.resolution_x
+    for i in range(rows * columns):
+        accumulation[i] = nodata if p[i] == nodata else accumulation[i] * scale
+
+    result = pointers._new_like('double')
+    result._values = accumulation
+    return finish_output(result, output)
+
+
+def _edge_cells(rows, columns):
+    for column in range(columns):
+        yield column
+        yield (rows - 1) * columns + column
+    for row in range(1, rows - 1):
+        yield row * columns
+        yield row * columns + columns - 1
+
+
+def _edge_directions(row, column, rows, columns, offsets):
+    """ (direction, index offset) of the neighbours of a cell on the edge
+    """
+    return [(k, offsets[k]) for k, (_, dy, dx) in enumerate(D8)
+            if 0 <= row + dy < rows and 0 <= column + dx < columns]
+
+
+def _step(value, epsilon, typecode, down=False):
+    """ value plus epsilon (or minus it, going down) as stored in an array
+    of typecode, moved on to the next storable value when that does not
+    differ from value
+    """
+    stored = array(typecode, [value - epsilon if down else value + epsilon])[0]
+    if stored != value:
+        return stored
+    float_format, int_format = ('<f', '<i') if typecode == 'f' else ('<d', '<q')
+    if value == 0.0:
+        smallest = struct.unpack(float_format, struct.pack(int_format, 1))[0]
+        return -smallest if down else smallest
+    # the magnitude of a float grows with its bits
+    bits = struct.unpack(int_format, struct.pack(float_format, value))[0]
+    bits += 1 if down == (value < 0.0) else -1
+    return struct.unpack(float_format, struct.pack(int_format, bits))[0]
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from raster import Raster, as_array, convert_values, filled_array, data_typecode, buffer_typecode
+
+
+def map_blocks(func, raster, output=None, halo=0, block_rows=256, workers=None,
+               executor='process', data_type=None):
+    """ Apply func to raster in tiles of block_rows rows, in parallel.
+
+    func receives each tile as a Raster window with halo extra rows above and
+    below (as made by Raster.iter_blocks) and returns a Raster, Array2D or
+    sequence of values of the same shape; only the tile's own rows are kept.
+    Cell-wise functions therefore need no halo, and a focal operation of
+    size n needs a halo of n // 2, e.g.
+
+        map_blocks(functools.partial(focal.focal_statistics, size=7), raster, halo=3)
+
+    With the 'process' executor tiles are exchanged through memory-mapped
+    .tas files rather than pickled: workers map the input (the raster's own
+    file when it is unloaded or mapped read-only, otherwise a temporary copy)
+    and write their rows straight into the mapped output, so func must be
+    picklable. With the 'thread' executor tiles are read from and written to
+    memory directly. The result is returned as a new Raster or, when output
+    is a file name, written to that file.
+    """
+    if executor not in ('process', 'thread'):
+        raise Exception("Unknown executor '{}'.".format(executor))
+    if data_type is None:
+        data_type = 'double' if raster.data_type.lower() == 'double' else 'float'
+    tiles = [(first_row, min(first_row + block_rows, raster.rows))
+             for first_row in range(0, raster.rows, block_rows)]
+
+    if executor == 'thread':
+        target = raster._new_like(data_type)
+        target._values = filled_array(data_typecode(data_type),
+                                 target.nodata, target.rows * target.columns)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_tile, func, raster, target, first_row, last_row, halo)
+                       for first_row, last_row in tiles]
+            for future in futures:
+                future.result()
+        if output is not None:
+            target._set_filenames(output)
+            target.write()
+            return None
+        return target
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        if raster.driver.can_map and (raster._values is None or raster._map_mode == 'r'):
+            input_file = raster.header_filename
+        else:
+            input_file = os.path.join(temp_dir, 'input.dep')
+            source = raster._new_like(raster.data_type)
+            source._values = raster._values
+            if source._values is None:
+                source._values = raster.read_window(0, 0, raster.rows, raster.columns)._values
+            source._set_filenames(input_file)
+            source.write()
+
+        # workers map the output, so formats that cannot be mapped are
+        # written through a temporary .dep file
+        target = raster._new_like(data_type)
+        mapped = output is not None
+        if mapped:
+            target._set_filenames(output)
+            mapped = target.driver.can_map
+        if not mapped:
+            target._set_filenames(os.path.join(temp_dir, 'output.dep'))
+        output_file = target.header_filename
+        target.minimum = target.maximum = 0.0
+        target._write_header()
+        with open(target.data_filename, "wb") as binary_file:
+            binary_file.truncate(target.rows * target.columns *
+                                 array(data_typecode(data_type)).itemsize)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_file_tile, func, input_file, output_file,
+                                   first_row, last_row, halo)
+                       for first_row, last_row in tiles]
+            for future in futures:
+                future.result()
+
+        # the statistics of the header are only known now
+        result = Raster.from_file(output_file, mmap=mapped)
+        result.minimum = float("inf")
+        result.maximum = float("-inf")
+        result.display_minimum = float("inf")
+        result.display_maximum = float("-inf")
+        if mapped:
+            result.calculate_min_and_max()
+            result._write_header()
+            result.close()
+            return None
+        if output is not None:
+            result._set_filenames(output)
+            result.write()
+            return None
+
+        result.header_filename = None
+        result.data_filename = None
+        return result
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _run_file_tile(func, input_file, output_file, first_row, last_row, halo):
+    """ Process one tile in a worker process, through mapped files
+    """
+    source = Raster.from_file(input_file, mmap=True)
+    target = Raster.from_file(output_file, mmap=True, mode='r+')
+    try:
+        _run_tile(func, source, target, first_row, last_row, halo)
+    finally:
+        source.close()
+        target.close()
+
+
+def _run_tile(func, source, target, first_row, last_row, halo):
+    """ Apply func to rows first_row to last_row of source, plus halo rows,
+    and store its result for those rows in target
+    """
+    block = source.read_window(first_row - halo, 0,
+                               last_row - first_row + 2 * halo, source.columns)
+    result = func(block)
+    values = getattr(result, '_values', result)
+
+    start = halo * source.columns
+    stop = start + (last_row - first_row) * source.columns
+    values = values[start:stop]
+    if isinstance(values, (list, tuple)):
+        values = array('d', values)
+    target._values[first_row * source.columns:last_row * source.columns] = convert_values(
+        as_array(values), buffer_typecode(target._values))
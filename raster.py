@@ -1,117 +1,1645 @@
 import os
+import sys
+import json
+import mmap
+import zlib
 import struct
 import math
+import time
+import logging
+import operator
+import functools
+import threading
+import numbers
+import itertools
+import contextlib
+from array import array
+from collections import Counter, OrderedDict
+
+# array.array typecodes used to store the pixels of each Whitebox data type
+_TYPECODES = {
+    'float': 'f',
+    'double': 'd',
+    'integer': 'h',
+    'byte': 'B',
+    'i32': 'i',
+}
+
+_INTEGER_TYPECODES = 'bBhHiIlLqQ'
+
+# array.array typecodes of the Array2D dtypes
+_DTYPES = {
+    'uint8': 'B',
+    'int8': 'b',
+    'uint16': 'H',
+    'int16': 'h',
+    'int32': 'i',
+    'uint32': 'I',
+    'int64': 'q',
+    'float32': 'f',
+    'float64': 'd',
+}
+
+# .dep header keys, with the Raster attribute and the parser for each
+_HEADER_FIELDS = {
+    'min': ('minimum', float),
+    'max': ('maximum', float),
+    'display min': ('display_minimum', float),
+    'display max': ('display_maximum', float),
+    'north': ('north', float),
+    'south': ('south', float),
+    'east': ('east', float),
+    'west': ('west', float),
+    'rows': ('rows', int),
+    'cols': ('columns', int),
+    'stacks': ('stacks', int),
+    'data type': ('data_type', str.lower),
+    'z units': ('z_units', str),
+    'xy units': ('xy_units', str),
+    'projection': ('projection', str),
+    'data scale': ('data_scale', str.lower),
+    'preferred palette': ('palette', str),
+    'nodata': ('nodata', float),
+    'byte order': ('byte_order', str.lower),
+    'palette nonlinearity': ('palette_nonlinearity', float),
+    'interleave': ('interleave', str.lower),
+}
+
+# characters of an ESRI ASCII grid body tokenized at a time
+_ASCII_CHUNK_CHARACTERS = 1 << 22
+
+# number of cells encoded per chunk when data must be converted on write
+_CHUNK_CELLS = 1 << 18
+
+_NAN = float('nan')
+_INF = float('inf')
+
+# D8 flow pointers as Whitebox encodes them, clockwise from north-east, with
+# the row and column offsets of the cell each points to
+D8 = ((1, -1, 1), (2, 0, 1), (4, 1, 1), (8, 1, 0),
+      (16, 1, -1), (32, 0, -1), (64, -1, -1), (128, -1, 0))
+
+_logger = logging.getLogger(__name__)
+
+# callables given an OperationRecord after each instrumented operation; while
+# there are none, instrumented calls cost only the check that there are none
+_HOOKS = []
+
+# per-thread nesting depth of instrumented calls
+_local = threading.local()
+
+
+def data_typecode(data_type):
+    """ Find the array typecode used to store a data type
+    """
+    try:
+        return _TYPECODES[data_type.lower()]
+    except KeyError:
+        raise Exception("Unknown data type")
+
+
+def _is_little_endian(byte_order):
+    """ Whether a header byte order string denotes little-endian data
+    """
+    return any(s in byte_order.lower() for s in ("little_endian", "least", "lsb", "little"))
+
+
+def _needs_byteswap(byte_order):
+    """ Whether data in byte_order differs from the native byte order
+    """
+    return _is_little_endian(byte_order) != (sys.byteorder == 'little')
+
+
+def _storage_value(typecode, value):
+    """ Convert a value so that it can be stored in an array of typecode
+    """
+    if typecode in _INTEGER_TYPECODES:
+        return int(round(value))
+    return float(value)
+
+
+def _integer_range(typecode):
+    """ The smallest and largest values of an integer typecode
+    """
+    bits = 8 * array(typecode).itemsize
+    if typecode.isupper():
+        return 0, 2 ** bits - 1
+    return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+
+def filled_array(typecode, value, count):
+    """ Create a typed array of count cells all set to value
+    """
+    try:
+        return array(typecode, [_storage_value(typecode, value)]) * count
+    except OverflowError:
+        raise Exception(
+            "Value {} cannot be stored in this data type.".format(value))
+
+
+def _truediv(x, y):
+    return x / y if y else _NAN
+
+
+def _pow(x, y):
+    try:
+        return math.pow(x, y)
+    except (ValueError, OverflowError):
+        return _NAN
+
+
+def _sqrt(x):
+    return math.sqrt(x) if x >= 0 else _NAN
+
+
+def _log(x):
+    return math.log(x) if x > 0 else _NAN
+
+
+def _write_values(binary_file, values, data_type, byte_order):
+    """ Encode typed pixel values to an open binary file. Values are written
+    in chunks of _CHUNK_CELLS so that at most one chunk is ever copied.
+    """
+    typecode = data_typecode(data_type)
+    swap = _needs_byteswap(byte_order)
+    if buffer_typecode(values) == typecode and not swap and _is_contiguous(values):
+        binary_file.write(values)
+        return
+
+    for start in range(0, len(values), _CHUNK_CELLS):
+        chunk = convert_values(
+            as_array(values[start:start + _CHUNK_CELLS]), typecode)
+        if swap:
+            chunk.byteswap()
+        chunk.tofile(binary_file)
+
+
+def convert_values(values, typecode):
+    """ An array of typecode holding values, which is returned unchanged
+    when it already is one
+    """
+    if values.typecode == typecode:
+        return values
+    if typecode in _INTEGER_TYPECODES:
+        return array(typecode, [int(round(v)) for v in values])
+    return array(typecode, values)
+
+
+def buffer_typecode(values):
+    """ Typecode of a pixel buffer (an array, memoryview or _SwappedValues)
+    """
+    if isinstance(values, memoryview):
+        return values.format
+    return values.typecode
+
+
+def as_array(values):
+    """ Copy a slice of a pixel buffer into an array, if it is not one already
+    """
+    if isinstance(values, array):
+        return values
+    result = array(buffer_typecode(values))
+    result.frombytes(values.cast('B') if values.c_contiguous else values.tobytes())
+    return result
+
+
+def _is_contiguous(values):
+    """ Whether a pixel buffer can be written out as it is
+    """
+    if isinstance(values, memoryview):
+        return values.c_contiguous
+    return isinstance(values, array)
+
+
+class _SwappedValues(object):
+    """ Typed access to a buffer holding values in non-native byte order.
+    Cells are decoded and encoded on demand; slices return native arrays.
+    """
+
+    def __init__(self, buffer, typecode):
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self._buffer = buffer
+        self._struct = struct.Struct(
+            ('>' if sys.byteorder == 'little' else '<') + typecode)
+
+    def __len__(self):
+        return len(self._buffer) // self.itemsize
+
+    def __iter__(self):
+        for start in range(0, len(self), _CHUNK_CELLS):
+            for value in self[start:start + _CHUNK_CELLS]:
+                yield value
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(len(self))
+            values = array(self.typecode)
+            values.frombytes(
+                self._buffer[start * self.itemsize:max(start, stop) * self.itemsize])
+            values.byteswap()
+            return values
+        if index < 0:
+            index += len(self)
+        return self._struct.unpack_from(self._buffer, index * self.itemsize)[0]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(len(self))
+            values = array(self.typecode, value)
+            values.byteswap()
+            self._buffer[start * self.itemsize:stop * self.itemsize] = values.tobytes()
+            return
+        if index < 0:
+            index += len(self)
+        self._struct.pack_into(self._buffer, index * self.itemsize,
+                               _storage_value(self.typecode, value))
+
+    def release(self):
+        self._buffer.release()
+
+
+def _ascii_header(r):
+    """ ESRI ASCII grid header for raster r
+    """
+    lines = ["ncols         {}".format(r.columns),
+             "nrows         {}".format(r.rows),
+             "xllcorner     {}".format(r.west),
+             "yllcorner     {}".format(r.south)]
+    if r.resolution_x == r.resolution_y:
+        lines.append("cellsize      {}".format(r.resolution_x))
+    else:
+        lines.append("dx            {}".format(r.resolution_x))
+        lines.append("dy            {}".format(r.resolution_y))
+    lines.append("NODATA_value  {}".format(r.nodata))
+    return '\n'.join(lines) + '\n'
+
+
+def _ascii_rows(values, columns):
+    """ Text of whole rows of values, one line per row
+    """
+    text = [' '.join(map(repr, values[i:i + columns]))
+            for i in range(0, len(values), columns)]
+    return '\n'.join(text) + '\n' if text else ''
+
+
+def _aggregate_rows(rows, factor, func, padding):
+    """ Combine each factor x factor group of cells of a list of rows with
+    func (operator.add or max), padding partial groups at the edges
+    """
+    result = []
+    for i in range(0, len(rows), factor):
+        combined = None
+        for row in rows[i:i + factor]:
+            row = row + [padding] * (-len(row) % factor)
+            across = row[0::factor]
+            for k in range(1, factor):
+                across = list(map(func, across, row[k::factor]))
+            combined = across if combined is None else list(map(func, combined, across))
+        result.append(combined)
+    return result
+
+
+def _nearest_rows(rows, factor):
+    """ The cell nearest the centre of each factor x factor group of cells
+    of a list of rows, taking the last row or column of partial groups
+    """
+    result = []
+    for i in range(0, len(rows), factor):
+        row = rows[min(i + factor // 2, len(rows) - 1)]
+        picked = list(row[factor // 2::factor])
+        if len(picked) < -(-len(row) // factor):
+            picked.append(row[-1])
+        result.append(picked)
+    return result
+
+
+def _is_ndarray(values):
+    """ Whether values is a NumPy array, without importing NumPy
+    """
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(values, numpy.ndarray)
+
+
+def _to_coordinates(cells, scale, offset):
+    """ offset + cells * scale, for a number or for each of a sequence
+    """
+    if _is_ndarray(cells):
+        return offset + cells * scale
+    if isinstance(cells, numbers.Number):
+        return offset + cells * scale
+    return array('d', [offset + c * scale for c in cells])
+
+
+def _to_cells(coordinates, scale, offset):
+    """ floor((coordinates - offset) / scale), for a number or for each of
+    a sequence
+    """
+    if _is_ndarray(coordinates):
+        import numpy
+        return numpy.floor((coordinates - offset) / scale).astype(numpy.int64)
+    if isinstance(coordinates, numbers.Number):
+        return math.floor((coordinates - offset) / scale)
+    floor = math.floor
+    return array('q', [floor((c - offset) / scale) for c in coordinates])
+
+
+def _cubic_weights(t):
+    """ Catmull-Rom weights of the four samples around a fraction t of the
+    way between the middle two
+    """
+    t2 = t * t
+    t3 = t2 * t
+    return (-0.5 * t3 + t2 - 0.5 * t, 1.5 * t3 - 2.5 * t2 + 1.0,
+            -1.5 * t3 + 2.0 * t2 + 0.5 * t, 0.5 * t3 - 0.5 * t2)
+
+
+def _snap(cells, up):
+    """ A number of cells rounded up or down to a whole number, allowing for
+    rounding errors in coordinates that should line up with cell edges
+    """
+    nearest = round(cells)
+    if abs(cells - nearest) < 1e-6:
+        return int(nearest)
+    return int(math.ceil(cells) if up else math.floor(cells))
+
+
+def _covered(start, size, count, new_start, new_size, new_count):
+    """ For each of new_count cells of new_size from new_start along an
+    axis, the (first, last) range of the count cells of size from start
+    whose centres fall within it, or the one holding its centre when there
+    are none; empty beyond the cells
+    """
+    ranges = []
+    for j in range(new_count):
+        edge = new_start + j * new_size
+        first = max(0, int(math.ceil((edge - start) / size - 0.5)))
+        last = min(count, int(math.ceil((edge + new_size - start) / size - 0.5)))
+        if first >= last:
+            centre = int(math.floor((edge + new_size / 2.0 - start) / size))
+            first, last = (centre, centre + 1) if 0 <= centre < count else (0, 0)
+        ranges.append((first, last))
+    return ranges
+
+
+def _aggregated(window, rows, columns, method):
+    """ The mean or most common valid value of the cells of window in each
+    block of rows x columns ranges, as an array of doubles
+    """
+    nodata = window.nodata
+    values = array('d')
+    for first_row, last_row in rows:
+        band = [window._values[r * window.columns:(r + 1) * window.columns]
+                for r in range(first_row, last_row)]
+        for first_col, last_col in columns:
+            cells = [z for row in band for z in row[first_col:last_col] if z != nodata]
+            if not cells:
+                values.append(nodata)
+            elif method == 'average':
+                values.append(sum(cells) / len(cells))
+            else:
+                # the most common value, and the least of any tied
+                counts = Counter(cells)
+                values.append(min(counts, key=lambda z: (-counts[z], z)))
+    return values
+
+
+def _array_view(values, rows, columns):
+    """ Zero-copy rows x columns view of a typed pixel buffer. This is a
+    NumPy ndarray when NumPy is installed and a memoryview otherwise.
+    Strided buffers, such as the bands of pixel-interleaved stacks, can
+    only be viewed with NumPy.
+    """
+    typecode = buffer_typecode(values)
+    try:
+        import numpy
+        if isinstance(values, memoryview) and not values.c_contiguous:
+            return numpy.asarray(values).reshape(rows, columns)
+        if isinstance(values, _SwappedValues):
+            dtype = numpy.dtype(typecode).newbyteorder()
+            return numpy.frombuffer(values._buffer, dtype=dtype).reshape(
+                rows, columns)
+        return numpy.frombuffer(values, dtype=typecode).reshape(
+            rows, columns)
+    except ImportError:
+        if isinstance(values, _SwappedValues):
+            raise Exception(
+                "Viewing non-native byte order data requires NumPy.")
+        if isinstance(values, memoryview) and not values.c_contiguous:
+            raise Exception(
+                "Viewing strided data, such as a band of a pixel-interleaved "
+                "stack, requires NumPy.")
+        view = memoryview(values)
+        if rows * columns == 0:
+            return view
+        return view.cast('B').cast(typecode, [rows, columns])
+
+
+class OperationRecord(object):
+    """ Timing and size of one instrumented operation: its name (such as
+    'read' or 'operator'), a detail (the file name, or the function of an
+    operator), the seconds taken, the cells processed, the bytes read or
+    written, the bytes allocated for new pixel values, and its depth, the
+    number of instrumented operations it ran within
+    """
+
+    def __init__(self, operation, detail, seconds, cells=0, bytes=0, allocated=0, depth=0):
+        self.operation = operation
+        self.detail = detail
+        self.seconds = seconds
+        self.cells = cells
+        self.bytes = bytes
+        self.allocated = allocated
+        self.depth = depth
+
+    def as_dict(self):
+        return {'operation': self.operation, 'detail': self.detail,
+                'seconds': self.seconds, 'cells': self.cells, 'bytes': self.bytes,
+                'allocated': self.allocated, 'depth': self.depth}
+
+
+class Profile(object):
+    """ The OperationRecords collected by profile(), with the seconds the
+    profile ran for
+    """
+
+    def __init__(self):
+        self.records = []
+        self.seconds = 0.0
+
+    def summary(self):
+        """ Totals of each operation, as a dict mapping its name to a dict
+        of count, seconds, cells, bytes and allocated
+        """
+        totals = {}
+        for record in self.records:
+            t = totals.setdefault(record.operation, {
+                'count': 0, 'seconds': 0.0, 'cells': 0, 'bytes': 0, 'allocated': 0})
+            t['count'] += 1
+            t['seconds'] += record.seconds
+            t['cells'] += record.cells
+            t['bytes'] += record.bytes
+            t['allocated'] += record.allocated
+        return totals
+
+    @property
+    def untracked(self):
+        """ Seconds spent outside of instrumented operations, such as in
+        per-cell access through indexing, which is not instrumented
+        """
+        return self.seconds - sum(r.seconds for r in self.records if r.depth == 0)
+
+
+def add_hook(hook):
+    """ Call hook with an OperationRecord after each instrumented operation
+    (reading and writing, windowed I/O, operators, expressions and
+    statistics) from now on, in any thread
+    """
+    _HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    _HOOKS.remove(hook)
+
+
+def log_operation(record):
+    """ A hook logging each record at DEBUG level to this module's logger,
+    with the record as a dict in the raster_operation attribute of the log
+    record for structured handlers
+    """
+    _logger.debug("%s %s: %.6f s, %d cells, %d bytes, %d bytes allocated",
+                  record.operation, record.detail, record.seconds, record.cells,
+                  record.bytes, record.allocated,
+                  extra={'raster_operation': record.as_dict()})
+
+
+@contextlib.contextmanager
+def profile(log=False):
+    """ Context manager collecting a record of each instrumented operation
+    run within it into the Profile it gives, and with log=True also logging
+    them with log_operation:
+
+        with profile() as p:
+            raster = Raster.from_file('dem.dep')
+            (raster * 2.0).write()
+        print(p.summary())
+    """
+    result = Profile()
+    hooks = [result.records.append]
+    if log:
+        hooks.append(log_operation)
+    for hook in hooks:
+        add_hook(hook)
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.seconds = time.perf_counter() - start
+        for hook in hooks:
+            remove_hook(hook)
+
+
+def _instrumented(operation, measure=None):
+    """ Decorate a function so that, while there are hooks, each call is
+    timed and reported to them. measure(args, kwargs, result) gives the
+    detail, cells, bytes and allocated of the record.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _HOOKS:
+                return func(*args, **kwargs)
+            depth = getattr(_local, 'depth', 0)
+            _local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _local.depth = depth
+            seconds = time.perf_counter() - start
+            detail, cells, size, allocated = (None, 0, 0, 0) if measure is None else \
+                measure(args, kwargs, result)
+            record = OperationRecord(operation, detail, seconds, cells, size, allocated, depth)
+            for hook in list(_HOOKS):
+                hook(record)
+            return result
+        return wrapper
+    return decorate
+
+
+def _cell_bytes(r, cells):
+    return cells * array(data_typecode(r.data_type)).itemsize
+
+
+def _measure_read(args, kwargs, result):
+    r = args[0]
+    cells = r.rows * r.columns
+    size = 0 if r._map is not None else _cell_bytes(r, cells)
+    return r.header_filename, cells, size, size
+
+
+def _measure_header(args, kwargs, result):
+    return args[1].header_filename, 0, 0, 0
+
+
+def _measure_write(args, kwargs, result):
+    r = args[0]
+    cells = r.rows * r.columns
+    return r.header_filename, cells, _cell_bytes(r, cells), 0
+
+
+def _measure_read_window(args, kwargs, result):
+    r = args[0]
+    cells = result.rows * result.columns
+    size = _cell_bytes(r, cells)
+    return r.header_filename, cells, size if r._values is None else 0, size
+
+
+def _measure_write_window(args, kwargs, result):
+    r, block = args[0], args[1]
+    cells = block.rows * block.columns
+    return r.header_filename, cells, _cell_bytes(r, cells) if r._values is None else 0, 0
+
+
+def _measure_operator(args, kwargs, result):
+    r, func = args[0], args[1]
+    if result is NotImplemented:
+        return getattr(func, '__name__', None), 0, 0, 0
+    cells = r.rows * r.columns
+    return getattr(func, '__name__', None), cells, 0, 0 if result is r else _cell_bytes(result, cells)
+
+
+def _measure_statistics(args, kwargs, result):
+    r = args[0]
+    return r.header_filename, r.rows * r.columns, 0, 0
+
+
+def _measure_compute(args, kwargs, result):
+    cells = result.rows * result.columns
+    return None, cells, 0, _cell_bytes(result, cells)
+
+
+def _measure_write_rows(args, kwargs, result):
+    r = args[0].raster
+    return r.header_filename, len(args[1]), _cell_bytes(r, len(args[1])), 0
+
+
+class RasterDriver(object):
+    """ Base class of raster file format drivers. A driver reads and writes
+    the files of one format, and is found by file extension or else by the
+    magic bytes at the start of a file. Register new drivers with
+    register_driver. Drivers must at least provide read_header, read and
+    open_writer; whole-raster writes are streamed through the writer.
+    """
+
+    # name of the format
+    name = None
+
+    # lower-case file extensions of the format
+    extensions = ()
+
+    # leading bytes of files in this format, when it has any
+    magic = None
+
+    # whether the data file holds raw cells that can be memory mapped
+    can_map = False
+
+    def identify(self, head):
+        """ Whether head, the first bytes of a file, marks it as this format
+        """
+        return self.magic is not None and head.startswith(self.magic)
+
+    def filenames(self, filename):
+        """ The header and data file names of a raster named filename
+        """
+        return filename, filename
+
+    def read_header(self, r):
+        raise Exception("The {} format has no header reader.".format(self.name))
+
+    def read(self, r):
+        raise Exception("The {} format cannot be read.".format(self.name))
+
+    def write_header(self, r):
+        raise Exception("The {} format has no separate header.".format(self.name))
+
+    def write(self, r):
+        """ Write raster r through a writer, a band of rows at a time
+        """
+        writer = self.open_writer(r)
+        try:
+            rows_per_band = max(1, _CHUNK_CELLS // max(r.columns, 1))
+            for first_row in range(0, r.rows, rows_per_band):
+                last_row = min(first_row + rows_per_band, r.rows)
+                writer.write_rows(as_array(
+                    r._values[first_row * r.columns:last_row * r.columns]))
+        except BaseException:
+            writer.close()
+            raise
+        writer.finish()
+
+    def open_writer(self, r):
+        """ An object to which whole rows of r are appended in order by
+        write_rows(values), and which is completed by finish() or abandoned
+        by close()
+        """
+        raise Exception("The {} format cannot be written.".format(self.name))
+
+    def read_rows(self, r, first_row, last_row, first_col, last_col):
+        """ Read a block of cells from the file of r, as an array of
+        (last_row - first_row) * (last_col - first_col) values
+        """
+        raise Exception("The {} format cannot be read a window at a time.".format(self.name))
+
+    def write_rows(self, r, values, first_row, last_row, first_col, last_col):
+        """ Write a block of cells into the file of r in place
+        """
+        raise Exception("The {} format cannot be updated in place.".format(self.name))
+
+
+def _check_band_interleaved(r):
+    """ A Raster holds the first band of a multi-stack raster, which must be
+    stored before the others
+    """
+    if r.stacks > 1 and r.interleave == 'pixel':
+        raise Exception("Pixel interleaved stacks must be read as a RasterStack.")
+
+
+class WhiteboxDriver(RasterDriver):
+    """ Whitebox GAT rasters: a text .dep header and a raw .tas data file
+    """
+
+    name = 'whitebox'
+    extensions = ('.dep', '.tas')
+    can_map = True
+
+    def identify(self, head):
+        return head.lower().startswith(b'min:')
+
+    def filenames(self, filename):
+        base, extension = os.path.splitext(filename)
+        if extension.lower() == '.tas':
+            return base + '.dep', filename
+        return filename, base + '.tas'
+
+    @_instrumented('read_header', _measure_header)
+    def read_header(self, r):
+        r.metadata = []
+        r.interleave = 'band'
+        with open(r.header_filename) as fp:
+            lines = fp.read().splitlines()
+
+        for line in lines:
+            key, _, value = line.partition(':')
+            key = key.strip().lower()
+            value = value.strip()
+            if key in _HEADER_FIELDS:
+                attribute, convert = _HEADER_FIELDS[key]
+                setattr(r, attribute, convert(value))
+            elif key.startswith('metadata'):
+                r.metadata.append(value)
+
+        r.resolution_x = (r.east - r.west) / r.columns
+        r.resolution_y = (r.north - r.south) / r.rows
+
+    def read(self, r):
+        # decode the whole data file in one call, straight into typed storage
+        self.read_header(r)
+        _check_band_interleaved(r)
+        r._values = array(data_typecode(r.data_type))
+        with open(r.data_filename, "rb") as binary_file:
+            r._values.fromfile(binary_file, r.rows * r.columns)
+
+        if _needs_byteswap(r.byte_order):
+            r._values.byteswap()
+
+    @_instrumented('write_header', _measure_header)
+    def write_header(self, r):
+        if r.display_maximum == float('-inf'):
+            r.display_maximum = r.maximum
+
+        if r.display_minimum == float('inf'):
+            r.display_minimum = r.minimum
+
+        # write the header data
+        with open(r.header_filename, 'w') as header_file:
+            header_file.write("Min:\t{}\n".format(r.minimum))
+            header_file.write("Max:\t{}\n".format(r.maximum))
+            header_file.write("North:\t{}\n".format(r.north))
+            header_file.write("South:\t{}\n".format(r.south))
+            header_file.write("East:\t{}\n".format(r.east))
+            header_file.write("West:\t{}\n".format(r.west))
+            header_file.write("Cols:\t{}\n".format(r.columns))
+            header_file.write("Rows:\t{}\n".format(r.rows))
+            header_file.write("Stacks:\t{}\n".format(r.stacks))
+            header_file.write("Data Type:\t{}\n".format(r.data_type))
+            header_file.write("Z Units:\t{}\n".format(r.z_units))
+            header_file.write("XY Units:\t{}\n".format(r.xy_units))
+            header_file.write("Projection:\t{}\n".format(r.projection))
+            header_file.write("Data Scale:\t{}\n".format(r.data_scale))
+            header_file.write(
+                "Display Min:\t{}\n".format(r.display_minimum))
+            header_file.write(
+                "Display Max:\t{}\n".format(r.display_maximum))
+            header_file.write("Preferred Palette:\t{}\n".format(
+                r.palette.replace('.pal', '.plt')))
+            header_file.write("NoData:\t{}\n".format(r.nodata))
+            if _is_little_endian(r.byte_order):
+                header_file.write("Byte Order:\tLITTLE_ENDIAN\n")
+            else:
+                header_file.write("Byte Order:\tBIG_ENDIAN\n")
+            header_file.write("Palette Nonlinearity:\t{}\n".format(
+                r.palette_nonlinearity))
+            if r.stacks > 1 and r.interleave == 'pixel':
+                header_file.write("Interleave:\tPIXEL\n")
+            for v in r.metadata:
+                header_file.write(
+                    "Metadata Entry:\t{}\n".format(v.replace(":", ";")))
+
+    def write(self, r):
+        r.calculate_min_and_max()
+        self.write_header(r)
+
+        if r._map is not None and r._map_filename == os.path.abspath(r.data_filename):
+            if r._map_mode == 'r+':
+                # edits were made in the file itself; just flush them
+                r._map.flush()
+                return
+            # the data file is about to be truncated; stop mapping it first
+            r._detach_map()
+
+        # write the binary data
+        with open(r.data_filename, "wb") as binary_file:
+            _write_values(binary_file, r._values, r.data_type, r.byte_order)
+
+    def open_writer(self, r):
+        return _WhiteboxWriter(self, r)
+
+    def read_rows(self, r, first_row, last_row, first_col, last_col):
+        _check_band_interleaved(r)
+        typecode = data_typecode(r.data_type)
+        width = last_col - first_col
+        with open(r.data_filename, "rb") as binary_file:
+            if width == r.columns:
+                # whole rows are contiguous in the data file; read them at once
+                binary_file.seek(first_row * width * array(typecode).itemsize)
+                values = array(typecode)
+                values.fromfile(binary_file, (last_row - first_row) * width)
+            else:
+                values = array(typecode)
+                for row in range(first_row, last_row):
+                    binary_file.seek((row * r.columns + first_col) * values.itemsize)
+                    values.fromfile(binary_file, width)
+        if _needs_byteswap(r.byte_order):
+            values.byteswap()
+        return values
+
+    def write_rows(self, r, values, first_row, last_row, first_col, last_col):
+        width = last_col - first_col
+        itemsize = array(data_typecode(r.data_type)).itemsize
+        with open(r.data_filename, "r+b") as binary_file:
+            for row in range(first_row, last_row):
+                start = (row - first_row) * width
+                binary_file.seek((row * r.columns + first_col) * itemsize)
+                _write_values(binary_file, values[start:start + width],
+                              r.data_type, r.byte_order)
+
+
+class _WhiteboxWriter(object):
+    """ Streams rows to a .tas file; the header follows once they are done
+    """
+
+    def __init__(self, driver, r):
+        self.driver = driver
+        self.raster = r
+        self._file = open(r.data_filename, "wb")
+
+    def write_rows(self, values):
+        _write_values(self._file, values, self.raster.data_type, self.raster.byte_order)
+
+    def finish(self):
+        self._file.close()
+        self.driver.write_header(self.raster)
+
+    def close(self):
+        self._file.close()
+
+
+class AsciiDriver(RasterDriver):
+    """ ESRI ASCII grids (.asc), read and written as a single text file
+    """
+
+    name = 'ascii'
+    extensions = ('.asc',)
+
+    # keys that may start an ESRI ASCII grid header
+    _KEYS = (b'ncols', b'nrows', b'xllcorner', b'yllcorner', b'xllcenter',
+             b'yllcenter', b'cellsize', b'nodata_value')
+
+    def identify(self, head):
+        return head.lstrip().lower().startswith(self._KEYS)
+
+    @_instrumented('read_header', _measure_header)
+    def read_header(self, r):
+        self._read(r, header_only=True)
+
+    def read(self, r):
+        self._read(r)
+
+    def _read(self, r, header_only=False):
+        """ Read an ESRI ASCII grid. The body is tokenized in large chunks of
+        text, each converted to numbers in a single call.
+        """
+        header = {}
+        with open(r.data_filename) as fp:
+            # the header is a run of 'key value' lines
+            while True:
+                position = fp.tell()
+                line = fp.readline()
+                words = line.split()
+                if not line or (words and not words[0][0].isalpha()):
+                    fp.seek(position)
+                    break
+                if len(words) == 1:
+                    raise Exception("Bad ESRI ASCII grid header line '{}'.".format(line.strip()))
+                if words:
+                    header[words[0].lower()] = words[1]
+
+            try:
+                r.columns = int(header['ncols'])
+                r.rows = int(header['nrows'])
+                r.resolution_x = float(header.get('cellsize', header.get('dx')))
+                r.resolution_y = float(header.get('cellsize', header.get('dy')))
+                if 'xllcenter' in header:
+                    r.west = float(header['xllcenter']) - r.resolution_x / 2.0
+                    r.south = float(header['yllcenter']) - r.resolution_y / 2.0
+                else:
+                    r.west = float(header['xllcorner'])
+                    r.south = float(header['yllcorner'])
+            except (KeyError, TypeError):
+                raise Exception("Incomplete ESRI ASCII grid header.")
+            r.east = r.west + r.columns * r.resolution_x
+            r.north = r.south + r.rows * r.resolution_y
+            r.nodata = float(header.get('nodata_value', -9999.0))
+
+            r.stacks = 1
+            r.data_type = 'double'
+            r.data_scale = 'continuous'
+            r.z_units = 'not specified'
+            r.xy_units = 'not specified'
+            r.projection = 'not specified'
+            r.palette = 'spectrum.pal'
+            r.palette_nonlinearity = 1.0
+            r.byte_order = sys.byteorder + '_endian'
+            r.minimum = float("inf")
+            r.maximum = float("-inf")
+            r.display_minimum = float("inf")
+            r.display_maximum = float("-inf")
+            r.metadata = []
+            if header_only:
+                return
+
+            r._values = array('d')
+            remainder = ''
+            while True:
+                text = fp.read(_ASCII_CHUNK_CHARACTERS)
+                if not text:
+                    break
+                tokens = (remainder + text).split()
+                # the last token may continue in the next chunk
+                remainder = '' if text[-1].isspace() or not tokens else tokens.pop()
+                r._values.fromlist(list(map(float, tokens)))
+            if remainder:
+                r._values.append(float(remainder))
+
+        if len(r._values) != r.rows * r.columns:
+            raise Exception("The ESRI ASCII grid should hold {} values but holds {}.".format(
+                r.rows * r.columns, len(r._values)))
+        r.calculate_min_and_max()
+
+    def open_writer(self, r):
+        return _AsciiWriter(r)
+
+    def read_rows(self, r, first_row, last_row, first_col, last_col):
+        raise Exception("ESRI ASCII grids must be read before taking windows.")
+
+    def write_rows(self, r, values, first_row, last_row, first_col, last_col):
+        raise Exception("ESRI ASCII grids cannot be updated in place.")
+
+
+class _AsciiWriter(object):
+    """ Streams rows to an ESRI ASCII grid. Its header needs no statistics,
+    so comes first.
+    """
+
+    def __init__(self, r):
+        self.raster = r
+        self._file = open(r.data_filename, "w")
+        self._file.write(_ascii_header(r))
+
+    def write_rows(self, values):
+        self._file.write(_ascii_rows(values, self.raster.columns))
+
+    def finish(self):
+        self._file.close()
+
+    def close(self):
+        self._file.close()
+
+
+class TiledDriver(RasterDriver):
+    """ Compressed tiled rasters (.rtz). The file holds square tiles of
+    tile_size cells, each compressed on its own with zlib or lzma (or left
+    as is for compression 'none'), followed by a footer giving the header
+    as JSON and the offset and length of every tile. Tiles that are all
+    nodata are not stored at all. Windows are read by decompressing only
+    the tiles they overlap.
+
+    Layout: the magic bytes, the offset of the footer as a little-endian
+    uint64, the tiles, then the footer: the length of the JSON header as a
+    uint64, the JSON header, and the tile offsets and lengths as two runs of
+    uint64 in row-major tile order. Cells are stored little-endian.
+    """
+
+    name = 'tiled'
+    extensions = ('.rtz',)
+    magic = b'\x89RTZ\r\n\x1a\n'
+
+    # Raster attributes kept in the JSON header
+    _FIELDS = ('rows', 'columns', 'north', 'south', 'east', 'west', 'stacks',
+               'data_type', 'nodata', 'data_scale', 'z_units', 'xy_units',
+               'projection', 'palette', 'palette_nonlinearity', 'minimum',
+               'maximum', 'display_minimum', 'display_maximum', 'metadata',
+               'tile_size', 'compression')
+
+    @_instrumented('read_header', _measure_header)
+    def read_header(self, r):
+        with open(r.data_filename, "rb") as binary_file:
+            head = binary_file.read(len(self.magic) + 8)
+            if not self.identify(head):
+                raise Exception("{} is not a tiled raster.".format(r.data_filename))
+            binary_file.seek(struct.unpack_from('<Q', head, len(self.magic))[0])
+            size = struct.unpack('<Q', binary_file.read(8))[0]
+            header = json.loads(binary_file.read(size).decode('utf-8'))
+            for attribute in self._FIELDS:
+                setattr(r, attribute, header[attribute])
+
+            count = self._tiles_down(r) * self._tiles_across(r)
+            index = array('Q')
+            index.fromfile(binary_file, 2 * count)
+        if sys.byteorder != 'little':
+            index.byteswap()
+        r._tile_offsets = index[:count]
+        r._tile_lengths = index[count:]
+
+        r.byte_order = 'little_endian'
+        r.resolution_x = (r.east - r.west) / r.columns
+        r.resolution_y = (r.north - r.south) / r.rows
+
+    def read(self, r):
+        self.read_header(r)
+        r._values = self.read_rows(r, 0, r.rows, 0, r.columns)
+
+    def write(self, r):
+        r.calculate_min_and_max()
+        RasterDriver.write(self, r)
+
+    def open_writer(self, r):
+        return _TiledWriter(self, r)
+
+    def read_rows(self, r, first_row, last_row, first_col, last_col):
+        size = r.tile_size
+        width = last_col - first_col
+        values = filled_array(data_typecode(r.data_type), r.nodata,
+                         (last_row - first_row) * width)
+        with open(r.data_filename, "rb") as binary_file:
+            for tile_row in range(first_row // size, (last_row - 1) // size + 1):
+                y0 = tile_row * size
+                rows = range(max(y0, first_row), min(y0 + size, last_row))
+                for tile_col in range(first_col // size, (last_col - 1) // size + 1):
+                    tile = self._read_tile(r, binary_file, tile_row, tile_col)
+                    if tile is None:
+                        continue
+                    x0 = tile_col * size
+                    tile_width = min(x0 + size, r.columns) - x0
+                    a = max(x0, first_col)
+                    b = min(x0 + size, last_col)
+                    for row in rows:
+                        source = (row - y0) * tile_width + a - x0
+                        target = (row - first_row) * width + a - first_col
+                        values[target:target + b - a] = tile[source:source + b - a]
+        return values
+
+    def _read_tile(self, r, binary_file, tile_row, tile_col):
+        """ Decode one tile, or give None when it is all nodata
+        """
+        index = tile_row * self._tiles_across(r) + tile_col
+        length = r._tile_lengths[index]
+        if length == 0:
+            return None
+        binary_file.seek(r._tile_offsets[index])
+        tile = array(data_typecode(r.data_type))
+        tile.frombytes(_tile_codec(r.compression)[1](binary_file.read(length)))
+        if sys.byteorder != 'little':
+            tile.byteswap()
+        return tile
+
+    def _tiles_down(self, r):
+        return (r.rows + r.tile_size - 1) // r.tile_size
+
+    def _tiles_across(self, r):
+        return (r.columns + r.tile_size - 1) // r.tile_size
+
+
+class _TiledWriter(object):
+    """ Streams rows to a tiled raster, compressing a band of tiles each
+    time tile_size rows have arrived
+    """
+
+    def __init__(self, driver, r):
+        self.driver = driver
+        self.raster = r
+        self._compress = _tile_codec(r.compression)[0]
+        self.data_typecode = data_typecode(r.data_type)
+        self._nodata = filled_array(self.data_typecode, r.nodata, 1)[0]
+        self._band = array(self.data_typecode)
+        self._offsets = array('Q')
+        self._lengths = array('Q')
+        self._file = open(r.data_filename, "wb")
+        self._file.write(driver.magic + struct.pack('<Q', 0))
+
+    def write_rows(self, values):
+        self._band.extend(convert_values(values, self.data_typecode))
+        band_cells = self.raster.tile_size * self.raster.columns
+        while len(self._band) >= band_cells:
+            self._write_band(self._band[:band_cells])
+            del self._band[:band_cells]
+
+    def _write_band(self, band):
+        size = self.raster.tile_size
+        columns = self.raster.columns
+        for x0 in range(0, columns, size):
+            x1 = min(x0 + size, columns)
+            tile = array(self.data_typecode)
+            for start in range(0, len(band), columns):
+                tile.extend(band[start + x0:start + x1])
+            if tile.count(self._nodata) == len(tile):
+                # sparse: all-nodata tiles take no space
+                self._offsets.append(0)
+                self._lengths.append(0)
+                continue
+            if sys.byteorder != 'little':
+                tile.byteswap()
+            data = self._compress(tile.tobytes())
+            self._offsets.append(self._file.tell())
+            self._lengths.append(len(data))
+            self._file.write(data)
+
+    def finish(self):
+        r = self.raster
+        if self._band:
+            self._write_band(self._band)
+        if r.display_maximum == float('-inf'):
+            r.display_maximum = r.maximum
+        if r.display_minimum == float('inf'):
+            r.display_minimum = r.minimum
+
+        header = json.dumps(dict((attribute, getattr(r, attribute))
+                                 for attribute in self.driver._FIELDS)).encode('utf-8')
+        index = self._offsets + self._lengths
+        if sys.byteorder != 'little':
+            index.byteswap()
+        footer = self._file.tell()
+        self._file.write(struct.pack('<Q', len(header)))
+        self._file.write(header)
+        index.tofile(self._file)
+        self._file.seek(len(self.driver.magic))
+        self._file.write(struct.pack('<Q', footer))
+        self._file.close()
+
+        r._tile_offsets = self._offsets
+        r._tile_lengths = self._lengths
+
+    def close(self):
+        self._file.close()
+
+
+def _tile_codec(compression):
+    """ The compress and decompress functions of a tile compression
+    """
+    if compression == 'zlib':
+        return zlib.compress, zlib.decompress
+    if compression == 'lzma':
+        import lzma
+        return lzma.compress, lzma.decompress
+    if compression == 'none':
+        return bytes, bytes
+    raise Exception("Unknown compression '{}'.".format(compression))
+
+
+# registered drivers; later registrations take precedence
+_DRIVERS = [WhiteboxDriver(), AsciiDriver(), TiledDriver()]
+
+
+def register_driver(driver):
+    """ Make a RasterDriver available to Raster and RasterWriter. It takes
+    precedence over the drivers registered before it.
+    """
+    _DRIVERS.append(driver)
+
+
+def get_driver(filename):
+    """ Find the driver for a raster file, by the extension of filename or,
+    failing that, by the magic bytes at the start of an existing file
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    for driver in reversed(_DRIVERS):
+        if extension in driver.extensions:
+            return driver
+
+    if os.path.isfile(filename):
+        with open(filename, "rb") as fp:
+            head = fp.read(64)
+        for driver in reversed(_DRIVERS):
+            if driver.identify(head):
+                return driver
+
+    raise Exception("Unknown file extension")
+
+
+class RasterCache(object):
+    """ Process-wide, thread-safe cache of the decoded headers and pixel
+    tiles of raster files, shared by every Raster through the module's
+    cache instance. Entries are keyed on the path, modification time and
+    size of the files, so that a file changed on disk is read afresh, and
+    are evicted least recently used first to keep their total size within
+    max_bytes. Tiles are bands of whole rows of about tile_cells cells,
+    matching the row-major layout of the data files so that each is read
+    in one go. The cache is off while max_bytes is 0, as it is until
+    resize is called.
+    """
+
+    def __init__(self, max_bytes=0, tile_cells=1 << 16):
+        self.max_bytes = max_bytes
+        self.tile_cells = tile_cells
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resize(self, max_bytes):
+        """ Change the byte budget, evicting entries to fit it; 0 turns the
+        cache off and empties it
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def invalidate(self, *filenames):
+        """ Drop the entries of the named files, after writing to them
+        """
+        if not self._entries:
+            return
+        paths = set(os.path.abspath(f) for f in filenames if f is not None)
+        with self._lock:
+            for key in list(self._entries):
+                if any(f[0] in paths for f in key[1]):
+                    self.bytes -= self._entries.pop(key)[1]
+
+    def read_header(self, r):
+        """ Read the header of raster r, from the cache when it has it
+        """
+        key = ('header', _file_key(r))
+        header = self._get(key)
+        if header is None:
+            r.driver.read_header(r)
+            self._put(key, _header_state(r), _header_size(r))
+        else:
+            _restore_header(r, header)
+
+    def read(self, r):
+        """ Read raster r, from the cache when it has the header and every
+        tile, else from the file, caching the header and tiles
+        """
+        files = _file_key(r)
+        header = self._get(('header', files))
+        if header is not None:
+            _restore_header(r, header)
+            values = self._assemble(r, files, 0, r.rows, 0, r.columns, fetch=False)
+            if values is not None:
+                r._values = values
+                return
+
+        r.driver.read(r)
+        self._put(('header', files), _header_state(r), _header_size(r))
+        rows = self._tile_rows(r)
+        for first_row in range(0, r.rows, rows):
+            tile = r._values[first_row * r.columns:(first_row + rows) * r.columns]
+            self._put(('tile', files, rows, first_row // rows), as_array(tile),
+                      len(tile) * tile.itemsize)
+
+    def read_rows(self, r, first_row, last_row, first_col, last_col):
+        """ The cells of a block of the data file of raster r, as
+        RasterDriver.read_rows, from cached tiles where possible
+        """
+        return self._assemble(r, _file_key(r), first_row, last_row, first_col, last_col)
+
+    def _tile_rows(self, r):
+        return max(1, self.tile_cells // max(r.columns, 1))
+
+    def _assemble(self, r, files, first_row, last_row, first_col, last_col, fetch=True):
+        """ Copy a block out of the tiles it overlaps. Missing tiles are read
+        and cached, or with fetch=False give None.
+        """
+        values = array(data_typecode(r.data_type))
+        rows = self._tile_rows(r)
+        columns = r.columns
+        for index in range(first_row // rows, (last_row - 1) // rows + 1):
+            top = index * rows
+            key = ('tile', files, rows, index)
+            tile = self._get(key)
+            if tile is None:
+                if not fetch:
+                    return None
+                tile = r.driver.read_rows(r, top, min(top + rows, r.rows), 0, columns)
+                self._put(key, tile, len(tile) * tile.itemsize)
+
+            start = max(first_row, top) - top
+            stop = min(last_row, top + rows) - top
+            if first_col == 0 and last_col == columns:
+                values.extend(tile[start * columns:stop * columns])
+                continue
+            for row in range(start, stop):
+                values.extend(tile[row * columns + first_col:row * columns + last_col])
+        return values
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, value, size):
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            self.bytes -= self._entries.popitem(last=False)[1][1]
+
+
+# the shared cache of raster headers and tiles, off until resized
+cache = RasterCache()
+
+# attributes of a raster that are not part of its header
+_UNCACHED = ('_values', '_statistics', '_overviews', '_map', '_map_mode', '_map_filename',
+             'header_filename', 'data_filename', 'driver', 'row_offset', 'column_offset')
+
+# allowance for the size of a cached header
+_HEADER_BYTES = 1024
+
+
+def _file_key(r):
+    """ The path, modification time and size of each file of raster r
+    """
+    files = []
+    for filename in sorted(set((r.header_filename, r.data_filename))):
+        stat = os.stat(filename)
+        files.append((os.path.abspath(filename), stat.st_mtime_ns, stat.st_size))
+    return tuple(files)
+
+
+def _header_state(r):
+    return dict((k, v) for k, v in vars(r).items() if k not in _UNCACHED)
+
+
+def _header_size(r):
+    return _HEADER_BYTES + sum(len(v) * v.itemsize for v in vars(r).values()
+                               if isinstance(v, array) and v is not r._values)
+
+
+def _restore_header(r, header):
+    for attribute, value in header.items():
+        setattr(r, attribute, list(value) if isinstance(value, list) else value)
 
 
 class Raster(object):
 
+    # pixel values; None until the data are read or mapped
+    _values = None
+
+    # cached RasterStatistics; reset whenever cells change
+    _statistics = None
+
+    # whether the cells differ from the data file; set when cells change
+    # and cleared when the raster is read or written
+    _unsaved = False
+
+    # RasterDriver reading and writing the raster's file format
+    driver = _DRIVERS[0]
+
+    # tile edge length and tile compression of tiled (.rtz) rasters
+    tile_size = 256
+    compression = 'zlib'
+
+    # layout of the bands of multi-stack rasters: 'band' or 'pixel'
+    interleave = 'band'
+
+    # headers of overviews, by level, once opened
+    _overviews = None
+
+    # memory map backing the pixel values of a memory-mapped raster
+    _map = None
+    _map_mode = None
+
     @staticmethod
-    def from_file(filename):
+    def from_file(filename, mmap=False, mode='r', overview=None):
+        """ Open a raster. With mmap=True the data file is memory mapped
+        rather than read and cells are decoded on demand. The mode is 'r'
+        (read-only), 'c' (copy-on-write) or 'r+' (edits are written
+        through to the file and flushed by write()). With overview=n the
+        level n overview made by build_overviews is opened instead.
+        """
         r = Raster()
-        if filename.lower().endswith('.dep'):
-            r.header_filename = filename
-            r.data_filename = filename.replace(
-                '.dep', '.tas').replace('.DEP', '.tas')
-        elif filename.lower().endswith('.tas'):
-            r.header_filename = filename.replace(
-                '.tas', '.dep').replace('.TAS', '.dep')
-            r.data_filename = filename
-        else:
-            raise Exception("Unknown file extension")
+        r._set_filenames(filename)
+        r.read(mmap=mmap, mode=mode, overview=overview)
+        return r
 
-        r.read()
+    @staticmethod
+    def open_header(filename):
+        """ Open only the header of a raster, giving its dimensions, extent,
+        data type, nodata value and metadata without touching the data
+        file. Windows and blocks can still be read from the result.
+        """
+        r = Raster()
+        r._set_filenames(filename)
+        r._read_header()
         return r
 
     @staticmethod
-    def create(filename, rows, columns, nodata):
+    def create(filename, rows, columns, nodata, data_type='float'):
+        """ A new in-memory raster of nodata cells, with a header ready to
+        be written: a grid of unit cells with its south-west corner at the
+        origin, in the native byte order. Set the extent and any other
+        fields that differ. With filename None the raster has no files
+        until it is given them.
+        """
         r = Raster()
-        if filename.lower().endswith('.dep'):
-            r.header_filename = filename
-            r.data_filename = filename.replace(
-                '.dep', '.tas').replace('.DEP', '.tas')
-        elif filename.lower().endswith('.tas'):
-            r.header_filename = filename.replace(
-                '.tas', '.dep').replace('.TAS', '.dep')
-            r.data_filename = filename
+        if filename is None:
+            r.header_filename = r.data_filename = None
         else:
-            raise Exception("Unknown file extension")
+            r._set_filenames(filename)
 
         r.rows = rows
         r.columns = columns
         r.nodata = nodata
-        r._values = [nodata] * rows * columns
+        r.data_type = data_type
+        r.north, r.south, r.east, r.west = float(rows), 0.0, float(columns), 0.0
+        r.resolution_x = r.resolution_y = 1.0
+        r.stacks = 1
+        r.data_scale = 'continuous'
+        r.palette = 'spectrum.pal'
+        r.palette_nonlinearity = 1.0
+        r.projection = r.z_units = r.xy_units = 'not specified'
+        r.byte_order = 'LITTLE_ENDIAN' if sys.byteorder == 'little' else 'BIG_ENDIAN'
+        r.minimum = r.display_minimum = float("inf")
+        r.maximum = r.display_maximum = float("-inf")
+        r.metadata = []
+        r._values = filled_array(data_typecode(data_type), nodata, rows * columns)
+        r._unsaved = True
         return r
 
     @staticmethod
     def create_from_other(filename, other, data_type=None, nodata=None, initial_value=None):
         r = Raster()
-        if filename.lower().endswith('.dep'):
-            r.header_filename = filename
-            r.data_filename = filename.replace(
-                '.dep', '.tas').replace('.DEP', '.tas')
-        elif filename.lower().endswith('.tas'):
-            r.header_filename = filename.replace(
-                '.tas', '.dep').replace('.TAS', '.dep')
-            r.data_filename = filename
-        else:
-            raise Exception("Unknown file extension")
+        r._set_filenames(filename)
 
         if type(other) is str:
-            other = Raster.from_file(other)
+            other = Raster.open_header(other)
 
         if not type(other) is Raster:
             raise Exception("Parameter 'other' must be a Raster or file name.")
 
+        r._copy_header(other, data_type, nodata)
+
+        if initial_value is None:
+            initial_value = r.nodata
+        r._values = filled_array(data_typecode(r.data_type),
+                            initial_value, r.rows * r.columns)
+        r._unsaved = True
+
+        return r
+
+    def _set_filenames(self, filename):
+        """ Set the header and data file names, and the driver, from
+        filename
+        """
+        self.driver = get_driver(filename)
+        self.header_filename, self.data_filename = self.driver.filenames(filename)
+
+    def _copy_header(self, other, data_type=None, nodata=None):
+        """ Copy the grid and format parameters of another raster. The
+        statistics and metadata are reset since the data will be unique.
+        """
         # copy parameters unrelated to the data and metadata
-        r.north = other.north
-        r.south = other.south
-        r.east = other.east
-        r.west = other.west
-        r.rows = other.rows
-        r.columns = other.columns
-        r.resolution_x = other.resolution_x
-        r.resolution_y = other.resolution_y
-        r.stacks = 1  # other.stacks
-        if not nodata:
-            r.nodata = other.nodata
+        self.north = other.north
+        self.south = other.south
+        self.east = other.east
+        self.west = other.west
+        self.rows = other.rows
+        self.columns = other.columns
+        self.resolution_x = other.resolution_x
+        self.resolution_y = other.resolution_y
+        self.stacks = 1  # other.stacks
+        if nodata is None:
+            self.nodata = other.nodata
         else:
-            r.nodata = nodata
-        r.data_scale = other.data_scale
+            self.nodata = nodata
+        self.data_scale = other.data_scale
         if not data_type:
-            r.data_type = other.data_type
+            self.data_type = other.data_type
         else:
-            r.data_type = data_type
-        r.palette = other.palette
-        r.palette_nonlinearity = 1.0  # other.palette_nonlinearity
-        r.projection = other.projection
-        r.z_units = other.z_units
-        r.xy_units = other.xy_units
-        r.byte_order = other.byte_order
+            self.data_type = data_type
+        self.palette = other.palette
+        self.palette_nonlinearity = 1.0  # other.palette_nonlinearity
+        self.projection = other.projection
+        self.z_units = other.z_units
+        self.xy_units = other.xy_units
+        self.byte_order = other.byte_order
+        self.tile_size = other.tile_size
+        self.compression = other.compression
 
         # the data will be unique to the new raster
-        r.minimum = float("inf")
-        r.maximum = float("-inf")
-        r.display_minimum = float("inf")
-        r.display_maximum = float("-inf")
-
-        if initial_value is None:
-            r._values = [r.nodata] * r.rows * r.columns
-        else:
-            r._values = [initial_value] * r.rows * r.columns
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self.display_minimum = float("inf")
+        self.display_maximum = float("-inf")
 
         # the metadata will also be unique
-        r.metadata = []
+        self.metadata = []
 
-        return r
+    @_instrumented('read_window', _measure_read_window)
+    def read_window(self, row_offset, column_offset, rows, columns, overview=None):
+        """ Read a rows x columns block starting at (row_offset,
+        column_offset) into a new in-memory Raster georeferenced to the
+        block. Values come from memory when this raster has them and are
+        otherwise read row by row from the data file. Cells outside of the
+        raster are nodata. With overview=n the block is read from the level
+        n overview, with offsets and sizes in overview cells.
+        """
+        if overview is not None:
+            return self._overview(overview).read_window(
+                row_offset, column_offset, rows, columns)
+
+        window = Raster()
+        window.header_filename = None
+        window.data_filename = None
+        window._copy_header(self)
+        window.rows = rows
+        window.columns = columns
+        window.north = self.north - row_offset * self.resolution_y
+        window.south = window.north - rows * self.resolution_y
+        window.west = self.west + column_offset * self.resolution_x
+        window.east = window.west + columns * self.resolution_x
+        window.row_offset = row_offset
+        window.column_offset = column_offset
+
+        typecode = data_typecode(self.data_type)
+        window._values = filled_array(typecode, self.nodata, rows * columns)
+
+        first_row = max(row_offset, 0)
+        last_row = min(row_offset + rows, self.rows)
+        first_col = max(column_offset, 0)
+        last_col = min(column_offset + columns, self.columns)
+        if first_row >= last_row or first_col >= last_col:
+            return window
+
+        width = last_col - first_col
+        if self._values is None:
+            chunk = self._read_rows(first_row, last_row, first_col, last_col)
+            if width == columns:
+                offset = (first_row - row_offset) * columns
+                window._values[offset:offset + len(chunk)] = chunk
+                return window
+
+        for row in range(first_row, last_row):
+            offset = (row - row_offset) * columns + first_col - column_offset
+            if self._values is None:
+                start = (row - first_row) * width
+                window._values[offset:offset + width] = chunk[start:start + width]
+            else:
+                start = row * self.columns + first_col
+                window._values[offset:offset + width] = convert_values(
+                    as_array(self._values[start:start + width]), typecode)
+
+        return window
+
+    @_instrumented('write_window', _measure_write_window)
+    def write_window(self, block, row_offset=None, column_offset=None):
+        """ Write a Raster or Array2D block into this raster with its top-left
+        cell at (row_offset, column_offset), which default to the offsets of
+        a block made by read_window. Cells falling outside of the raster are
+        skipped. When this raster has no values in memory the block is
+        written into the data file in place and the header is left as is.
+        """
+        if row_offset is None:
+            row_offset = block.row_offset
+        if column_offset is None:
+            column_offset = block.column_offset
+
+        first_row = max(row_offset, 0)
+        last_row = min(row_offset + block.rows, self.rows)
+        first_col = max(column_offset, 0)
+        last_col = min(column_offset + block.columns, self.columns)
+        if first_row >= last_row or first_col >= last_col:
+            return
+
+        typecode = data_typecode(self.data_type)
+        width = last_col - first_col
+        values = array(typecode)
+        for row in range(first_row, last_row):
+            offset = (row - row_offset) * block.columns + first_col - column_offset
+            values.extend(convert_values(as_array(block._values[offset:offset + width]), typecode))
+        self._statistics = None
+        if self._values is None:
+            self.driver.write_rows(self, values, first_row, last_row, first_col, last_col)
+            cache.invalidate(self.data_filename)
+            return
+
+        self._unsaved = True
+        for row in range(first_row, last_row):
+            start = row * self.columns + first_col
+            offset = (row - first_row) * width
+            self._values[start:start + width] = values[offset:offset + width]
+
+    @property
+    def array(self):
+        """Zero-copy (rows, columns) view of the pixel values
+        """
+        return _array_view(self._values, self.rows, self.columns)
 
     def __getitem__(self, pos):
         """Array indexing operator for Raster
         """
         row, column = pos
-        if row >= 0 and row < self.rows and column >= 0 and column < self.columns:
-            index = row * self.columns + column
-            if index >= 0 and index < len(self._values):
-                return self._values[index]
+        if 0 <= row < self.rows and 0 <= column < self.columns:
+            return self._values[row * self.columns + column]
 
         return self.nodata
 
@@ -119,122 +1647,203 @@ class Raster(object):
         """Array index assignment operator for Raster
         """
         row, column = pos
-        if row >= 0 and row < self.rows and column >= 0 and column < self.columns:
+        if 0 <= row < self.rows and 0 <= column < self.columns:
             index = row * self.columns + column
-            if index >= 0 and index < len(self._values):
+            self._statistics = None
+            self._unsaved = True
+            try:
                 self._values[index] = value
+            except TypeError:
+                # integer storage; round floating-point values
+                self._values[index] = int(round(value))
 
     # def __delitem__(self, pos):
     #     row, column = pos
     #     # do nothing; this should be allowable
 
-    def __iadd__(self, other):
-        """Increment (+=) operator for Raster
+    def _new_like(self, data_type=None, nodata=None):
+        """ An in-memory raster with this raster's grid and no values yet
         """
-        if type(other) is Raster:
+        r = Raster()
+        r.header_filename = None
+        r.data_filename = None
+        r._copy_header(self, data_type, nodata)
+        r._values = array(data_typecode(r.data_type))
+        return r
+
+    def lazy(self):
+        """ A RasterExpression for this raster. Operators applied to it are
+        deferred and evaluated together in a single blocked pass.
+        """
+        return RasterExpression(None, [self])
+
+    @_instrumented('operator', _measure_operator)
+    def _apply(self, func, other=None, reverse=False, in_place=False, may_be_invalid=False):
+        """ Apply func to every cell, and to the matching cell of other when it
+        is a Raster or to other itself when it is a number. Cells that are
+        nodata in either operand are nodata in the result, as are cells for
+        which func returns NaN when may_be_invalid is set, and, in integer
+        rasters, cells whose result is not finite or is outside of the range
+        of the data type. The work is done in chunks of _CHUNK_CELLS cells,
+        and in-place results are only stored once every chunk is done.
+        """
+        if isinstance(other, RasterExpression):
+            return NotImplemented
+
+        if isinstance(other, Raster):
             if self.rows != other.rows or self.columns != other.columns:
                 raise Exception("Both rasters must have the same dimensions.")
+            data_type = 'double' if 'double' in (
+                self.data_type.lower(), other.data_type.lower()) else 'float'
+        else:
+            data_type = 'double' if self.data_type.lower() == 'double' else 'float'
+
+        result = self if in_place else self._new_like(data_type)
+        result._statistics = None
+        result._unsaved = True
+        typecode = buffer_typecode(result._values)
+        if typecode in _INTEGER_TYPECODES:
+            low, high = _integer_range(typecode)
+        a, na, nodata = self._values, self.nodata, result.nodata
+        chunks = []
+        for start in range(0, self.rows * self.columns, _CHUNK_CELLS):
+            stop = min(start + _CHUNK_CELLS, self.rows * self.columns)
+            xs = a[start:stop]
+            if isinstance(other, Raster):
+                ys, nb = other._values[start:stop], other.nodata
+                if reverse:
+                    values = [nodata if x == na or y == nb else func(y, x)
+                              for x, y in zip(xs, ys)]
+                else:
+                    values = [nodata if x == na or y == nb else func(x, y)
+                              for x, y in zip(xs, ys)]
+            elif other is None:
+                values = [nodata if x == na else func(x) for x in xs]
+            elif reverse:
+                values = [nodata if x == na else func(other, x) for x in xs]
+            else:
+                values = [nodata if x == na else func(x, other) for x in xs]
 
-            for i in range(self.rows * self.columns):
-                # row = int(math.floor(float(i) / float(self.columns)))
-                # col = int(float(i) % float(self.columns))
-                self._values[i] += other._values[i]  # [row, col]
+            if may_be_invalid:
+                values = [nodata if z != z else z for z in values]
+            if typecode in _INTEGER_TYPECODES:
+                values = [int(round(z if low - 0.5 < z < high + 0.5 else nodata))
+                          for z in values]
 
-        elif (type(other) is int) or (type(other) is float):
-            for i in range(self.rows * self.columns):
-                self._values[i] += float(other)
+            if in_place:
+                chunks.append((start, stop, array(typecode, values)))
+            else:
+                result._values.fromlist(values)
 
-        return self
+        for start, stop, values in chunks:
+            result._values[start:stop] = values
+        return result
 
-    def __isub__(self, pos, value):
-        """Decrement (-=) operator for Raster
+    def __add__(self, other):
+        """Add a Raster or number, returning a new Raster
         """
-        if type(other) is Raster:
-            if self.rows != other.rows or self.columns != other.columns:
-                raise Exception("Both rasters must have the same dimensions.")
+        return self._apply(operator.add, other)
 
-            for i in range(self.rows * self.columns):
-                # row = int(math.floor(float(i) / float(self.columns)))
-                # col = int(float(i) % float(self.columns))
-                self._values[i] -= other._values[i]  # [row, col]
+    def __radd__(self, other):
+        return self._apply(operator.add, other, reverse=True)
 
-        elif (type(other) is int) or (type(other) is float):
-            for i in range(self.rows * self.columns):
-                self._values[i] -= float(other)
-
-        return self
+    def __iadd__(self, other):
+        """Increment (+=) operator for Raster
+        """
+        return self._apply(operator.add, other, in_place=True)
 
-    def __itruediv__(self, other):
-        """Increment (/=) operator for Raster
+    def __sub__(self, other):
+        """Subtract a Raster or number, returning a new Raster
         """
-        if type(other) is Raster:
-            if self.rows != other.rows or self.columns != other.columns:
-                raise Exception("Both rasters must have the same dimensions.")
+        return self._apply(operator.sub, other)
 
-            for i in range(self.rows * self.columns):
-                # row = int(math.floor(float(i) / float(self.columns)))
-                # col = int(float(i) % float(self.columns))
-                self._values[i] /= other._values[i]  # [row, col]
+    def __rsub__(self, other):
+        return self._apply(operator.sub, other, reverse=True)
 
-        elif (type(other) is int) or (type(other) is float):
-            for i in range(self.rows * self.columns):
-                self._values[i] /= float(other)
+    def __isub__(self, other):
+        """Decrement (-=) operator for Raster
+        """
+        return self._apply(operator.sub, other, in_place=True)
 
-        return self
+    def __mul__(self, other):
+        """Multiply by a Raster or number, returning a new Raster
+        """
+        return self._apply(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self._apply(operator.mul, other, reverse=True)
 
     def __imul__(self, other):
-        """Increment (*=) operator for Raster
+        """Multiply (*=) operator for Raster
         """
-        if type(other) is Raster:
-            if self.rows != other.rows or self.columns != other.columns:
-                raise Exception("Both rasters must have the same dimensions.")
+        return self._apply(operator.mul, other, in_place=True)
 
-            for i in range(self.rows * self.columns):
-                # row = int(math.floor(float(i) / float(self.columns)))
-                # col = int(float(i) % float(self.columns))
-                self._values[i] *= other._values[i]  # [row, col]
+    def __truediv__(self, other):
+        """Divide by a Raster or number, returning a new Raster. Division by
+        zero gives nodata.
+        """
+        return self._apply(_truediv, other, may_be_invalid=True)
 
-        elif (type(other) is int) or (type(other) is float):
-            for i in range(self.rows * self.columns):
-                self._values[i] *= float(other)
+    def __rtruediv__(self, other):
+        return self._apply(_truediv, other, reverse=True, may_be_invalid=True)
 
-        return self
+    def __itruediv__(self, other):
+        """Divide (/=) operator for Raster
+        """
+        return self._apply(_truediv, other, in_place=True, may_be_invalid=True)
 
-    def __add__(self, other):
-        """Add two Raster
+    def __pow__(self, other):
+        """Raise to the power of a Raster or number, returning a new Raster.
+        Results that are undefined or overflow give nodata.
         """
-        if type(other) is Raster:
-            if self.rows != other.rows or self.columns != other.columns:
-                raise Exception("Both rasters must have the same dimensions.")
+        return self._apply(_pow, other, may_be_invalid=True)
 
-            for i in range(self.rows * self.columns):
-                if self._values[i] != self.nodata or other._values[i] != other.nodata:
-                    self._values[i] += other._values[i]
+    def __rpow__(self, other):
+        return self._apply(_pow, other, reverse=True, may_be_invalid=True)
 
-        elif (type(other) is int) or (type(other) is float):
-            for i in range(self.rows * self.columns):
-                if self._values[i] != self.nodata:
-                    self._values[i] += other
+    def __ipow__(self, other):
+        """Power (**=) operator for Raster
+        """
+        return self._apply(_pow, other, in_place=True, may_be_invalid=True)
 
-        return self
+    def __neg__(self):
+        return self._apply(operator.neg)
 
-    def __mul__(self, other):
-        """Add two Raster
+    def __abs__(self):
+        return self._apply(abs)
+
+    def sqrt(self, in_place=False):
+        """Square root of each cell; negative cells give nodata
         """
-        if type(other) is Raster:
-            if self.rows != other.rows or self.columns != other.columns:
-                raise Exception("Both rasters must have the same dimensions.")
+        return self._apply(_sqrt, in_place=in_place, may_be_invalid=True)
 
-            for i in range(self.rows * self.columns):
-                if self._values[i] != self.nodata or other._values[i] != other.nodata:
-                    self._values[i] *= other._values[i]
+    def log(self, in_place=False):
+        """Natural logarithm of each cell; cells <= 0 give nodata
+        """
+        return self._apply(_log, in_place=in_place, may_be_invalid=True)
 
-        elif (type(other) is int) or (type(other) is float):
-            for i in range(self.rows * self.columns):
-                if self._values[i] != self.nodata:
-                    self._values[i] *= other
+    def __lt__(self, other):
+        """Cell-wise comparison giving 1 where true and 0 where false
+        """
+        return self._apply(operator.lt, other)
 
-        return self
+    def __le__(self, other):
+        return self._apply(operator.le, other)
+
+    def __gt__(self, other):
+        return self._apply(operator.gt, other)
+
+    def __ge__(self, other):
+        return self._apply(operator.ge, other)
+
+    def equal(self, other):
+        """Cell-wise equality giving 1 where equal and 0 elsewhere. (The ==
+        operator compares whole rasters.)
+        """
+        return self._apply(operator.eq, other)
+
+    def not_equal(self, other):
+        return self._apply(operator.ne, other)
 
     def __eq__(self, other):
         if isinstance(other, Raster):
@@ -248,232 +1857,1336 @@ class Raster(object):
             return True
         return NotImplemented
 
-    def read(self):
-        # First, read the header file
-        self.metadata = []
-        with open(self.header_filename) as fp:
-            line = fp.readline()
-            while line:
-                line = line.strip()
-                if 'min:' in line.lower() and not 'display' in line.lower():
-                    self.minimum = float(line.split(':')[1].strip())
-                elif 'max:' in line.lower() and not 'display' in line.lower():
-                    self.maximum = float(line.split(':')[1].strip())
-                elif 'display min:' in line.lower():
-                    self.display_minimum = float(line.split(':')[1].strip())
-                elif 'display max:' in line.lower():
-                    self.display_maximum = float(line.split(':')[1].strip())
-                elif 'north:' in line.lower():
-                    self.north = float(line.split(':')[1].strip())
-                elif 'south:' in line.lower():
-                    self.south = float(line.split(':')[1].strip())
-                elif 'east:' in line.lower():
-                    self.east = float(line.split(':')[1].strip())
-                elif 'west:' in line.lower():
-                    self.west = float(line.split(':')[1].strip())
-                elif 'rows:' in line.lower():
-                    self.rows = int(line.split(':')[1].strip())
-                elif 'cols:' in line.lower():
-                    self.columns = int(line.split(':')[1].strip())
-                elif 'stacks:' in line.lower():
-                    self.stacks = int(line.split(':')[1].strip())
-                elif 'data type:' in line.lower():
-                    self.data_type = line.split(':')[1].strip().lower()
-                elif 'z units:' in line.lower():
-                    self.z_units = line.split(':')[1].strip()
-                elif 'xy units:' in line.lower():
-                    self.xy_units = line.split(':')[1].strip()
-                elif 'projection:' in line.lower():
-                    self.projection = line.split(':')[1].strip()
-                elif 'data scale:' in line.lower():
-                    self.data_scale = line.split(':')[1].strip().lower()
-                elif 'preferred palette:' in line.lower():
-                    self.palette = line.split(':')[1].strip()
-                elif 'nodata:' in line.lower():
-                    self.nodata = float(line.split(':')[1].strip())
-                elif 'byte order:' in line.lower():
-                    self.byte_order = line.split(':')[1].strip().lower()
-                elif 'palette nonlinearity:' in line.lower():
-                    self.palette_nonlinearity = float(
-                        line.split(':')[1].strip())
-                elif 'metadata' in line.lower():
-                    self.metadata.append(line.split(':')[1].strip())
-                else:
-                    print(line)
-
-                line = fp.readline()
-
-        self.resolution_x = (self.east - self.west) / self.columns
-        self.resolution_y = (self.north - self.south) / self.rows
-
-        # self._values = [self._nodata]*self._rows*self._columns
-        self._values = []
-        num_pixels = self.rows * self.columns
-
-        with open(self.data_filename, "rb") as binary_file:
-            # Read the whole file at once
-            data = binary_file.read()
-
-            data_size = 4
-            pack_format = ">"  # big endian
-            if any(s in self.byte_order for s in ("little_endian", "least", "lsb", "little")):
-                pack_format = "<"  # little endian
-
-            if self.data_type == 'float':
-                data_size = 4
-                pack_format += "f"
-            elif self.data_type == 'double':
-                data_size = 8
-                pack_format += "d"
-            elif self.data_type == 'integer':
-                data_size = 2
-                pack_format += "h"
-            elif self.data_type == 'byte':
-                data_size = 1
-                pack_format += "c"
-            elif self.data_type == 'i32':
-                data_size = 4
-                pack_format += "i"
-            else:
-                raise Exception("Unknown data type")
-
-            for p in range(num_pixels):
-                # Seek position and read N bytes
-                pos = p * data_size
-                val, = struct.unpack(pack_format, data[pos:pos + data_size])
-                self._values.append(val)
-
-    def write(self):
-        self.calculate_min_and_max()
+    @_instrumented('read', _measure_read)
+    def read(self, mmap=False, mode='r', overview=None):
+        """ Read the raster, or memory map it (see from_file). With
+        overview=n the level n overview is read instead and the raster
+        then refers to the overview's files.
+        """
+        if overview is not None:
+            self._set_filenames(self._overview(overview).header_filename)
+            self._overviews = None
+        self._statistics = None
+        self._unsaved = False
+        if mmap:
+            if not self.driver.can_map:
+                raise Exception("Rasters in the {} format cannot be memory mapped.".format(
+                    self.driver.name))
+            self._read_header()
+            self._map_data(mode)
+            return
+
+        self.close()
+        if cache.max_bytes:
+            cache.read(self)
+        else:
+            self.driver.read(self)
 
-        if self.display_maximum == float('-inf'):
-            self.display_maximum = self.maximum
+    def _read_header(self):
+        if cache.max_bytes:
+            cache.read_header(self)
+        else:
+            self.driver.read_header(self)
 
-        if self.display_minimum == float('inf'):
-            self.display_minimum = self.minimum
+    def _read_rows(self, first_row, last_row, first_col, last_col):
+        """ Read a block of cells from the data file, through the shared
+        cache when it is on
+        """
+        if cache.max_bytes:
+            return cache.read_rows(self, first_row, last_row, first_col, last_col)
+        return self.driver.read_rows(self, first_row, last_row, first_col, last_col)
 
-        # write the header data
-        with open(self.header_filename, 'w') as header_file:
-            header_file.write("Min:\t{}\n".format(self.minimum))
-            header_file.write("Max:\t{}\n".format(self.maximum))
-            header_file.write("North:\t{}\n".format(self.north))
-            header_file.write("South:\t{}\n".format(self.south))
-            header_file.write("East:\t{}\n".format(self.east))
-            header_file.write("West:\t{}\n".format(self.west))
-            header_file.write("Cols:\t{}\n".format(self.columns))
-            header_file.write("Rows:\t{}\n".format(self.rows))
-            header_file.write("Stacks:\t{}\n".format(self.stacks))
-            header_file.write("Data Type:\t{}\n".format(self.data_type))
-            header_file.write("Z Units:\t{}\n".format(self.z_units))
-            header_file.write("XY Units:\t{}\n".format(self.xy_units))
-            header_file.write("Projection:\t{}\n".format(self.projection))
-            header_file.write("Data Scale:\t{}\n".format(self.data_scale))
-            header_file.write(
-                "Display Min:\t{}\n".format(self.display_minimum))
-            header_file.write(
-                "Display Max:\t{}\n".format(self.display_maximum))
-            header_file.write("Preferred Palette:\t{}\n".format(
-                self.palette.replace('.pal', '.plt')))
-            header_file.write("NoData:\t{}\n".format(self.nodata))
-            if any(s in self.byte_order for s in ("little_endian", "least", "lsb", "little")):
-                header_file.write("Byte Order:\tLITTLE_ENDIAN\n")
-            else:
-                header_file.write("Byte Order:\tBIG_ENDIAN\n")
-            header_file.write("Palette Nonlinearity:\t{}\n".format(
-                self.palette_nonlinearity))
-            for v in self.metadata:
-                header_file.write(
-                    "Metadata Entry:\t{}\n".format(v.replace(":", ";")))
+    def _map_data(self, mode):
+        """ Memory map the data file in place of reading it
+        """
+        accesses = {'r': mmap.ACCESS_READ,
+                    'c': mmap.ACCESS_COPY, 'r+': mmap.ACCESS_WRITE}
+        if mode not in accesses:
+            raise Exception("Unknown memory map mode '{}'.".format(mode))
+
+        self.close()
+        _check_band_interleaved(self)
+        typecode = data_typecode(self.data_type)
+        size = self.rows * self.columns * array(typecode).itemsize
+        with open(self.data_filename, "r+b" if mode == 'r+' else "rb") as binary_file:
+            self._map = mmap.mmap(binary_file.fileno(),
+                                  size, access=accesses[mode])
+        self._map_mode = mode
+        self._map_filename = os.path.abspath(self.data_filename)
+
+        buffer = memoryview(self._map)
+        if _needs_byteswap(self.byte_order):
+            self._values = _SwappedValues(buffer, typecode)
+        else:
+            self._values = buffer.cast(typecode)
 
-        # write the binary data
-        with open(self.data_filename, "wb") as binary_file:
-            data_size = 4
-            pack_format = ">"  # big endian
-            if any(s in self.byte_order for s in ("little_endian", "least", "lsb", "little")):
-                pack_format = "<"  # little endian
-
-            if self.data_type == 'float':
-                data_size = 4
-                pack_format += "f"
-            elif self.data_type == 'double':
-                data_size = 8
-                pack_format += "d"
-            elif self.data_type == 'integer':
-                data_size = 2
-                pack_format += "h"
-            elif self.data_type == 'byte':
-                data_size = 1
-                pack_format += "c"
-            elif self.data_type == 'i32':
-                data_size = 4
-                pack_format += "i"
-            else:
-                raise Exception("Unknown data type")
+    def close(self):
+        """ Release the memory map of a memory-mapped raster. The raster
+        keeps its header but no longer has pixel values.
+        """
+        if self._map is not None:
+            self._values.release()
+            self._values = None
+            self._map.close()
+            self._map = None
+            self._map_mode = None
+
+    def _detach_map(self):
+        """ Copy memory-mapped values into memory and release the map
+        """
+        values = as_array(self._values[0:len(self._values)])
+        self.close()
+        self._values = values
 
-            data = bytearray()
-            num_pixels = self.rows * self.columns
-            for p in range(num_pixels):
-                vals = struct.pack(pack_format, self._values[p])
-                data.extend(vals)
+    @_instrumented('write', _measure_write)
+    def write(self):
+        self.driver.write(self)
+        self._unsaved = False
+        cache.invalidate(self.header_filename, self.data_filename)
+
+    def _write_header(self):
+        self.driver.write_header(self)
+
+    def iter_blocks(self, block_rows=256, halo=0):
+        """ Generate the raster as successive bands of block_rows rows.
+        Each item is (first_row, last_row, block), where block is a window
+        covering rows first_row - halo to last_row + halo (padded with
+        nodata beyond the edges) and block.row_offset is the raster row
+        of its first row. Only one band is held in memory at a time when
+        the raster is memory mapped or has no values loaded.
+        """
+        for first_row in range(0, self.rows, block_rows):
+            last_row = min(first_row + block_rows, self.rows)
+            block = self.read_window(first_row - halo, 0,
+                                     last_row - first_row + 2 * halo, self.columns)
+            yield first_row, last_row, block
+
+    def build_overviews(self, levels=(2, 4, 8, 16), method='mean', block_rows=256):
+        """ Build reduced-resolution copies of the raster, one for each level
+        n in levels, with 1/n of the rows and columns and n times the cell
+        size. Overview cells are the mean or maximum of the valid cells they
+        cover, or the cell nearest their centre for method 'nearest'. They
+        are saved next to the raster in its own format (dem.dep gives
+        dem.ovr2.dep, dem.ovr4.dep and so on) and served by
+        read(overview=n) and read_window(..., overview=n). All levels are
+        made in a single streamed pass, each from the finest level that
+        divides it. The raster must be written first if its cells have
+        changed.
+        """
+        if self._unsaved:
+            raise Exception("The raster has unsaved changes; write it before building overviews.")
+        if method not in ('mean', 'nearest', 'max'):
+            raise Exception("Unknown overview method '{}'.".format(method))
+        levels = sorted(set(levels))
+        if not levels or levels[0] < 2:
+            raise Exception("Overview levels must be integers of 2 or more.")
+
+        # bands hold whole overview rows of every level
+        band_rows = 1
+        for n in levels:
+            band_rows = band_rows * n // math.gcd(band_rows, n)
+        band_rows *= max(1, block_rows // band_rows)
+
+        data_type = self.data_type
+        if method == 'mean' and data_typecode(data_type) in _INTEGER_TYPECODES:
+            data_type = 'float'
+        typecode = data_typecode(data_type)
+
+        self._overviews = {}
+        writers = {}
+        for n in levels:
+            if os.path.exists(self._stamp_filename(n)):
+                os.remove(self._stamp_filename(n))
+        with contextlib.ExitStack() as stack:
+            for n in levels:
+                template = self._new_like(data_type)
+                template.rows = -(-self.rows // n)
+                template.columns = -(-self.columns // n)
+                template.resolution_x = self.resolution_x * n
+                template.resolution_y = self.resolution_y * n
+                template.south = self.north - template.rows * template.resolution_y
+                template.east = self.west + template.columns * template.resolution_x
+                writers[n] = stack.enter_context(
+                    RasterWriter(self._overview_filename(n), template))
+
+            nodata = self.nodata
+            for first_row, last_row, block in self.iter_blocks(band_rows):
+                rows = [block._values[i:i + block.columns]
+                        for i in range(0, len(block._values), block.columns)]
+                if method == 'mean':
+                    grids = {1: ([[0.0 if z == nodata else z for z in row] for row in rows],
+                                 [[0.0 if z == nodata else 1.0 for z in row] for row in rows])}
+                elif method == 'max':
+                    grids = {1: [[-_INF if z == nodata else z for z in row] for row in rows]}
+
+                for n in levels:
+                    if method == 'nearest':
+                        values = [z for row in _nearest_rows(rows, n) for z in row]
+                    else:
+                        m = max(m for m in grids if n % m == 0)
+                        if method == 'mean':
+                            sums, counts = grids[m]
+                            grids[n] = (_aggregate_rows(sums, n // m, operator.add, 0.0),
+                                        _aggregate_rows(counts, n // m, operator.add, 0.0))
+                            values = [s / c if c else nodata for sums_row, counts_row in zip(*grids[n])
+                                      for s, c in zip(sums_row, counts_row)]
+                        else:
+                            grids[n] = _aggregate_rows(grids[m], n // m, max, -_INF)
+                            values = [z if z != -_INF else nodata for row in grids[n] for z in row]
+                    writers[n].write_rows(convert_values(array('d', values), typecode),
+                                           len(values) // writers[n].raster.columns)
+
+        source = self._source_stamp()
+        if source is not None:
+            for n in levels:
+                with open(self._stamp_filename(n), 'w') as f:
+                    f.write(source)
+
+    def _overview_filename(self, n):
+        base, extension = os.path.splitext(self.header_filename)
+        return '{}.ovr{}{}'.format(base, n, extension)
+
+    def _stamp_filename(self, n):
+        """ The file recording the source stamp of the level n overview,
+        kept beside the overview since not every format has metadata
+        """
+        return self._overview_filename(n) + '.src'
 
-            binary_file.write(data)
+    def _source_stamp(self):
+        """ The size and modification time of the data file, recorded when
+        overviews are built to tell when they are out of date, or None when
+        there is no data file
+        """
+        if self.data_filename is None or not os.path.exists(self.data_filename):
+            return None
+        stat = os.stat(self.data_filename)
+        return 'overview of source size {} mtime {}'.format(stat.st_size, stat.st_mtime_ns)
+
+    def _overview(self, n):
+        """ The header of the level n overview, opened once and kept, after
+        checking that the raster has not changed since it was built
+        """
+        if self._overviews is None:
+            self._overviews = {}
+        if n not in self._overviews:
+            filename = self._overview_filename(n)
+            if not os.path.exists(filename):
+                raise Exception("The raster has no overview of level {}; "
+                                "make one with build_overviews.".format(n))
+            self._overviews[n] = Raster.open_header(filename)
+        overview = self._overviews[n]
+        source = self._source_stamp()
+        stamp = None
+        if os.path.exists(self._stamp_filename(n)):
+            with open(self._stamp_filename(n)) as f:
+                stamp = f.read()
+        if source is not None and stamp != source:
+            raise Exception("The overview of level {} is out of date; "
+                            "rebuild it with build_overviews.".format(n))
+        return overview
 
     def calculate_min_and_max(self):
         """ Figure out the minimum and maximum values
         """
-        for i in range(self.rows * self.columns):
-            z = self._values[i]
-            if z != self.nodata:
-                if z < self.minimum:
-                    self.minimum = z
-                if z > self.maximum:
-                    self.maximum = z
+        stats = self.statistics()
+        self.minimum = stats.minimum
+        self.maximum = stats.maximum
+
+    @_instrumented('statistics', _measure_statistics)
+    def statistics(self, bins=256, refresh=False):
+        """ RasterStatistics of the valid cells, computed in a single blocked
+        pass and cached until cells are changed through the Raster. Pass
+        refresh=True after editing the values through the .array view.
+        """
+        stats = self._statistics
+        if stats is None or refresh or stats.bins != bins:
+            stats = RasterStatistics(bins)
+            if self._values is None:
+                for _, _, block in self.iter_blocks():
+                    stats.update(block._values, self.nodata)
+            else:
+                for start in range(0, len(self._values), _CHUNK_CELLS):
+                    stats.update(
+                        self._values[start:start + _CHUNK_CELLS], self.nodata)
+            self._statistics = stats
+        return stats
+
+    def set_display_range(self, low_percentile=2.0, high_percentile=98.0):
+        """ Stretch the display range between two percentiles of the values
+        """
+        stats = self.statistics()
+        if stats.count:
+            self.display_minimum = stats.percentile(low_percentile)
+            self.display_maximum = stats.percentile(high_percentile)
+
+    # The coordinate transforms take a number, or a sequence of them which
+    # gives an array (or a NumPy array for NumPy input).
 
     def get_x_from_column(self, column):
-        return self.west + self.resolution_x / 2.0 + column * self.resolution_x
+        return _to_coordinates(column, self.resolution_x,
+                               self.west + self.resolution_x / 2.0)
 
     def get_y_from_row(self, row):
-        return self.north - self.resolution_y / 2.0 - row * self.resolution_y
+        return _to_coordinates(row, -self.resolution_y,
+                               self.north - self.resolution_y / 2.0)
 
     def get_column_from_x(self, x):
-        return math.floor((x - self.west) / self.resolution_x)
+        return _to_cells(x, self.resolution_x, self.west)
 
     def get_row_from_y(self, y):
-        return math.floor((self.north - y) / self.resolution_y)
+        return _to_cells(y, -self.resolution_y, self.north)
+
+    def sample(self, xs, ys, method='nearest', block_rows=256):
+        """ Values of the raster at the points (xs[i], ys[i]), as an array of
+        doubles. Method 'nearest' takes the cell holding each point, while
+        'bilinear' and 'bicubic' (Catmull-Rom) interpolate between the
+        centres of the 2 x 2 or 4 x 4 cells around it. Nodata cells and
+        cells beyond the edges are left out of the interpolation and the
+        remaining weights rescaled; bicubic falls back to bilinear next to
+        them. Points outside of the raster, or with no valid cell to draw
+        on, are nodata. Points are gathered by bands of block_rows rows and
+        only bands holding points are read, so a raster without values in
+        memory reads just those rows and a memory-mapped one just touches
+        their pages.
+        """
+        halos = {'nearest': 0, 'bilinear': 1, 'bicubic': 2}
+        if method not in halos:
+            raise Exception("Unknown sampling method '{}'.".format(method))
+        halo = halos[method]
+        nodata = self.nodata
+        west, north = self.west, self.north
+        resolution_x, resolution_y = self.resolution_x, self.resolution_y
+
+        # point positions in cells from the top-left corner, by band
+        us = array('d', [(x - west) / resolution_x for x in xs])
+        vs = array('d', [(north - y) / resolution_y for y in ys])
+        if len(us) != len(vs):
+            raise Exception("There must be as many y coordinates as x coordinates.")
+        bands = {}
+        for i, (u, v) in enumerate(zip(us, vs)):
+            if 0.0 <= u < self.columns and 0.0 <= v < self.rows:
+                bands.setdefault(int(v) // block_rows, []).append(i)
+
+        result = filled_array('d', nodata, len(us))
+        width = self.columns + 2 * halo
+        for band in sorted(bands):
+            top = band * block_rows - halo
+            z = self.read_window(top, -halo, block_rows + 2 * halo, width)._values
+            for i in bands[band]:
+                u = us[i]
+                v = vs[i]
+                if method == 'nearest':
+                    result[i] = z[(int(v) - top) * width + int(u)]
+                    continue
+
+                # the cell centres around the point are at half-cell offsets
+                u -= 0.5
+                v -= 0.5
+                column = math.floor(u)
+                row = math.floor(v)
+                fx = u - column
+                fy = v - row
+                index = (row - top) * width + column + halo
+                if method == 'bicubic':
+                    cells = [z[start:start + 4] for start in
+                             range(index - width - 1, index + 3 * width - 1, width)]
+                    if not any(nodata in row for row in cells):
+                        w0, w1, w2, w3 = _cubic_weights(fx)
+                        result[i] = sum(w * (w0 * a + w1 * b + w2 * c + w3 * d)
+                                        for w, (a, b, c, d) in zip(_cubic_weights(fy), cells))
+                        continue
+
+                total = weight = 0.0
+                for cell, w in ((z[index], (1.0 - fx) * (1.0 - fy)),
+                                (z[index + 1], fx * (1.0 - fy)),
+                                (z[index + width], (1.0 - fx) * fy),
+                                (z[index + width + 1], fx * fy)):
+                    if cell != nodata and w > 0.0:
+                        total += w * cell
+                        weight += w
+                if weight > 0.0:
+                    result[i] = total / weight
+        return result
+
+    def resample(self, target, method='nearest', output=None, block_rows=256):
+        """ Regrid the raster to a new cell size, given as a number or an
+        (x, y) pair, keeping the north-west corner, or onto the grid of a
+        target Raster. Method 'nearest', 'bilinear' or 'cubic' samples the
+        raster at the new cell centres (see sample); 'average' and 'mode'
+        aggregate the cells whose centres fall in each new cell, for
+        downsampling, and take the nearest cell where there are none. The
+        new grid is made a band of block_rows rows at a time, reading only
+        the rows of this raster under it, and is returned as a new Raster
+        or, when output is a file name, streamed to that file.
+        """
+        samplers = {'nearest': 'nearest', 'bilinear': 'bilinear', 'cubic': 'bicubic'}
+        if method not in samplers and method not in ('average', 'mode'):
+            raise Exception("Unknown resampling method '{}'.".format(method))
+        data_type = self.data_type
+        if method in ('bilinear', 'cubic', 'average'):
+            data_type = 'double' if self.data_type.lower() == 'double' else 'float'
+
+        grid = self._new_like(data_type)
+        if isinstance(target, Raster):
+            for attribute in ('rows', 'columns', 'north', 'south', 'east', 'west',
+                              'resolution_x', 'resolution_y'):
+                setattr(grid, attribute, getattr(target, attribute))
+        else:
+            grid.resolution_x, grid.resolution_y = target if isinstance(
+                target, (tuple, list)) else (target, target)
+            grid.columns = max(1, _snap((self.east - self.west) / grid.resolution_x, True))
+            grid.rows = max(1, _snap((self.north - self.south) / grid.resolution_y, True))
+            grid.east = grid.west + grid.columns * grid.resolution_x
+            grid.south = grid.north - grid.rows * grid.resolution_y
+
+        typecode = data_typecode(data_type)
+        xs = [grid.west + (j + 0.5) * grid.resolution_x for j in range(grid.columns)]
+        if method in ('average', 'mode'):
+            columns = _covered(self.west, self.resolution_x, self.columns,
+                               grid.west, grid.resolution_x, grid.columns)
+        with open_output(output, grid) as writer:
+            for first_row in range(0, grid.rows, block_rows):
+                last_row = min(first_row + block_rows, grid.rows)
+                # the rows of this raster under the band, plus a margin
+                top = math.floor((self.north - (grid.north - first_row * grid.resolution_y)) /
+                                 self.resolution_y) - 2
+                bottom = math.ceil((self.north - (grid.north - last_row * grid.resolution_y)) /
+                                   self.resolution_y) + 2
+                window = self.read_window(top, 0, bottom - top, self.columns)
+
+                if method in samplers:
+                    ys = [grid.north - (i + 0.5) * grid.resolution_y
+                          for i in range(first_row, last_row) for _ in xs]
+                    values = window.sample(xs * (last_row - first_row), ys,
+                                           samplers[method], block_rows=window.rows)
+                else:
+                    rows = _covered(-window.north, window.resolution_y, window.rows,
+                                    -(grid.north - first_row * grid.resolution_y),
+                                    grid.resolution_y, last_row - first_row)
+                    values = _aggregated(window, rows, columns, method)
+
+                writer.write_rows(convert_values(values, typecode), last_row - first_row)
+
+        if output is None:
+            return writer.raster
+
+    def align_to(self, other, method='nearest', output=None, block_rows=256):
+        """ Resample onto the grid of other, so that the two can be combined
+        cell by cell (see resample)
+        """
+        return self.resample(other, method, output, block_rows)
+
+    def crop(self, extent):
+        """ The part of the raster within extent, a Raster or a tuple of
+        (north, south, east, west), widened to whole cells of this raster,
+        as an in-memory window (see read_window)
+        """
+        if isinstance(extent, Raster):
+            extent = (extent.north, extent.south, extent.east, extent.west)
+        north, south, east, west = extent
+        first_row = _snap((self.north - north) / self.resolution_y, False)
+        last_row = _snap((self.north - south) / self.resolution_y, True)
+        first_col = _snap((west - self.west) / self.resolution_x, False)
+        last_col = _snap((east - self.west) / self.resolution_x, True)
+        return self.read_window(first_row, first_col,
+                                last_row - first_row, last_col - first_col)
 
 
 class Array2D(object):
+    """ A rows x columns grid of numbers held in a compact typed buffer, for
+    working grids. Reads of cells outside of the grid give nodata and writes
+    to them are ignored. Cells may also be read and assigned a block at a
+    time with slices, e.g. a2d[10:20, 5:8] = 0; blocks must lie in the grid.
+    """
+
     @staticmethod
-    def create(rows, columns, nodata=-32768.0, initial_value=None):
-        """ Constructor for Array2D
+    def create(rows, columns, nodata=-32768.0, initial_value=None, dtype='float64'):
+        """ Constructor for Array2D. The dtype is one of those in _DTYPES;
+        cells start at initial_value, or at nodata when it is None.
         """
+        if dtype not in _DTYPES:
+            raise Exception("Unknown dtype '{}'.".format(dtype))
         a2d = Array2D()
         a2d.rows = rows
         a2d.columns = columns
         a2d.nodata = nodata
+        a2d.dtype = dtype
         if initial_value is None:
-            a2d._values = [nodata] * rows * columns
-        else:
-            a2d._values = [initial_value] * rows * columns
+            initial_value = nodata
+        a2d._values = filled_array(_DTYPES[dtype], initial_value, rows * columns)
 
         return a2d
 
+    @property
+    def array(self):
+        """Zero-copy (rows, columns) view of the cell values
+        """
+        return _array_view(self._values, self.rows, self.columns)
+
     def __getitem__(self, pos):
-        """Array indexing operator for Array2D
+        """Array indexing operator for Array2D. Slices give a new Array2D.
         """
         row, column = pos
-        if row >= 0 and row < self.rows and column >= 0 and column < self.columns:
-            index = row * self.columns + column
-            if index >= 0 and index < len(self._values):
-                return self._values[index]
+        if self._is_block(row, column):
+            return self._get_block(row, column)
+        if 0 <= row < self.rows and 0 <= column < self.columns:
+            return self._values[row * self.columns + column]
 
         return self.nodata
 
     def __setitem__(self, pos, value):
-        """Array index assignment operator for Array2D
+        """Array index assignment operator for Array2D. Slices assign a block
+        from a number, an Array2D or Raster, or a flat sequence of values.
         """
         row, column = pos
-        if row >= 0 and row < self.rows and column >= 0 and column < self.columns:
+        if self._is_block(row, column):
+            self._set_block(row, column, value)
+            return
+        if 0 <= row < self.rows and 0 <= column < self.columns:
             index = row * self.columns + column
-            if index >= 0 and index < len(self._values):
+            try:
                 self._values[index] = value
+            except TypeError:
+                # integer storage; round floating-point values
+                self._values[index] = int(round(value))
+
+    def fill(self, value):
+        """ Set every cell to value, in place
+        """
+        chunk = filled_array(self._values.typecode, value, min(_CHUNK_CELLS, len(self._values)))
+        for start in range(0, len(self._values), len(chunk)):
+            stop = min(start + len(chunk), len(self._values))
+            self._values[start:stop] = chunk[:stop - start]
+
+    def copy(self):
+        """ An independent copy of the grid
+        """
+        a2d = Array2D()
+        a2d.rows = self.rows
+        a2d.columns = self.columns
+        a2d.nodata = self.nodata
+        a2d.dtype = self.dtype
+        a2d._values = self._values[:]
+        return a2d
+
+    def get_row(self, row):
+        """ A copy of one row, as an array
+        """
+        if not 0 <= row < self.rows:
+            raise Exception("Row {} is outside of the grid.".format(row))
+        return self._values[row * self.columns:(row + 1) * self.columns]
+
+    def set_row(self, row, values):
+        """ Set one row from a sequence of columns values
+        """
+        self._set_block(row, slice(None), values)
+
+    def _is_block(self, row, column):
+        """ Whether an index pair selects a block, as it does when either is
+        a slice; otherwise both must be integers
+        """
+        if isinstance(row, slice) or isinstance(column, slice):
+            return True
+        if not isinstance(row, numbers.Integral) or not isinstance(column, numbers.Integral):
+            raise Exception("Array2D indices must be integers or slices.")
+        return False
+
+    def _block_range(self, index, size):
+        """ The start and stop of an index or slice along a dimension
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            if step != 1:
+                raise Exception("Array2D blocks cannot have a step.")
+            return start, max(start, stop)
+        if not 0 <= index < size:
+            raise Exception("Index {} is outside of the grid.".format(index))
+        return index, index + 1
+
+    def _get_block(self, row, column):
+        first_row, last_row = self._block_range(row, self.rows)
+        first_col, last_col = self._block_range(column, self.columns)
+        block = Array2D()
+        block.rows = last_row - first_row
+        block.columns = last_col - first_col
+        block.nodata = self.nodata
+        block.dtype = self.dtype
+        block._values = array(self._values.typecode)
+        for r in range(first_row, last_row):
+            start = r * self.columns
+            block._values.extend(self._values[start + first_col:start + last_col])
+        return block
+
+    def _set_block(self, row, column, value):
+        first_row, last_row = self._block_range(row, self.rows)
+        first_col, last_col = self._block_range(column, self.columns)
+        width = last_col - first_col
+        typecode = self._values.typecode
+        if isinstance(value, (Array2D, Raster)):
+            if (value.rows, value.columns) != (last_row - first_row, width):
+                raise Exception("The block does not match the shape of the slice.")
+            value = value._values
+        elif isinstance(value, numbers.Number):
+            value = filled_array(typecode, value, (last_row - first_row) * width)
+        elif len(value) != (last_row - first_row) * width:
+            raise Exception("The block does not match the shape of the slice.")
+
+        for r in range(first_row, last_row):
+            start = (r - first_row) * width
+            values = value[start:start + width]
+            if isinstance(values, memoryview):
+                values = as_array(values)
+            elif not isinstance(values, array):
+                values = array('d', values)
+            start = r * self.columns + first_col
+            self._values[start:start + width] = convert_values(values, typecode)
+
+
+def _as_raster_operand(value, like):
+    """ A Raster, or a number, taking its grid from like
+    """
+    if isinstance(value, Raster):
+        if value.rows != like.rows or value.columns != like.columns:
+            raise Exception("Both rasters must have the same dimensions.")
+    return value
+
+
+def where(condition, a, b):
+    """ A raster taking cells from a where condition is non-zero and from b
+    elsewhere. a and b may be Rasters or numbers; cells that are nodata in
+    condition, or in the chosen operand, are nodata.
+    """
+    if any(isinstance(r, RasterExpression) for r in (condition, a, b)):
+        if isinstance(condition, Raster):
+            condition = condition.lazy()
+        return condition._combine(_where, a, b)
+
+    a = _as_raster_operand(a, condition)
+    b = _as_raster_operand(b, condition)
+    data_type = 'float'
+    for r in (a, b):
+        if isinstance(r, Raster) and r.data_type.lower() == 'double':
+            data_type = 'double'
+
+    result = condition._new_like(data_type)
+    nodata, nc = result.nodata, condition.nodata
+    for start in range(0, condition.rows * condition.columns, _CHUNK_CELLS):
+        stop = min(start + _CHUNK_CELLS, condition.rows * condition.columns)
+        cs = condition._values[start:stop]
+        if isinstance(a, Raster):
+            xs, na = a._values[start:stop], a.nodata
+        else:
+            xs, na = [a] * (stop - start), None
+        if isinstance(b, Raster):
+            ys, nb = b._values[start:stop], b.nodata
+        else:
+            ys, nb = [b] * (stop - start), None
+
+        result._values.fromlist([
+            nodata if c == nc else
+            (nodata if x == na else x) if c else
+            (nodata if y == nb else y)
+            for c, x, y in zip(cs, xs, ys)])
+
+    return result
+
+
+def minimum(a, b):
+    """ Cell-wise minimum of a Raster and a Raster or number, in either order
+    """
+    if not isinstance(a, (Raster, RasterExpression)):
+        a, b = b, a
+    if isinstance(b, RasterExpression) and isinstance(a, Raster):
+        a = a.lazy()
+    if isinstance(a, RasterExpression):
+        return a._combine(_min, b)
+    return a._apply(min, b)
+
+
+def maximum(a, b):
+    """ Cell-wise maximum of a Raster and a Raster or number, in either order
+    """
+    if not isinstance(a, (Raster, RasterExpression)):
+        a, b = b, a
+    if isinstance(b, RasterExpression) and isinstance(a, Raster):
+        a = a.lazy()
+    if isinstance(a, RasterExpression):
+        return a._combine(_max, b)
+    return a._apply(max, b)
+
+
+class RasterStatistics(object):
+    """ Streaming accumulator of the count, minimum, maximum, mean, standard
+    deviation and histogram of the valid cells of a raster. Blocks of values
+    are added with update(). The histogram has a fixed number of bins whose
+    width doubles, merging neighbouring bins, whenever a value falls outside
+    of its range, so percentiles are approximate to within a bin.
+    """
+
+    def __init__(self, bins=256):
+        if bins < 2 or bins % 2:
+            raise Exception("The number of bins must be even.")
+        self.bins = bins
+        self.count = 0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self._shift = None
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._low = None
+        self._width = None
+        self._counts = [0] * bins
+
+    def update(self, values, nodata):
+        """ Add a block of values, skipping nodata (and NaN) cells
+        """
+        valid = [z for z in values if z != nodata and z == z]
+        if not valid:
+            return
+
+        low, high = min(valid), max(valid)
+        self.count += len(valid)
+        self.minimum = min(self.minimum, low)
+        self.maximum = max(self.maximum, high)
+
+        # sums are taken about the first value seen, which keeps the variance
+        # from being lost to rounding when the mean is large
+        if self._shift is None:
+            self._shift = valid[0]
+        shift = self._shift
+        self._sum += sum(z - shift for z in valid)
+        self._sum_squares += sum((z - shift) * (z - shift) for z in valid)
+
+        if self._low is None:
+            self._low = low
+            self._width = (high - low) / self.bins or abs(low) * 1e-9 or 1e-9
+        self._expand(low, high)
+
+        scale = 1.0 / self._width
+        top = self.bins - 1
+        origin = self._low
+        for index, n in Counter(int((z - origin) * scale) for z in valid).items():
+            self._counts[min(index, top)] += n
+
+    def _expand(self, low, high):
+        """ Double the bin width until the histogram covers low to high
+        """
+        n = self.bins
+        while low < self._low or high >= self._low + self._width * n:
+            merged = [self._counts[i] + self._counts[i + 1]
+                      for i in range(0, n, 2)]
+            if low < self._low:
+                self._counts = [0] * (n // 2) + merged
+                self._low -= self._width * n
+            else:
+                self._counts = merged + [0] * (n // 2)
+            self._width *= 2.0
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self._shift + self._sum / self.count
+
+    @property
+    def std(self):
+        """ Population standard deviation
+        """
+        if not self.count:
+            return None
+        mean = self._sum / self.count
+        return math.sqrt(max(0.0, self._sum_squares / self.count - mean * mean))
+
+    @property
+    def histogram(self):
+        """ (edges, counts), where bin i holds values from edges[i] up to
+        edges[i + 1]
+        """
+        if not self.count:
+            return [], []
+        edges = [self._low + i * self._width for i in range(self.bins + 1)]
+        return edges, list(self._counts)
+
+    def percentile(self, p):
+        """ Approximate value below which p percent of the cells fall,
+        interpolated within the histogram bin that contains it
+        """
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        cumulative = 0
+        for i, n in enumerate(self._counts):
+            if n and cumulative + n >= target:
+                z = self._low + (i + (target - cumulative) / n) * self._width
+                return min(max(z, self.minimum), self.maximum)
+            cumulative += n
+        return self.maximum
+
+
+class RasterWriter(object):
+    """ Streams row bands, in order, to a new raster with the same grid as
+    other. The minimum and maximum are accumulated as bands are written and
+    the header is saved by close(). Use it as a context manager:
+
+        with RasterWriter('out.dep', raster) as writer:
+            for first_row, last_row, block in raster.iter_blocks(halo=1):
+                ...
+                writer.write_block(block, 1, last_row - first_row)
+    """
+
+    def __init__(self, filename, other, data_type=None, nodata=None):
+        self.raster = Raster()
+        self.raster._set_filenames(filename)
+
+        self.raster._copy_header(other, data_type, nodata)
+        self.statistics = RasterStatistics()
+        self.rows_written = 0
+        self._writer = self.raster.driver.open_writer(self.raster)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def write_block(self, block, first_row=0, rows=None):
+        """ Append rows first_row to first_row + rows of a Raster or Array2D
+        block with the same number of columns as the output
+        """
+        r = self.raster
+        if block.columns != r.columns:
+            raise Exception("Blocks must have the same number of columns as the raster.")
+        if rows is None:
+            rows = block.rows - first_row
+        if self.rows_written + rows > r.rows:
+            raise Exception("Too many rows written to the raster.")
+
+        start = first_row * block.columns
+        self.write_rows(
+            as_array(block._values[start:start + rows * block.columns]), rows)
+
+    @_instrumented('write_rows', _measure_write_rows)
+    def write_rows(self, values, rows):
+        """ Append rows rows of cells, given as an array of the output's
+        typecode
+        """
+        r = self.raster
+        self._writer.write_rows(values)
+        self.rows_written += rows
+
+        self.statistics.update(values, r.nodata)
+        r.minimum = self.statistics.minimum
+        r.maximum = self.statistics.maximum
+
+    def close(self):
+        """ Finish the data file and save the header
+        """
+        if self._writer is None:
+            return
+        writer = self._writer
+        self._writer = None
+        if self.rows_written != self.raster.rows:
+            writer.close()
+            raise Exception("Only {} of {} rows were written.".format(
+                self.rows_written, self.raster.rows))
+        writer.finish()
+        cache.invalidate(self.raster.header_filename, self.raster.data_filename)
+
+
+class _MemoryWriter(object):
+    """ Collects row bands into an in-memory raster, in place of a
+    RasterWriter when a result is returned rather than written
+    """
+
+    def __init__(self, other, data_type=None, nodata=None):
+        self.raster = other._new_like(data_type, nodata)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def write_rows(self, values, rows):
+        self.raster._values.extend(values)
+
+
+def open_output(output, other, data_type=None, nodata=None):
+    """ Somewhere to stream a result with the grid of other, a row band at a
+    time with write_rows: a RasterWriter for the file output, or when
+    output is None an in-memory raster, given by the writer's raster. Use
+    it as a context manager; files are only finished when no error is
+    raised.
+    """
+    if output is None:
+        return _MemoryWriter(other, data_type, nodata)
+    return RasterWriter(output, other, data_type, nodata)
+
+
+def finish_output(result, output):
+    """ Return the in-memory raster result, or write it to output when that
+    is a file name
+    """
+    if output is None:
+        return result
+    result._set_filenames(output)
+    result.write()
+
+
+def cell_values(raster):
+    """ The cells of a raster, read from its file if they are not in memory
+    """
+    if raster._values is None:
+        return raster.read_window(0, 0, raster.rows, raster.columns)._values
+    return raster._values
+
+
+# per-cell reductions of the bands of a RasterStack
+REDUCTIONS = ('mean', 'max', 'argmax', 'slope', 'count')
+
+# nodata value of argmax results
+_BAND_NODATA = -32768.0
+
+
+class RasterStack(object):
+    """ Bands of cells on one grid, such as a time series of daily grids,
+    held together in a single typed array. The bands are stored one after
+    another (interleave 'band') or with the values of each cell side by
+    side (interleave 'pixel'). Multi-stack Whitebox rasters are read and
+    written with their Stacks field giving the number of bands; pixel
+    interleaved files also have an Interleave field.
+    """
+
+    def __init__(self, header, bands, interleave='band', values=None):
+        """ A stack of bands with the grid, nodata value and data type of
+        the Raster header, holding values, or nodata when values is None
+        """
+        if interleave not in ('band', 'pixel'):
+            raise Exception("Interleave must be 'band' or 'pixel'.")
+        self.header = Raster()
+        self.header.header_filename = getattr(header, 'header_filename', None)
+        self.header.data_filename = getattr(header, 'data_filename', None)
+        self.header.driver = header.driver
+        self.header._copy_header(header)
+        self.header.metadata = list(getattr(header, 'metadata', []))
+        self.rows = header.rows
+        self.columns = header.columns
+        self.nodata = header.nodata
+        self.data_type = header.data_type
+        self.bands = bands
+        self.interleave = interleave
+        count = self.rows * self.columns * bands
+        if values is None:
+            values = filled_array(data_typecode(self.data_type), self.nodata, count)
+        elif len(values) != count:
+            raise Exception("Expected {} values for {} bands but got {}.".format(
+                count, bands, len(values)))
+        self._values = values
+
+    @staticmethod
+    def from_file(filename):
+        """ Read all of the bands of a Whitebox raster
+        """
+        header = Raster.open_header(filename)
+        if not isinstance(header.driver, WhiteboxDriver):
+            raise Exception("Raster stacks can only be read from Whitebox rasters.")
+        values = array(data_typecode(header.data_type))
+        with open(header.data_filename, "rb") as binary_file:
+            values.fromfile(binary_file, header.rows * header.columns * header.stacks)
+        if _needs_byteswap(header.byte_order):
+            values.byteswap()
+        return RasterStack(header, header.stacks, header.interleave, values)
+
+    @staticmethod
+    def from_rasters(rasters, interleave='band'):
+        """ Stack copies of the values of Rasters with the same grid, taking
+        the header of the first
+        """
+        rasters = list(rasters)
+        if not rasters:
+            raise Exception("There must be at least one raster to stack.")
+        first = rasters[0]
+        for r in rasters[1:]:
+            if (r.rows, r.columns) != (first.rows, first.columns):
+                raise Exception("All of the rasters must have the same dimensions.")
+        stack = RasterStack(first, len(rasters), interleave)
+        typecode = buffer_typecode(stack._values)
+        for band, r in enumerate(rasters):
+            values = convert_values(as_array(r._values[0:len(r._values)]), typecode)
+            stack._band_values(band)[0:len(values)] = memoryview(values)
+        return stack
+
+    def __len__(self):
+        return self.bands
+
+    def __getitem__(self, band):
+        return self.band(band)
+
+    def band(self, band):
+        """ A Raster viewing the cells of one band without copying them, so
+        that changes to either are seen in both. For pixel interleaving the
+        cells are strided, and the Raster's array view needs NumPy.
+        """
+        if not 0 <= band < self.bands:
+            raise Exception("There is no band {}.".format(band))
+        r = self.header._new_like()
+        r._values = self._band_values(band)
+        r.row_offset = r.column_offset = 0
+        return r
+
+    def _band_values(self, band):
+        """ A memoryview of the cells of one band
+        """
+        view = memoryview(self._values)
+        if self.interleave == 'band':
+            count = self.rows * self.columns
+            return view[band * count:(band + 1) * count]
+        return view[band::self.bands]
+
+    @property
+    def array(self):
+        """ Zero-copy view of the values, with shape (bands, rows, columns)
+        for band interleaving and (rows, columns, bands) for pixel
+        interleaving. This is a NumPy ndarray when NumPy is installed and
+        a memoryview otherwise.
+        """
+        if self.interleave == 'band':
+            shape = (self.bands, self.rows, self.columns)
+        else:
+            shape = (self.rows, self.columns, self.bands)
+        view = _array_view(self._values, self.bands * self.rows, self.columns)
+        if isinstance(view, memoryview):
+            if not len(self._values):
+                return view
+            return memoryview(self._values).cast('B').cast(self._values.typecode, list(shape))
+        return view.reshape(shape)
+
+    def interleaved(self, interleave):
+        """ A copy of the stack with the given interleaving
+        """
+        stack = RasterStack(self.header, self.bands, interleave)
+        for band in range(self.bands):
+            stack._band_values(band)[:] = self._band_values(band)
+        return stack
+
+    def write(self, filename=None):
+        """ Write the stack to a Whitebox raster, by default the file it was
+        read from
+        """
+        filename = filename or self.header.header_filename
+        if filename is None:
+            raise Exception("The stack has no file name to write to.")
+        r = Raster()
+        r._set_filenames(filename)
+        if not isinstance(r.driver, WhiteboxDriver):
+            raise Exception("Raster stacks can only be written to Whitebox rasters.")
+        r._copy_header(self.header)
+        r.metadata = list(self.header.metadata)
+        r.stacks = self.bands
+        r.interleave = self.interleave
+        r._values = self._values
+        r.calculate_min_and_max()
+        r.driver.write_header(r)
+        with open(r.data_filename, "wb") as binary_file:
+            _write_values(binary_file, self._values, r.data_type, r.byte_order)
+        cache.invalidate(r.header_filename, r.data_filename)
+
+    def reduce(self, statistic='mean', times=None, output=None, block_rows=256):
+        """ Reduce the bands, cell by cell, to a Raster of their mean, max,
+        argmax (the first band holding the maximum), slope (of the least
+        squares linear trend against times, by default the band numbers)
+        or count of valid values. Nodata values are left out, and cells
+        without values (or, for the slope, without values at two times)
+        are nodata. Cells are reduced a band of block_rows rows at a time,
+        gathering the band's values into pixel order so that each cell's
+        values are reduced together by builtins such as sum and max. The
+        result is returned or, when output is a file name, streamed to that
+        file.
+        """
+        if statistic not in REDUCTIONS:
+            raise Exception("Unknown reduction '{}'.".format(statistic))
+        if times is None:
+            times = range(self.bands)
+        elif len(times) != self.bands:
+            raise Exception("There must be one time for each band.")
+        # the slope does not change when the times are shifted; centre them
+        # so that the sums of squares lose no precision
+        centre = sum(times) / float(self.bands)
+        times = [t - centre for t in times]
+
+        result = self.header._new_like()
+        if statistic in ('argmax', 'count'):
+            result.data_type = 'integer'
+            result.nodata = _BAND_NODATA
+        elif statistic != 'max' and result.data_type != 'double':
+            result.data_type = 'float'
+        typecode = data_typecode(result.data_type)
+
+        with open_output(output, result) as writer:
+            for first_row in range(0, self.rows, block_rows):
+                last_row = min(first_row + block_rows, self.rows)
+                values = convert_values(array('d', self._reduce_cells(
+                    statistic, times, first_row * self.columns,
+                    last_row * self.columns, result.nodata)), typecode)
+                writer.write_rows(values, last_row - first_row)
+        if output is None:
+            return writer.raster
+
+    def _cells(self, band, start, stop):
+        """ An array of the values of cells start to stop of one band
+        """
+        if self.interleave == 'band':
+            offset = band * self.rows * self.columns
+            return self._values[offset + start:offset + stop]
+        return self._values[start * self.bands + band:stop * self.bands:self.bands]
+
+    def _pixels(self, start, stop):
+        """ An array of the values of cells start to stop in pixel order, the
+        values of each cell together
+        """
+        if self.interleave == 'pixel':
+            return self._values[start * self.bands:stop * self.bands]
+        block = filled_array(self._values.typecode, 0, (stop - start) * self.bands)
+        for band in range(self.bands):
+            block[band::self.bands] = self._cells(band, start, stop)
+        return block
+
+    def _reduce_cells(self, statistic, times, start, stop, result_nodata):
+        """ Reduce the values of each of cells start to stop in turn with
+        builtins, which only need help from Python for cells with nodata
+        """
+        nodata = self.nodata
+        bands = self.bands
+        block = self._pixels(start, stop)
+        cells = (block[i:i + bands] for i in range(0, len(block), bands))
+        if statistic == 'count':
+            return [bands - values.count(nodata) for values in cells]
+
+        results = []
+        if statistic == 'slope':
+            sxx = sum(x * x for x in times)
+            for values in cells:
+                if nodata not in values:
+                    results.append(sum(map(operator.mul, times, values)) / sxx
+                                   if bands > 1 and sxx > 0.0 else result_nodata)
+                    continue
+                valid = [(x, v) for x, v in zip(times, values) if v != nodata]
+                mean = sum(x for x, _ in valid) / max(len(valid), 1)
+                d = sum((x - mean) ** 2 for x, _ in valid)
+                results.append(sum((x - mean) * v for x, v in valid) / d
+                               if len(valid) > 1 and d > 0.0 else result_nodata)
+            return results
+
+        for values in cells:
+            if nodata in values:
+                values = [v for v in values if v != nodata]
+                if not values:
+                    results.append(result_nodata)
+                    continue
+            if statistic == 'mean':
+                results.append(sum(values) / len(values))
+            elif statistic == 'max':
+                results.append(max(values))
+            else:
+                # the band of the first maximum, among all of the bands
+                offset = len(results) * bands
+                results.append(block.index(max(values), offset) - offset)
+        return results
+
+
+def _nan_aware(func):
+    """ Wrap func so that it returns NaN when any argument is NaN
+    """
+    def wrapped(*args):
+        for a in args:
+            if a != a:
+                return _NAN
+        return func(*args)
+    return wrapped
+
+
+def _where(c, x, y):
+    if c != c:
+        return _NAN
+    return x if c else y
+
+
+# expression counterparts of functions that do not propagate NaN by themselves
+_lt = _nan_aware(operator.lt)
+_le = _nan_aware(operator.le)
+_gt = _nan_aware(operator.gt)
+_ge = _nan_aware(operator.ge)
+_eq = _nan_aware(operator.eq)
+_ne = _nan_aware(operator.ne)
+_min = _nan_aware(min)
+_max = _nan_aware(max)
+_expression_pow = _nan_aware(_pow)
+
+
+class RasterExpression(object):
+    """ A deferred raster algebra expression. Raster.lazy() gives the leaf
+    expression for a raster, and the usual operators on expressions build
+    a tree instead of computing anything. The tree is evaluated by
+    compute(), write() or element access in a single pass over blocks of
+    rows, with nodata and undefined results carried as NaN, so no
+    full-size intermediate rasters are ever created.
+    """
+
+    def __init__(self, func, operands):
+        self._func = func
+        self._operands = operands
+        rasters = self._rasters()
+        self.template = rasters[0]
+        for r in rasters[1:]:
+            if r.rows != self.template.rows or r.columns != self.template.columns:
+                raise Exception("Both rasters must have the same dimensions.")
+        self.rows = self.template.rows
+        self.columns = self.template.columns
+        self.nodata = self.template.nodata
+        self.data_type = 'float'
+        if any(r.data_type.lower() == 'double' for r in rasters):
+            self.data_type = 'double'
+
+    def _rasters(self):
+        if self._func is None:
+            return self._operands
+        rasters = []
+        for operand in self._operands:
+            if isinstance(operand, RasterExpression):
+                rasters.extend(operand._rasters())
+        return rasters
+
+    def _combine(self, func, *others):
+        return RasterExpression(func, [self] + [
+            o.lazy() if isinstance(o, Raster) else o for o in others])
+
+    def _reversed(self, func, other):
+        if isinstance(other, Raster):
+            other = other.lazy()
+        return RasterExpression(func, [other, self])
+
+    def _evaluate(self, start, stop):
+        """ Values of cells start to stop, with NaN for invalid cells
+        """
+        if self._func is None:
+            r = self._operands[0]
+            if r._values is None:
+                first_row = start // r.columns
+                last_row = (stop + r.columns - 1) // r.columns
+                window = r.read_window(
+                    first_row, 0, last_row - first_row, r.columns)
+                offset = first_row * r.columns
+                values = window._values[start - offset:stop - offset]
+            else:
+                values = r._values[start:stop]
+            nodata = r.nodata
+            return [_NAN if z == nodata else z for z in values]
+
+        args = [operand._evaluate(start, stop) if isinstance(operand, RasterExpression)
+                else itertools.repeat(operand, stop - start)
+                for operand in self._operands]
+        return list(map(self._func, *args))
+
+    def _blocks(self):
+        """ Generate (start, stop, values) for successive blocks of rows
+        """
+        rows_per_block = max(1, _CHUNK_CELLS // max(self.columns, 1))
+        for first_row in range(0, self.rows, rows_per_block):
+            start = first_row * self.columns
+            stop = min(first_row + rows_per_block, self.rows) * self.columns
+            nodata = self.nodata
+            values = [nodata if z != z else z for z in self._evaluate(start, stop)]
+            yield start, stop, values
+
+    def __getitem__(self, pos):
+        row, column = pos
+        if 0 <= row < self.rows and 0 <= column < self.columns:
+            index = row * self.columns + column
+            z = self._evaluate(index, index + 1)[0]
+            if z == z:
+                return z
+
+        return self.nodata
+
+    @_instrumented('compute', _measure_compute)
+    def compute(self):
+        """ Evaluate the expression into a new in-memory Raster
+        """
+        result = self.template._new_like(self.data_type)
+        for _, _, values in self._blocks():
+            result._values.fromlist(values)
+        return result
+
+    def write(self, filename):
+        """ Evaluate the expression straight into a raster file, one block of
+        rows at a time
+        """
+        with RasterWriter(filename, self.template, self.data_type) as writer:
+            typecode = data_typecode(self.data_type)
+            for start, stop, values in self._blocks():
+                writer.write_rows(array(typecode, values),
+                                   (stop - start) // self.columns)
+
+    def __add__(self, other):
+        return self._combine(operator.add, other)
+
+    def __radd__(self, other):
+        return self._reversed(operator.add, other)
+
+    def __sub__(self, other):
+        return self._combine(operator.sub, other)
+
+    def __rsub__(self, other):
+        return self._reversed(operator.sub, other)
+
+    def __mul__(self, other):
+        return self._combine(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self._reversed(operator.mul, other)
+
+    def __truediv__(self, other):
+        return self._combine(_truediv, other)
+
+    def __rtruediv__(self, other):
+        return self._reversed(_truediv, other)
+
+    def __pow__(self, other):
+        return self._combine(_expression_pow, other)
+
+    def __rpow__(self, other):
+        return self._reversed(_expression_pow, other)
+
+    def __neg__(self):
+        return self._combine(operator.neg)
+
+    def __abs__(self):
+        return self._combine(abs)
+
+    def sqrt(self):
+        return self._combine(_sqrt)
+
+    def log(self):
+        return self._combine(_log)
+
+    def __lt__(self, other):
+        return self._combine(_lt, other)
+
+    def __le__(self, other):
+        return self._combine(_le, other)
+
+    def __gt__(self, other):
+        return self._combine(_gt, other)
+
+    def __ge__(self, other):
+        return self._combine(_ge, other)
+
+    def equal(self, other):
+        return self._combine(_eq, other)
+
+    def not_equal(self, other):
+        return self._combine(_ne, other)
@@ -0,0 +1,144 @@
+import math
+from array import array
+from collections import defaultdict
+
+from raster import Array2D
+
+STATISTICS = ('count', 'sum', 'mean', 'min', 'max', 'std')
+
+
+def label(raster, connectivity=8, by_value=False, background=0.0, block_rows=256):
+    """ Label the connected regions of a Raster or Array2D with two-pass
+    union-find. Cells join a region when they touch it across an edge, or
+    for connectivity 8 also across a corner, and with by_value only when
+    they hold the same value (to label the patches of a categorical map).
+    Nodata cells, and cells equal to background unless it is None, are in
+    no region. Returns (labels, count), where labels is an int32 Array2D
+    numbering the regions 1 to count in the order they are first met,
+    row by row, with 0 outside of them. A raster without values in memory
+    is read a band of block_rows rows at a time.
+    """
+    if connectivity not in (4, 8):
+        raise Exception("Connectivity must be 4 or 8.")
+    rows, columns = raster.rows, raster.columns
+    nodata = raster.nodata
+    labels = Array2D.create(rows, columns, 0, dtype='int32')
+    out = labels._values
+    parent = array('i', [0])
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    # first pass: provisional labels, merging those that meet
+    previous = None
+    row = 0
+    for band in _bands(raster, block_rows):
+        for start in range(0, len(band), columns):
+            current = band[start:start + columns]
+            base = row * columns
+            for col in range(columns):
+                v = current[col]
+                if v == nodata or v == background:
+                    continue
+                found = []
+                if col > 0 and out[base + col - 1] and (not by_value or current[col - 1] == v):
+                    found.append(out[base + col - 1])
+                if previous is not None:
+                    above = base - columns
+                    for dx in ((-1, 0, 1) if connectivity == 8 else (0,)):
+                        x = col + dx
+                        if 0 <= x < columns and out[above + x] and (
+                                not by_value or previous[x] == v):
+                            found.append(out[above + x])
+                if not found:
+                    out[base + col] = len(parent)
+                    parent.append(len(parent))
+                    continue
+                roots = [find(a) for a in found]
+                root = min(roots)
+                for r in roots:
+                    parent[r] = root
+                out[base + col] = root
+            previous = current
+            row += 1
+
+    # second pass: number the merged regions consecutively
+    final = array('i', [0]) * len(parent)
+    count = 0
+    for i in range(1, len(parent)):
+        root = find(i)
+        if root == i:
+            count += 1
+            final[i] = count
+        else:
+            final[i] = final[root]
+    for start in range(0, len(out), columns):
+        out[start:start + columns] = array('i', [final[a] for a in out[start:start + columns]])
+    return labels, count
+
+
+def zonal_stats(zones, values, stats=STATISTICS, block_rows=256):
+    """ Statistics of the cells of values (a Raster or Array2D) within each
+    zone of zones (another with the same dimensions, such as the labels
+    made by label), as a dict mapping each zone to a dict of the requested
+    stats, from STATISTICS. Cells that are nodata in either grid are left
+    out; std is the population standard deviation. The grids are read
+    together in a single pass, a band of block_rows rows at a time, with
+    each band's cells grouped by zone and summarised with builtins.
+    """
+    for stat in stats:
+        if stat not in STATISTICS:
+            raise Exception("Unknown statistic '{}'.".format(stat))
+    if (zones.rows, zones.columns) != (values.rows, values.columns):
+        raise Exception("The zones and values must have the same dimensions.")
+    zone_nodata = zones.nodata
+    value_nodata = values.nodata
+    with_spread = 'std' in stats
+
+    # per zone: count, mean, sum of squared deviations, sum, min and max
+    totals = {}
+    for zone_band, value_band in zip(_bands(zones, block_rows), _bands(values, block_rows)):
+        groups = defaultdict(list)
+        for zone, v in zip(zone_band, value_band):
+            if zone != zone_nodata and v != value_nodata:
+                groups[zone].append(v)
+
+        for zone, group in groups.items():
+            n = len(group)
+            total = math.fsum(group)
+            mean = total / n
+            m2 = math.fsum([(v - mean) ** 2 for v in group]) if with_spread else 0.0
+            if zone not in totals:
+                totals[zone] = [n, mean, m2, total, min(group), max(group)]
+                continue
+            # combine with the earlier bands (Chan et al.)
+            t = totals[zone]
+            count = t[0] + n
+            delta = mean - t[1]
+            t[2] += m2 + delta * delta * t[0] * n / count
+            t[1] += delta * n / count
+            t[0] = count
+            t[3] += total
+            t[4] = min(t[4], min(group))
+            t[5] = max(t[5], max(group))
+
+    results = {}
+    for zone, (n, mean, m2, total, low, high) in totals.items():
+        summary = {'count': n, 'sum': total, 'mean': mean,
+                   'min': low, 'max': high, 'std': math.sqrt(m2 / n)}
+        results[zone] = dict((stat, summary[stat]) for stat in stats)
+    return results
+
+
+def _bands(grid, block_rows):
+    """ The cells of a Raster or Array2D, a band of block_rows rows at a time
+    """
+    for first_row in range(0, grid.rows, block_rows):
+        last_row = min(first_row + block_rows, grid.rows)
+        if grid._values is None:
+            yield grid.read_window(first_row, 0, last_row - first_row, grid.columns)._values
+        else:
+            yield grid._values[first_row * grid.columns:last_row * grid.columns]
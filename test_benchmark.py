@@ -0,0 +1,44 @@
+import os, json
+from raster import Raster
+from fixtures import temporary_directory
+import benchmark
+
+def testBenchmark():
+    print("Testing the benchmark harness:")
+    directory = temporary_directory()
+    filename = os.path.join(directory, 'synthetic.dep')
+    for data_type in ('float', 'byte'):
+        benchmark.synthetic_raster(filename, 30, 40, data_type, 'BIG_ENDIAN', seed=5)
+        r = Raster.from_file(filename)
+        assert (r.rows, r.columns, r.data_type, r.byte_order) == (30, 40, data_type, 'big_endian')
+        valid = [v for v in r._values if v != r.nodata]
+        assert 0 < len(r._values) - len(valid) < 50 and 0.0 <= min(valid) and max(valid) <= 1001.0
+        assert list(benchmark.synthetic_raster(filename, 30, 40, data_type, seed=5)._values) == list(r._values)
+
+    results = benchmark.run(20, 30, ('float', 'integer'), benchmark.BYTE_ORDERS, repeat=1, directory=directory)
+    names = [name for name, _, _ in benchmark.BENCHMARKS]
+    assert [result['name'] for result in results['results']] == names * 4
+    for result in results['results']:
+        assert result['seconds'] > 0.0 and result['peak_memory'] >= 0
+        assert abs(result['cells_per_second'] * result['seconds'] / 600 - (4 if result['name'] == 'algebra' else 1)) < 1e-6
+
+    # a baseline twice as fast flags everything; one twice as slow nothing
+    saved = json.loads(json.dumps(results))
+    for result in saved['results']:
+        result['seconds'] /= 2.0
+    assert len(benchmark.compare(results, saved)) == len(results['results'])
+    for result in saved['results']:
+        result['seconds'] *= 4.0
+    assert benchmark.compare(results, saved) == []
+
+    output_file = os.path.join(directory, 'results.json')
+    assert benchmark.main(['--rows', '10', '--columns', '12', '--repeat', '1', '--benchmarks', 'read', 'algebra',
+                           '--output', output_file]) == 0
+    with open(output_file) as f:
+        assert [result['name'] for result in json.load(f)['results']] == ['read', 'algebra']
+    try:
+        benchmark.run(10, 10, benchmarks=['nothing'])
+        assert False
+    except Exception:
+        pass
+    print("Done!")
@@ -0,0 +1,82 @@
+import os, math, random
+from raster import Raster
+from fixtures import make_raster, temporary_directory
+import distance
+
+def _random_raster(rows, columns, chance, nodata=-32768.0, seed=1):
+    """An in-memory raster of 2 x 1.5 cells, with chance of each cell being one
+    (else zero) and a few nodata cells
+    """
+    rng = random.Random(seed)
+
+    def cell(row, col):
+        p = rng.random()
+        return nodata if p < 0.05 else (1.0 if p < 0.05 + chance else 0.0)
+    return make_raster(rows, columns, cell, nodata, cell_size=(2.0, 1.5))
+
+def testEuclideanDistance():
+    print("Testing the Euclidean distance transform:")
+    raster = _random_raster(21, 17, 0.03)
+    targets = [(row, col) for row in range(raster.rows) for col in range(raster.columns)
+               if raster[row, col] == 1.0]
+    output_file = os.path.join(temporary_directory(), 'distance.dep')
+    distance.euclidean_distance(raster, output=output_file)
+    result = Raster.from_file(output_file)
+    for row in range(raster.rows):
+        for col in range(raster.columns):
+            if raster[row, col] == raster.nodata:
+                assert result[row, col] == result.nodata
+                continue
+            expected = min(math.hypot((row - y) * 1.5, (col - x) * 2.0) for y, x in targets)
+            assert abs(result[row, col] - expected) < 1e-4
+
+    empty = distance.euclidean_distance(_random_raster(4, 5, 0.0))
+    assert set(empty._values) == {empty.nodata}
+    print("Done!")
+
+def testCostDistance():
+    print("Testing cost distance:")
+    sources = _random_raster(15, 12, 0.02, seed=2)
+    cost = _random_raster(15, 12, 0.0, seed=3)
+    random.seed(4)
+    for row in range(cost.rows):
+        for col in range(cost.columns):
+            if cost[row, col] != cost.nodata:
+                cost[row, col] = random.choice((1.0, 2.0, 5.0, -1.0 if random.random() < 0.1 else 3.0))
+    accumulated, links = distance.cost_distance(sources, cost)
+
+    # relax every move until nothing improves
+    steps = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+    passable = lambda y, x: 0 <= y < cost.rows and 0 <= x < cost.columns and cost[y, x] >= 0.0
+    expected = {}
+    for row in range(cost.rows):
+        for col in range(cost.columns):
+            if passable(row, col) and sources[row, col] == 1.0:
+                expected[row, col] = 0.0
+    changed = True
+    while changed:
+        changed = False
+        for (y, x), d in list(expected.items()):
+            for dy, dx in steps:
+                if passable(y + dy, x + dx):
+                    nd = d + math.hypot(dy * 1.5, dx * 2.0) * (cost[y, x] + cost[y + dy, x + dx]) / 2.0
+                    if nd < expected.get((y + dy, x + dx), float('inf')) - 1e-9:
+                        expected[y + dy, x + dx] = nd
+                        changed = True
+
+    pointers = {1: (-1, 1), 2: (0, 1), 4: (1, 1), 8: (1, 0), 16: (1, -1), 32: (0, -1), 64: (-1, -1), 128: (-1, 0)}
+    for row in range(cost.rows):
+        for col in range(cost.columns):
+            if (row, col) not in expected:
+                assert accumulated[row, col] == cost.nodata and links[row, col] == 255
+                continue
+            assert abs(accumulated[row, col] - expected[row, col]) < 1e-9
+            if expected[row, col] == 0.0:
+                assert links[row, col] == 0
+                continue
+            # the back-link leads to the cell the least-cost path arrives from
+            dy, dx = pointers[links[row, col]]
+            y, x = row + dy, col + dx
+            step = math.hypot(dy * 1.5, dx * 2.0) * (cost[y, x] + cost[row, col]) / 2.0
+            assert abs(expected[y, x] + step - expected[row, col]) < 1e-9
+    print("Done!")
@@ -0,0 +1,97 @@
+import os, math, random
+from raster import Raster
+from fixtures import make_raster, temporary_directory
+import focal
+
+def _random_raster(rows, columns, nodata=-32768.0, seed=1):
+    """An in-memory raster of random values with a few nodata cells
+    """
+    rng = random.Random(seed)
+    return make_raster(rows, columns, lambda row, col: nodata if rng.random() < 0.1
+                       else float(rng.randint(0, 20)), nodata)
+
+def _neighbours(raster, row, col, radius):
+    return [raster[yn, xn] for yn in range(row - radius, row + radius + 1)
+            for xn in range(col - radius, col + radius + 1)
+            if raster[yn, xn] != raster.nodata]
+
+def _brute_force(values, statistic):
+    n = len(values)
+    if statistic == 'count':
+        return n
+    if statistic == 'sum':
+        return sum(values)
+    mean = sum(values) / n
+    if statistic == 'mean':
+        return mean
+    if statistic == 'std':
+        return math.sqrt(sum((z - mean) ** 2 for z in values) / n)
+    if statistic == 'min':
+        return min(values)
+    if statistic == 'max':
+        return max(values)
+    if statistic == 'range':
+        return max(values) - min(values)
+    values = sorted(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+def testFocalStatistics():
+    print("Testing focal statistics:")
+    raster = _random_raster(13, 9)
+    for size in (1, 3, 5):
+        for statistic in focal.STATISTICS:
+            result = focal.focal_statistics(raster, statistic, size, block_rows=4)
+            for row in range(raster.rows):
+                for col in range(raster.columns):
+                    if raster[row, col] == raster.nodata:
+                        assert result[row, col] == raster.nodata
+                    else:
+                        expected = _brute_force(_neighbours(raster, row, col, size // 2), statistic)
+                        assert abs(result[row, col] - expected) < 1e-4, (statistic, size, row, col)
+    print("Done!")
+
+def testFocalKernel():
+    print("Testing focal kernels:")
+    raster = _random_raster(10, 8)
+    kernel = [[1, 2, 1], [2, 4, 2], [1, 2, 1]]
+    result = focal.focal_kernel(raster, kernel, block_rows=3)
+    raw = focal.focal_kernel(raster, kernel, normalize=False)
+    for row in range(raster.rows):
+        for col in range(raster.columns):
+            if raster[row, col] == raster.nodata:
+                assert result[row, col] == raster.nodata
+                continue
+            total = weight = 0.0
+            for dy in range(3):
+                for dx in range(3):
+                    z = raster[row + dy - 1, col + dx - 1]
+                    if z != raster.nodata:
+                        total += kernel[dy][dx] * z
+                        weight += kernel[dy][dx]
+            assert abs(result[row, col] - total / weight) < 1e-4
+            assert abs(raw[row, col] - total) < 1e-4
+    print("Done!")
+
+def testEdgePreservingFilter():
+    print("Testing the edge-preserving filter:")
+    raster = _random_raster(12, 10)
+    threshold = 10.0
+    output_file = os.path.join(temporary_directory(), 'smoothed.dep')
+    focal.edge_preserving_filter(raster, 5, threshold, output=output_file, block_rows=5)
+    result = Raster.from_file(output_file)
+    for row in range(raster.rows):
+        for col in range(raster.columns):
+            z = raster[row, col]
+            if z == raster.nodata:
+                assert result[row, col] == raster.nodata
+                continue
+            sum_w = sum_zw = 0.0
+            for zn in _neighbours(raster, row, col, 2):
+                if abs(zn - z) < threshold:
+                    w = 1.0 - abs(zn - z) / threshold
+                    sum_w += w
+                    sum_zw += zn * w
+            assert abs(result[row, col] - sum_zw / sum_w) < 1e-4
+    print("Done!")
@@ -0,0 +1,118 @@
+import os, math, random
+from raster import Raster
+from fixtures import make_raster, temporary_directory
+import hydrology
+
+_OFFSETS = [(1, -1, 1), (2, 0, 1), (4, 1, 1), (8, 1, 0), (16, 1, -1), (32, 0, -1), (64, -1, -1), (128, -1, 0)]
+
+def _random_dem(rows, columns, nodata=-32768.0, seed=1):
+    """An in-memory DEM of random whole-number elevations with a few nodata cells
+    """
+    rng = random.Random(seed)
+    return make_raster(rows, columns, lambda row, col: nodata if rng.random() < 0.03
+                       else float(rng.randint(0, 30)), nodata, cell_size=(2.0, 1.0))
+
+def _is_outlet(dem, row, col):
+    """Edge cells and cells next to nodata drain out of the DEM
+    """
+    return any(dem[row + dy, col + dx] == dem.nodata for _, dy, dx in _OFFSETS)
+
+def _drains(result, row, col):
+    return any(result[row + dy, col + dx] < result[row, col] and result[row + dy, col + dx] != result.nodata
+               for _, dy, dx in _OFFSETS)
+
+def testFillDepressions():
+    print("Testing depression filling:")
+    dem = _random_dem(25, 20)
+
+    # the fill is the lowest surface over the DEM that drains, found by brute force
+    expected = {}
+    for row in range(dem.rows):
+        for col in range(dem.columns):
+            if dem[row, col] != dem.nodata:
+                expected[row, col] = dem[row, col] if _is_outlet(dem, row, col) else float('inf')
+    changed = True
+    while changed:
+        changed = False
+        for (row, col), w in expected.items():
+            lowest = min(expected.get((row + dy, col + dx), float('inf')) for _, dy, dx in _OFFSETS)
+            level = max(dem[row, col], lowest)
+            if level < w:
+                expected[row, col] = level
+                changed = True
+
+    filled = hydrology.fill_depressions(dem)
+    for row in range(dem.rows):
+        for col in range(dem.columns):
+            assert filled[row, col] == expected.get((row, col), dem.nodata)
+    assert filled.data_type == 'float' and dem[3, 3] == _random_dem(25, 20)[3, 3]
+
+    sloped = hydrology.fill_depressions(dem, epsilon=0.001)
+    breached = hydrology.fill_depressions(dem, breach=True)
+    for row in range(dem.rows):
+        for col in range(dem.columns):
+            z = dem[row, col]
+            if z == dem.nodata:
+                assert sloped[row, col] == breached[row, col] == dem.nodata
+                continue
+            assert expected[row, col] <= sloped[row, col] < expected[row, col] + 1.0
+            assert breached[row, col] <= z
+            if not _is_outlet(dem, row, col):
+                assert _drains(sloped, row, col) and _drains(breached, row, col)
+    print("Done!")
+
+def testFlowRouting():
+    print("Testing D8 flow direction and accumulation:")
+    dem = hydrology.fill_depressions(_random_dem(18, 22, seed=2), epsilon=0.01)
+    pointers = hydrology.flow_direction(dem, block_rows=5)
+    for row in range(dem.rows):
+        for col in range(dem.columns):
+            z = dem[row, col]
+            if z == dem.nodata:
+                assert pointers[row, col] == pointers.nodata
+                continue
+            best, pointer = 0.0, 0
+            for p, dy, dx in _OFFSETS:
+                zn = dem[row + dy, col + dx]
+                if zn != dem.nodata:
+                    drop = (z - zn) / math.hypot(dy * dem.resolution_y, dx * dem.resolution_x)
+                    if drop > best:
+                        best, pointer = drop, p
+            assert pointers[row, col] == pointer, (row, col)
+
+    # every cell adds one to itself and to each cell downslope of it
+    counts = {}
+    for row in range(dem.rows):
+        for col in range(dem.columns):
+            y, x = row, col
+            while pointers[y, x] != pointers.nodata:
+                counts[y, x] = counts.get((y, x), 0) + 1
+                moves = [(dy, dx) for p, dy, dx in _OFFSETS if p == pointers[y, x]]
+                if not moves:
+                    break
+                y, x = y + moves[0][0], x + moves[0][1]
+
+    output_file = os.path.join(temporary_directory(), 'accumulation.dep')
+    hydrology.flow_accumulation(pointers, output=output_file)
+    accumulation = Raster.from_file(output_file)
+    area = hydrology.flow_accumulation(pointers, 'area')
+    for row in range(dem.rows):
+        for col in range(dem.columns):
+            assert accumulation[row, col] == counts.get((row, col), accumulation.nodata)
+            if (row, col) in counts:
+                assert area[row, col] == counts[row, col] * 2.0
+
+    # the test DEM, from a file
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    dem = Raster.open_header(test_dir + 'test.dep').read_window(300, 200, 150, 120)
+    filled = hydrology.fill_depressions(dem, epsilon=0.0001)
+    pointers = hydrology.flow_direction(filled)
+    accumulation = hydrology.flow_accumulation(pointers)
+    for row in range(1, dem.rows - 1):
+        for col in range(1, dem.columns - 1):
+            if dem[row, col] != dem.nodata and not _is_outlet(dem, row, col):
+                assert pointers[row, col] != 0
+    outlets = sum(accumulation[row, col] for row in range(dem.rows) for col in range(dem.columns)
+                  if dem[row, col] != dem.nodata and pointers[row, col] == 0)
+    assert outlets == sum(1 for z in dem._values if z != dem.nodata)
+    print("Done!")
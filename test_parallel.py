@@ -0,0 +1,34 @@
+import os, functools
+from raster import Raster
+from fixtures import temporary_directory
+import focal
+import parallel
+
+def _scale(block):
+    return block * 2.0 - 100.0
+
+def testMapBlocks():
+    print("Testing parallel tiled execution:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep')
+    mean = functools.partial(focal.focal_statistics, statistic='mean', size=5)
+    expected = focal.focal_statistics(raster, 'mean', 5)
+
+    for executor in ('process', 'thread'):
+        result = parallel.map_blocks(mean, raster, halo=2, block_rows=150, workers=4, executor=executor)
+        assert result == expected
+        assert (result.display_minimum, result.display_maximum) == (float('inf'), float('-inf'))
+
+    scaled = parallel.map_blocks(_scale, raster, block_rows=300, workers=2)
+    assert scaled == raster * 2.0 - 100.0
+
+    # tiles of an unloaded raster are read from its own file
+    mapped = Raster.from_file(test_dir + 'test.dep', mmap=True)
+    output_file = os.path.join(temporary_directory(), 'mean.dep')
+    parallel.map_blocks(mean, mapped, output=output_file, halo=2, block_rows=128, workers=3)
+    written = Raster.from_file(output_file)
+    assert written == expected
+    assert written.minimum == min(z for z in expected._values if z != expected.nodata)
+    assert (written.display_minimum, written.display_maximum) == (written.minimum, written.maximum)
+    assert written.display_minimum != written.display_maximum
+    print("Done!")
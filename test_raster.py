@@ -1,5 +1,24 @@
-import os, math
-from raster import Raster, Array2D
+import os, math, struct, logging, tempfile
+from array import array
+import raster as raster_module
+import focal
+from concurrent.futures import ThreadPoolExecutor
+from raster import Raster, RasterWriter, RasterStack, Array2D
+from fixtures import make_raster, temporary_directory
+
+def _write_whitebox(header_file, data_type, byte_order, rows, columns, values, nodata=-32768.0):
+    """Writes a .dep/.tas pair by hand, independently of Raster.write
+    """
+    formats = {'float': 'f', 'double': 'd', 'integer': 'h', 'byte': 'B', 'i32': 'i'}
+    with open(header_file, 'w') as f:
+        f.write("Min:\t0\nMax:\t0\nNorth:\t{}\nSouth:\t0.0\nEast:\t{}\nWest:\t0.0\n".format(float(rows), float(columns)))
+        f.write("Cols:\t{}\nRows:\t{}\nStacks:\t1\nData Type:\t{}\n".format(columns, rows, data_type.upper()))
+        f.write("Z Units:\tnot specified\nXY Units:\tnot specified\nProjection:\tnot specified\n")
+        f.write("Data Scale:\tcontinuous\nDisplay Min:\t0\nDisplay Max:\t0\nPreferred Palette:\tspectrum.pal\n")
+        f.write("NoData:\t{}\nByte Order:\t{}\nPalette Nonlinearity:\t1.0\n".format(nodata, byte_order))
+    order = '<' if byte_order == 'LITTLE_ENDIAN' else '>'
+    with open(header_file.replace('.dep', '.tas'), 'wb') as f:
+        f.write(struct.pack('{}{}{}'.format(order, len(values), formats[data_type]), *values))
 
 def testRaster():
     print("Testing Raster:")
@@ -82,69 +101,885 @@ def testArray2D():
     assert total == 101.0
     print("Done!")
 
-def filter():
+def testArray2DTypes():
+    print("Testing typed Array2D grids:")
+    flags = Array2D.create(30, 40, nodata=255, initial_value=0, dtype='uint8')
+    assert flags._values.itemsize == 1 and flags.dtype == 'uint8'
+    assert flags[-1, 0] == 255
+    flags[3, 4] = 1
+    assert flags[3, 4] == 1
+    labels = Array2D.create(30, 40, nodata=-1, dtype='int32')
+    assert labels._values.typecode == 'i' and labels[0, 0] == -1
+    labels[1, 1] = 2.6
+    assert labels[1, 1] == 3
+    assert Array2D.create(2, 2, dtype='float32')._values.typecode == 'f'
+    try:
+        Array2D.create(2, 2, dtype='complex')
+        assert False
+    except Exception:
+        pass
+
+    # block reads and assignment through slices
+    labels[2:4, 5:8] = 7
+    assert labels[1:5, 5:9]._values.tolist() == [-1] * 4 + [7, 7, 7, -1] * 2 + [-1] * 4
+    block = labels[2:4, 5:8]
+    assert (block.rows, block.columns, block.dtype) == (2, 3, 'int32')
+    labels[10:12, 0:3] = block
+    assert labels[11, 2] == 7 and labels[12, 2] == -1
+    labels[0, :] = range(40)
+    assert labels.get_row(0).tolist() == list(range(40))
+    labels.set_row(29, [5.0] * 40)
+    assert labels[29, 39] == 5
+    try:
+        labels[0:2, 0:2] = [1, 2, 3]
+        assert False
+    except Exception:
+        pass
+
+    # slices are checked before the out-of-grid nodata of single cells
+    for read in (lambda: labels[-1, :], lambda: labels[30, 1:3], lambda: labels[1.5, 2]):
+        try:
+            read()
+            assert False
+        except Exception as e:
+            assert 'grid' in str(e) or 'integers' in str(e)
+    try:
+        labels[30, :] = 7
+        assert False
+    except Exception as e:
+        assert 'outside of the grid' in str(e)
+
+    copy = labels.copy()
+    copy.fill(0)
+    assert copy[0, 5] == 0 and labels[0, 5] == 5
+    assert sum(copy._values) == 0 and len(copy._values) == 1200
+    print("Done!")
+
+def testTypedStorage():
+    print("Testing typed storage:")
+    raster = Raster.create(None, 10, 20, -32768.0)
+    assert raster._values.typecode == 'f'
+    assert len(raster._values) == 200
+    assert raster[5, 5] == -32768.0
+    assert (raster.north, raster.south, raster.east, raster.west) == (10.0, 0.0, 20.0, 0.0)
+    assert raster.resolution_x == raster.resolution_y == 1.0 and raster.metadata == []
+    file_name = os.path.join(temporary_directory(), 'created.dep')
+    raster._set_filenames(file_name)
+    raster.write()
+    assert Raster.from_file(file_name).east == 20.0
+
+    raster[2, 3] = 1.5
+    view = raster.array
+    assert view[2, 3] == 1.5
+    view[4, 7] = 2.5
+    assert raster[4, 7] == 2.5
+
+    ints = Raster.create(None, 10, 20, -32768.0, data_type='integer')
+    assert ints._values.typecode == 'h'
+    ints[1, 1] = 3.7
+    assert ints[1, 1] == 4
+
+    a2d = Array2D.create(10, 20, initial_value=0.0)
+    a2d.array[9, 19] = 1.0
+    assert a2d[9, 19] == 1.0
+    print("Done!")
+
+def testReadDataTypes():
+    print("Testing bulk decoding:")
+    test_dir = temporary_directory()
+    values = [0, 1, 2, 3, 4, 5, 100, 127]
+    for data_type in ('float', 'double', 'integer', 'byte', 'i32'):
+        for byte_order in ('LITTLE_ENDIAN', 'BIG_ENDIAN'):
+            file_name = os.path.join(test_dir, '{}_{}.dep'.format(data_type, byte_order))
+            _write_whitebox(file_name, data_type, byte_order, 2, 4, values)
+            raster = Raster.from_file(file_name)
+            assert list(raster._values) == values
+            assert raster[1, 3] == 127
+    print("Done!")
+
+def testWriteDataTypes():
+    print("Testing bulk encoding:")
+    test_dir = temporary_directory()
+    values = [0, 1, 2, 3, 4, 5, 100, 127]
+    for data_type in ('float', 'double', 'integer', 'byte', 'i32'):
+        for byte_order in ('LITTLE_ENDIAN', 'BIG_ENDIAN'):
+            file_name = os.path.join(test_dir, 'in.dep')
+            _write_whitebox(file_name, data_type, byte_order, 2, 4, values, nodata=255)
+            raster = Raster.from_file(file_name)
+            out_name = os.path.join(test_dir, 'out.dep')
+            output = Raster.create_from_other(out_name, raster)
+            for i in range(8):
+                output[i // 4, i % 4] = raster[i // 4, i % 4]
+            output.write()
+            with open(file_name.replace('.dep', '.tas'), 'rb') as f:
+                expected = f.read()
+            with open(out_name.replace('.dep', '.tas'), 'rb') as f:
+                assert f.read() == expected
+            assert list(Raster.from_file(out_name)._values) == values
+    print("Done!")
+
+def testMemoryMap():
+    print("Testing memory-mapped rasters:")
     test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
-    test_file = test_dir + 'test.dep'
-    output_file = test_dir + 'delete_me.dep'
+    raster = Raster.from_file(test_dir + 'test.dep')
+    mapped = Raster.from_file(test_dir + 'test.dep', mmap=True)
+    for row, col in ((0, 0), (500, 250), (999, 999)):
+        assert mapped[row, col] == raster[row, col]
+    assert mapped[-1, 0] == mapped.nodata
+    mapped.close()
 
-    print('Reading data...')
-    raster = Raster.from_file(test_file)
+    out_dir = temporary_directory()
+    for byte_order in ('LITTLE_ENDIAN', 'BIG_ENDIAN'):
+        file_name = os.path.join(out_dir, byte_order + '.dep')
+        _write_whitebox(file_name, 'float', byte_order, 2, 4, [0, 1, 2, 3, 4, 5, 6, 7])
 
-    output = Raster.create_from_other(output_file, raster)
+        # edits to a copy-on-write map never reach the file until written
+        cow = Raster.from_file(file_name, mmap=True, mode='c')
+        cow[0, 1] = 10.0
+        assert cow[0, 1] == 10.0
+        assert Raster.from_file(file_name)[0, 1] == 1.0
+        cow.write()
+        assert Raster.from_file(file_name)[0, 1] == 10.0
 
-    filter_size = 7
-    mid_point = int(filter_size / 2.0)
-    dx = []
-    dy = []
-    for r in range(filter_size):
-        for c in range(filter_size):
-            dx.append(c - mid_point)
-            dy.append(r - mid_point)
+        # writable maps edit the file in place
+        writable = Raster.from_file(file_name, mmap=True, mode='r+')
+        writable[1, 2] = 20.0
+        writable.write()
+        writable.close()
+        values = list(Raster.from_file(file_name)._values)
+        assert values == [0, 10, 2, 3, 4, 5, 20, 7]
 
-    num_neighbours = len(dx)
-    threshold = 10.0
+        # integer maps round floating-point values, whatever the byte order
+        file_name = os.path.join(out_dir, byte_order + '_integer.dep')
+        _write_whitebox(file_name, 'integer', byte_order, 2, 4, [0, 1, 2, 3, 4, 5, 6, 7])
+        writable = Raster.from_file(file_name, mmap=True, mode='r+')
+        writable[0, 2] = 12.6
+        writable[1, 0] = -3.2
+        assert (writable[0, 2], writable[1, 0]) == (13, -3)
+        writable.write()
+        writable.close()
+        assert list(Raster.from_file(file_name)._values) == [0, 1, 13, 3, -3, 5, 6, 7]
+    print("Done!")
 
-    values = [0.0]*num_neighbours
-    w = [0.0]*num_neighbours
+def testWindows():
+    print("Testing windowed reads and writes:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep')
+    header_only = Raster.open_header(test_dir + 'test.dep')
 
-    old_progress = 1
-    for row in range(raster.rows):
-        for col in range(raster.columns):
-            z = raster[row, col]
-            if z != raster.nodata:
-                sum_w = 0.0
-                for n in range(num_neighbours):
-                    xn = col + dx[n]
-                    yn = row + dy[n]
-                    zn = raster[yn, xn]
-                    if zn != raster.nodata:
-                        values[n] = zn
-                        diff = math.fabs(zn - z)
-                        if diff < threshold:
-                            w[n] = 1.0 - diff / threshold
-                            sum_w += w[n]
-                        else:
-                            values[n] = 0.0
-                            w[n] = 0.0
+    for source in (raster, header_only):
+        window = source.read_window(10, 20, 5, 8)
+        assert window.rows == 5 and window.columns == 8
+        assert window[0, 0] == raster[10, 20]
+        assert window[4, 7] == raster[14, 27]
+        assert window.north == raster.north - 10 * raster.resolution_y
+        assert window.west == raster.west + 20 * raster.resolution_x
+        assert window.get_x_from_column(0) == raster.get_x_from_column(20)
+
+        # windows hanging over the edge are padded with nodata
+        edge = source.read_window(-2, 998, 4, 4)
+        assert edge[0, 0] == raster.nodata and edge[1, 3] == raster.nodata
+        assert edge[2, 0] == raster[0, 998] and edge[3, 1] == raster[1, 999]
+
+    out_dir = temporary_directory()
+    file_name = os.path.join(out_dir, 'window.dep')
+    _write_whitebox(file_name, 'float', 'BIG_ENDIAN', 3, 4, list(range(12)))
+    block = Array2D.create(2, 2, initial_value=50.0)
+    target = Raster.open_header(file_name)
+    assert target.statistics().maximum == 11.0
+    target.write_window(block, 1, 2)
+    assert list(Raster.from_file(file_name)._values) == [0, 1, 2, 3, 4, 5, 50, 50, 8, 9, 50, 50]
+    assert target.statistics().maximum == 50.0
+
+    in_memory = Raster.from_file(file_name)
+    window = in_memory.read_window(0, 0, 2, 2)
+    window[0, 0] = -1.0
+    in_memory.write_window(window)
+    assert in_memory[0, 0] == -1.0
+    print("Done!")
+
+def testIterBlocks():
+    print("Testing block iteration:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep')
+    mapped = Raster.from_file(test_dir + 'test.dep', mmap=True)
+    out_file = os.path.join(temporary_directory(), 'copy.dep')
+    bands = 0
+    with RasterWriter(out_file, mapped) as writer:
+        for first_row, last_row, block in mapped.iter_blocks(block_rows=300, halo=2):
+            assert block.row_offset == first_row - 2
+            assert block.rows == last_row - first_row + 4
+            assert block[2, 5] == raster[first_row, 5]
+            if first_row == 0:
+                assert block[0, 0] == raster.nodata
+            writer.write_block(block, 2, last_row - first_row)
+            bands += 1
+    assert bands == 4
+
+    copy = Raster.from_file(out_file)
+    assert copy == raster
+    assert copy.minimum == raster.minimum and copy.maximum == raster.maximum
+    print("Done!")
+
+def _small_raster(values, nodata=-1.0, data_type='float'):
+    """An in-memory 2 x 3 raster holding values
+    """
+    return make_raster(2, 3, lambda row, col: values[row * 3 + col], nodata, data_type)
+
+def testOpenOutput():
+    print("Testing streamed outputs:")
+    raster = _small_raster([1.0, 2.0, -1.0, 4.0, 9.0, 0.0])
+    with raster_module.open_output(None, raster, 'integer', 255) as writer:
+        writer.write_rows(array('h', [1, 2, 3]), 1)
+        writer.write_rows(array('h', [4, 5, 6]), 1)
+    result = writer.raster
+    assert (result.data_type, result.nodata, result.header_filename) == ('integer', 255, None)
+    assert list(result._values) == [1, 2, 3, 4, 5, 6]
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'streamed.dep')
+        with raster_module.open_output(output_file, raster) as writer:
+            writer.write_block(raster)
+        assert Raster.from_file(output_file) == raster
+
+        # a failure part way through is raised as it is, not as missing rows
+        try:
+            with raster_module.open_output(output_file, raster) as writer:
+                writer.write_block(raster, 0, 1)
+                raise KeyError('failed')
+        except KeyError:
+            pass
+    print("Done!")
+
+def testAlgebra():
+    print("Testing raster algebra:")
+    a = _small_raster([1.0, 2.0, -1.0, 4.0, 9.0, 0.0])
+    b = _small_raster([2.0, -1.0, 3.0, 2.0, 3.0, 0.0])
+
+    assert list((a + b)._values) == [3.0, -1.0, -1.0, 6.0, 12.0, 0.0]
+    assert list((a - b)._values) == [-1.0, -1.0, -1.0, 2.0, 6.0, 0.0]
+    assert list((a * 2)._values) == [2.0, 4.0, -1.0, 8.0, 18.0, 0.0]
+    assert list((10 - a)._values) == [9.0, 8.0, -1.0, 6.0, 1.0, 10.0]
+    assert list((a / b)._values) == [0.5, -1.0, -1.0, 2.0, 3.0, -1.0]
+    assert list((a ** 2)._values) == [1.0, 4.0, -1.0, 16.0, 81.0, 0.0]
+    roots = a.sqrt()
+    assert roots[0, 0] == 1.0 and roots[0, 2] == -1.0 and roots[1, 2] == 0.0
+    assert abs(roots[0, 1] - math.sqrt(2.0)) < 1e-6
+    assert list(a.log()._values)[5] == -1.0
+    assert list(abs(a - 6)._values) == [5.0, 4.0, -1.0, 2.0, 3.0, 6.0]
+    assert (-a)[1, 1] == -9.0
+    assert list((a > 1.5)._values) == [0.0, 1.0, -1.0, 1.0, 1.0, 0.0]
+    assert list(a.equal(b)._values) == [0.0, -1.0, -1.0, 0.0, 0.0, 1.0]
+    assert list(raster_module.maximum(a, b)._values) == [2.0, -1.0, -1.0, 4.0, 9.0, 0.0]
+    assert list(raster_module.minimum(a, 3.0)._values) == [1.0, 2.0, -1.0, 3.0, 3.0, 0.0]
+    assert list(raster_module.where(a > 2, a, 0.0)._values) == [0.0, 0.0, -1.0, 4.0, 9.0, 0.0]
+
+    # operands are left untouched and in-place variants update the raster
+    assert list(a._values) == [1.0, 2.0, -1.0, 4.0, 9.0, 0.0]
+    values = a._values
+    a += b
+    a -= 1
+    a *= 2
+    a /= b
+    assert a._values is values
+    assert list(a._values)[:4] == [2.0, -1.0, -1.0, 5.0]
+    assert abs(a[1, 1] - 22.0 / 3.0) < 1e-6 and a[1, 2] == -1.0
+
+    integers = _small_raster([1, 2, 3, 4, 5, 6], data_type='integer')
+    integers /= 2
+    assert list(integers._values) == [0, 1, 2, 2, 2, 3]
+
+    # results outside of the range of the data type, or not finite, are nodata
+    bytes_ = _small_raster([250, 1, 2, 3, 4, 255], nodata=255, data_type='byte')
+    bytes_ += 10
+    assert list(bytes_._values) == [255, 11, 12, 13, 14, 255]
+    bytes_ -= 12
+    assert list(bytes_._values) == [255, 255, 0, 1, 2, 255]
+    integers **= 1000.0
+    assert list(integers._values) == [0, 1, -1, -1, -1, -1]
+
+    # numbers may come first in minimum and maximum
+    assert list(raster_module.minimum(3.0, b)._values) == list(raster_module.minimum(b, 3.0)._values)
+    assert list(raster_module.maximum(3.0, b)._values) == [3.0, -1.0, 3.0, 3.0, 3.0, 3.0]
+    print("Done!")
+
+def testLazyExpressions():
+    print("Testing lazy expressions:")
+    a = _small_raster([1.0, 2.0, -1.0, 4.0, 9.0, 0.0])
+    b = _small_raster([2.0, -1.0, 3.0, 2.0, 3.0, 0.0])
+    c = _small_raster([4.0, 1.0, 1.0, 0.0, 2.0, 8.0])
+
+    expression = a.lazy() * 2.0 + b / c
+    assert isinstance(expression, raster_module.RasterExpression)
+    assert expression[0, 0] == 2.5 and expression[0, 1] == -1.0
+    result = expression.compute()
+    assert list(result._values) == [2.5, -1.0, -1.0, -1.0, 19.5, 0.0]
+    assert list(result._values) == list((a * 2.0 + b / c)._values)
+
+    mixed = raster_module.where(a.lazy() > 1.5, raster_module.maximum(a.lazy(), b), 10 - c)
+    assert list(mixed.compute()._values) == list(
+        raster_module.where(a > 1.5, raster_module.maximum(a, b), 10 - c)._values)
+
+    out_file = os.path.join(temporary_directory(), 'lazy.dep')
+    _write_whitebox(out_file, 'float', 'LITTLE_ENDIAN', 2, 3, [1, 2, 3, 4, 5, 6])
+    source = Raster.open_header(out_file)
+    (source.lazy() ** 2 - 1).write(out_file.replace('lazy', 'squared'))
+    squared = Raster.from_file(out_file.replace('lazy', 'squared'))
+    assert list(squared._values) == [0, 3, 8, 15, 24, 35]
+    assert squared.minimum == 0 and squared.maximum == 35
+    print("Done!")
+
+def testStatistics():
+    print("Testing statistics:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep')
+    values = sorted(z for z in raster._values if z != raster.nodata)
+    mean = sum(values) / len(values)
+    std = math.sqrt(sum((z - mean) ** 2 for z in values) / len(values))
+
+    stats = raster.statistics()
+    assert stats.count == len(values)
+    assert stats.minimum == values[0] and stats.maximum == values[-1]
+    assert abs(stats.mean - mean) < 1e-9 and abs(stats.std - std) < 1e-9
+    edges, counts = stats.histogram
+    assert len(edges) == len(counts) + 1 and sum(counts) == len(values)
+    assert edges[0] <= values[0] and edges[-1] >= values[-1]
+    bin_width = edges[1] - edges[0]
+    for p in (5, 50, 95):
+        assert abs(stats.percentile(p) - values[int(p / 100.0 * (len(values) - 1))]) <= bin_width
+
+    # values added block by block, in any order, give the same results
+    streamed = raster_module.RasterStatistics()
+    for start in reversed(range(0, len(values), 1000)):
+        streamed.update(values[start:start + 1000], raster.nodata)
+    assert streamed.count == stats.count and abs(streamed.mean - mean) < 1e-9
+    edges, counts = streamed.histogram
+    assert sum(counts) == len(values)
+    assert abs(streamed.percentile(50) - values[len(values) // 2]) <= edges[1] - edges[0]
+
+    # the cached statistics and the header range follow edits
+    assert raster.statistics() is stats
+    raster[0, 0] = 1000.0
+    assert raster.statistics() is not stats
+    raster.calculate_min_and_max()
+    assert raster.maximum == 1000.0
+    raster[0, 0] = values[0]
+    raster.calculate_min_and_max()
+    assert raster.maximum == values[-1]
+
+    raster.set_display_range(2.0, 98.0)
+    assert values[0] <= raster.display_minimum < raster.display_maximum <= values[-1]
+    print("Done!")
+
+def testOpenHeader():
+    print("Testing header-only opening:")
+    out_dir = temporary_directory()
+    file_name = os.path.join(out_dir, 'header.dep')
+    _write_whitebox(file_name, 'i32', 'BIG_ENDIAN', 3, 4, list(range(12)), nodata=-1)
+    with open(file_name, 'a') as f:
+        f.write("Metadata Entry:\tCreated at 10:30\n\n")
+    # dimensions, extent and metadata come from the header alone
+    os.rename(file_name.replace('.dep', '.tas'), file_name.replace('.dep', '.bak'))
+    raster = Raster.open_header(file_name)
+    assert raster._values is None
+    assert (raster.rows, raster.columns) == (3, 4)
+    assert (raster.north, raster.south, raster.east, raster.west) == (3.0, 0.0, 4.0, 0.0)
+    assert raster.data_type == 'i32' and raster.nodata == -1.0
+    assert raster.byte_order == 'big_endian'
+    assert raster.minimum == 0 and raster.display_minimum == 0
+    assert raster.metadata == ['Created at 10:30']
+
+    os.rename(file_name.replace('.dep', '.bak'), file_name.replace('.dep', '.tas'))
+    assert list(raster.read_window(1, 0, 2, 4)._values) == list(range(4, 12))
+    print("Done!")
+
+def testAsciiGrid():
+    print("Testing ESRI ASCII grids:")
+    out_dir = temporary_directory()
+    file_name = os.path.join(out_dir, 'grid.asc')
+    with open(file_name, 'w') as f:
+        f.write("ncols 3\nNROWS 2\nxllcenter 100.5\nyllcenter 200.5\ncellsize 1.0\nNODATA_value -9999\n")
+        f.write("1 2.5 -9999\n  4e2 -5\n6\n")
+    grid = Raster.from_file(file_name)
+    assert (grid.rows, grid.columns) == (2, 3)
+    assert (grid.west, grid.south, grid.east, grid.north) == (100.0, 200.0, 103.0, 202.0)
+    assert list(grid._values) == [1.0, 2.5, -9999.0, 400.0, -5.0, 6.0]
+    assert grid.nodata == -9999.0 and grid.minimum == -5.0 and grid.maximum == 400.0
+    assert Raster.open_header(file_name).rows == 2
+
+    # tokens split across chunk boundaries are joined back together
+    chunk = raster_module._ASCII_CHUNK_CHARACTERS
+    raster_module._ASCII_CHUNK_CHARACTERS = 7
+    try:
+        assert list(Raster.from_file(file_name)._values) == list(grid._values)
+    finally:
+        raster_module._ASCII_CHUNK_CHARACTERS = chunk
+
+    # a header line without a value names the line
+    with open(file_name, 'w') as f:
+        f.write("ncols 3\nnrows\nxllcorner 0\nyllcorner 0\ncellsize 1.0\n1 2 3\n4 5 6\n")
+    try:
+        Raster.from_file(file_name)
+        assert False
+    except Exception as e:
+        assert "'nrows'" in str(e)
+
+    # round trip of the test DEM through both writers
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep')
+    converted = Raster.create_from_other(os.path.join(out_dir, 'test.asc'), raster)
+    converted._values = raster._values
+    converted.write()
+    back = Raster.from_file(os.path.join(out_dir, 'test.asc'))
+    assert back.west == raster.west and back.north == raster.north
+    assert list(back._values) == list(raster._values)
+
+    with RasterWriter(os.path.join(out_dir, 'streamed.asc'), raster) as writer:
+        for first_row, last_row, block in raster.iter_blocks(block_rows=333):
+            writer.write_block(block)
+    with open(os.path.join(out_dir, 'streamed.asc')) as a, open(os.path.join(out_dir, 'test.asc')) as b:
+        assert a.read() == b.read()
+    print("Done!")
+
+def testTiledFormat():
+    print("Testing the tiled format and format drivers:")
+    out_dir = temporary_directory()
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep')
+
+    # a mostly nodata raster, so that most tiles are sparse
+    sparse = Raster.create_from_other(os.path.join(out_dir, 'sparse.rtz'), raster)
+    sparse.tile_size = 64
+    for row in range(100, 150):
+        for col in range(30, 90):
+            sparse[row, col] = raster[row, col]
+    sparse.write()
+    assert os.path.getsize(sparse.data_filename) < sparse.rows * sparse.columns * 4 // 20
+    assert list(sparse._tile_lengths).count(0) > len(sparse._tile_lengths) // 2
+
+    back = Raster.from_file(os.path.join(out_dir, 'sparse.rtz'))
+    assert back.driver.name == 'tiled' and back.tile_size == 64
+    assert (back.rows, back.columns, back.north, back.west) == (raster.rows, raster.columns, raster.north, raster.west)
+    assert back == sparse and back.minimum == sparse.minimum
+
+    # windows decompress only the tiles they overlap
+    header = Raster.open_header(os.path.join(out_dir, 'sparse.rtz'))
+    assert header._values is None
+    window = header.read_window(90, 20, 70, 100)
+    assert list(window._values) == list(sparse.read_window(90, 20, 70, 100)._values)
+    try:
+        header.write_window(window)
+        assert False
+    except Exception:
+        pass
+
+    # every compression round-trips, streamed or written whole
+    for compression in ('zlib', 'lzma', 'none'):
+        file_name = os.path.join(out_dir, compression + '.rtz')
+        raster.compression, raster.tile_size = compression, 100
+        with RasterWriter(file_name, raster, data_type='double') as writer:
+            for first_row, last_row, block in raster.iter_blocks(block_rows=77):
+                writer.write_block(block)
+        back = Raster.from_file(file_name)
+        assert back.compression == compression and back.data_type == 'double'
+        assert back == raster
+
+    # files are recognised by their magic bytes whatever their name
+    os.rename(os.path.join(out_dir, 'zlib.rtz'), os.path.join(out_dir, 'zlib.bin'))
+    assert Raster.from_file(os.path.join(out_dir, 'zlib.bin')) == raster
+    try:
+        Raster.from_file(os.path.join(out_dir, 'zlib.rtz'), mmap=True)
+        assert False
+    except Exception:
+        pass
+
+    # drivers registered later take precedence
+    class Renamed(raster_module.TiledDriver):
+        extensions = ('.tiles',)
+    driver = Renamed()
+    raster_module.register_driver(driver)
+    try:
+        assert raster_module.get_driver('a.tiles') is driver
+        copy = Raster.create_from_other(os.path.join(out_dir, 'copy.tiles'), raster)
+        copy._values = raster._values
+        copy.write()
+        assert Raster.from_file(os.path.join(out_dir, 'copy.tiles')) == raster
+    finally:
+        raster_module._DRIVERS.remove(driver)
+    print("Done!")
+
+def testOverviews():
+    print("Testing overviews:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep').read_window(200, 300, 100, 90)
+    file_name = os.path.join(temporary_directory(), 'dem.dep')
+    raster._set_filenames(file_name)
+    for row, col in ((0, 0), (5, 7), (99, 89)):
+        raster[row, col] = raster.nodata
+    raster.write()
+
+    def covered(n, row, col):
+        return [raster[y, x] for y in range(row * n, min(row * n + n, raster.rows))
+                for x in range(col * n, min(col * n + n, raster.columns))]
+
+    for method in ('mean', 'max', 'nearest'):
+        raster.build_overviews(levels=(2, 3, 16), method=method, block_rows=50)
+        for n in (2, 3, 16):
+            overview = Raster.from_file(file_name, overview=n)
+            assert (overview.rows, overview.columns) == (-(-100 // n), -(-90 // n))
+            assert overview.resolution_x == n * raster.resolution_x
+            assert overview.north == raster.north and overview.west == raster.west
+            assert overview.header_filename.endswith('dem.ovr{}.dep'.format(n))
+            for row in range(overview.rows):
+                for col in range(overview.columns):
+                    cells = covered(n, row, col)
+                    valid = [z for z in cells if z != raster.nodata]
+                    if method == 'nearest':
+                        y = min(row * n + n // 2, raster.rows - 1)
+                        x = min(col * n + n // 2, raster.columns - 1)
+                        expected = raster[y, x]
+                    elif method == 'max':
+                        expected = max(valid)
                     else:
-                        values[n] = 0.0
-                        w[n] = 0.0
+                        expected = sum(valid) / len(valid)
+                    assert abs(overview[row, col] - expected) < 1e-3, (method, n, row, col)
 
-                if sum_w > 0.0:
-                    z = 0.0
-                    for n in range(num_neighbours):
-                        z += values[n] * w[n] / sum_w
+    window = raster.read_window(3, 2, 10, 12, overview=2)
+    assert list(window._values) == list(Raster.from_file(file_name, overview=2).read_window(3, 2, 10, 12)._values)
+    try:
+        raster.read_window(0, 0, 1, 1, overview=4)
+        assert False
+    except Exception:
+        pass
 
-                output[row, col] = z
+    # overviews of a raster changed since they were built are refused
+    raster.build_overviews(levels=(2,), method='max')
+    raster += 1000.0
+    raster.write()
+    for read in (lambda: Raster.from_file(file_name, overview=2),
+                 lambda: raster.read_window(0, 0, 2, 2, overview=2)):
+        try:
+            read()
+            assert False
+        except Exception as e:
+            assert 'out of date' in str(e)
+    raster.build_overviews(levels=(2,), method='max')
+    assert Raster.from_file(file_name, overview=2)[1, 1] == max(covered(2, 1, 1))
+    block = Raster.open_header(file_name)
+    block.write_window(raster.read_window(0, 0, 1, 1))
+    try:
+        Raster.open_header(file_name).read_window(0, 0, 1, 1, overview=2)
+        assert False
+    except Exception as e:
+        assert 'out of date' in str(e)
 
+    # formats without metadata keep their overviews too, but unsaved edits
+    # are not made into overviews
+    ascii_name = os.path.join(os.path.dirname(file_name), 'dem.asc')
+    raster._set_filenames(ascii_name)
+    raster.write()
+    raster.build_overviews(levels=(2,), method='max')
+    assert Raster.from_file(ascii_name, overview=2)[1, 1] == max(covered(2, 1, 1))
+    raster[0, 0] = 1.0
+    try:
+        raster.build_overviews(levels=(2,))
+        assert False
+    except Exception as e:
+        assert 'unsaved' in str(e)
+    print("Done!")
 
-        progress = int(100.0 * (row+1) / raster.rows)
-        if progress != old_progress:
-            print('progress: {}%'.format(progress))
-            old_progress = progress
+def testSampling():
+    print("Testing coordinate transforms and point sampling:")
+    # a plane over an 8 x 10 grid of 2 x 1.5 cells
+    r = make_raster(8, 10, lambda row, col: 2.0 * row + 3.0 * col + 1.0, -1.0, 'double',
+                    cell_size=(2.0, 1.5), origin=(50.0, 100.0))
 
-    print('Saving data...')
-    output.write()
+    columns = r.get_column_from_x([50.0, 51.9, 52.0, 69.9])
+    assert list(columns) == [0, 0, 1, 9] and columns.typecode == 'q'
+    assert list(r.get_row_from_y([112.0, 110.4, 100.1])) == [0, 1, 7]
+    assert list(r.get_x_from_column(range(3))) == [r.get_x_from_column(c) for c in range(3)]
+    assert list(r.get_y_from_row([0, 7])) == [111.25, 100.75]
+    assert r.get_row_from_y(110.4) == 1 and r.get_x_from_column(1) == 53.0
+
+    xs = [51.0, 53.5, 60.0, 61.3, 66.6, 49.0, 55.0]
+    ys = [111.25, 110.0, 105.1, 102.2, 107.0, 105.0, 99.0]
+    nearest = r.sample(xs, ys)
+    assert list(nearest[:5]) == [r[r.get_row_from_y(y), r.get_column_from_x(x)] for x, y in zip(xs[:5], ys[:5])]
+    assert list(nearest[5:]) == [-1.0, -1.0]
+
+    # interpolation is exact on a plane away from the edges
+    for method in ('bilinear', 'bicubic'):
+        values = r.sample(xs[1:5], ys[1:5], method)
+        for x, y, z in zip(xs[1:5], ys[1:5], values):
+            col = (x - r.west) / r.resolution_x - 0.5
+            row = (r.north - y) / r.resolution_y - 0.5
+            assert abs(z - (2.0 * row + 3.0 * col + 1.0)) < 1e-9, (method, x, y, z)
+
+    # nodata neighbours are left out of the weights
+    r[3, 4] = -1.0
+    x, y = 60.0, 106.0
+    z = r.sample([x], [y], 'bilinear')[0]
+    assert abs(z - (r[3, 5] * 0.25 + r[4, 4] * 0.25 + r[4, 5] * 0.25) / 0.75) < 1e-9
+    assert r.sample([x], [y], 'bicubic')[0] == z
+    assert r.sample([59.0], [106.9])[0] == -1.0
+
+    # unloaded rasters read only the bands holding points
+    file_name = os.path.join(temporary_directory(), 'plane.dep')
+    r._set_filenames(file_name)
+    r.write()
+    header = Raster.open_header(file_name)
+    for method in ('nearest', 'bilinear', 'bicubic'):
+        assert header.sample(xs, ys, method, block_rows=3) == r.sample(xs, ys, method)
+    print("Done!")
+
+def testResample():
+    print("Testing resampling, alignment and cropping:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    raster = Raster.from_file(test_dir + 'test.dep').read_window(400, 500, 60, 50)
+    raster[10, 10] = raster.nodata
+
+    # block averages and modes over 4 x 4 blocks, with partial blocks at the edges
+    for method in ('average', 'mode'):
+        coarse = raster.resample(4.0 * raster.resolution_x, method, block_rows=4)
+        assert (coarse.rows, coarse.columns) == (15, 13)
+        assert coarse.north == raster.north and coarse.west == raster.west
+        assert coarse.east == raster.west + 13 * 4.0 * raster.resolution_x
+        for row in range(coarse.rows):
+            for col in range(coarse.columns):
+                cells = [raster[y, x] for y in range(4 * row, min(4 * row + 4, 60))
+                         for x in range(4 * col, min(4 * col + 4, 50)) if raster[y, x] != raster.nodata]
+                if method == 'average':
+                    assert abs(coarse[row, col] - sum(cells) / len(cells)) < 1e-3
+                else:
+                    best = max(cells.count(z) for z in cells)
+                    assert coarse[row, col] == min(z for z in cells if cells.count(z) == best)
+
+    # point methods sample at the new cell centres
+    fine = raster.resample((raster.resolution_x / 2.0, raster.resolution_y / 3.0), 'nearest')
+    assert (fine.rows, fine.columns) == (180, 100)
+    for row in range(0, fine.rows, 7):
+        for col in range(0, fine.columns, 3):
+            assert fine[row, col] == raster[row // 3, col // 2]
+    xs = [fine.get_x_from_column(col) for row in range(fine.rows) for col in range(fine.columns)]
+    ys = [fine.get_y_from_row(row) for row in range(fine.rows) for col in range(fine.columns)]
+    for method, sampler in (('bilinear', 'bilinear'), ('cubic', 'bicubic')):
+        output_file = os.path.join(temporary_directory(), 'fine.dep')
+        raster.resample((raster.resolution_x / 2.0, raster.resolution_y / 3.0), method,
+                        output=output_file, block_rows=16)
+        written = Raster.from_file(output_file)
+        assert [abs(a - b) < 1e-3 for a, b in zip(written._values, raster.sample(xs, ys, sampler))] == [True] * len(xs)
+
+    # cropping widens to whole cells, and alignment makes grids match
+    part = raster.crop((raster.north - 10.2 * raster.resolution_y, raster.north - 20.0 * raster.resolution_y,
+                        raster.west + 30.0 * raster.resolution_x, raster.west + 5.5 * raster.resolution_x))
+    assert (part.rows, part.columns, part.row_offset, part.column_offset) == (10, 25, 10, 5)
+    assert part[0, 0] == raster[10, 5] and part.west == raster.west + 5 * raster.resolution_x
+    aligned = fine.align_to(raster, 'average')
+    assert (aligned.rows, aligned.columns) == (raster.rows, raster.columns)
+    assert all(abs(a - b) < 1e-3 for a, b in zip(aligned._values, raster._values))
+    assert (aligned - raster).rows == raster.rows
+    print("Done!")
+
+def testInstrumentation():
+    print("Testing instrumentation hooks:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    seen = []
+    raster_module.add_hook(seen.append)
+    try:
+        raster = Raster.from_file(test_dir + 'test.dep')
+    finally:
+        raster_module.remove_hook(seen.append)
+    assert [(r.operation, r.depth) for r in seen] == [('read_header', 1), ('read', 0)]
+    assert (seen[1].cells, seen[1].bytes, seen[1].allocated) == (1000000, 4000000, 4000000)
+    raster.read_window(0, 0, 2, 2)
+    assert len(seen) == 2
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger('raster')
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    output_file = os.path.join(temporary_directory(), 'profiled.dep')
+    try:
+        with raster_module.profile(log=True) as profile:
+            window = raster.read_window(10, 10, 50, 40)
+            result = window * 2.0 + window
+            result._set_filenames(output_file)
+            result.write()
+            header = Raster.open_header(output_file)
+            header.read_window(0, 0, 5, 40)
+            header.statistics()
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+
+    summary = profile.summary()
+    assert sorted(summary) == ['operator', 'read_header', 'read_window', 'statistics', 'write', 'write_header']
+    assert summary['operator']['count'] == 2 and summary['operator']['allocated'] == 2 * 2000 * 4
+    assert [r.detail for r in profile.records if r.operation == 'operator'] == ['mul', 'add']
+    assert summary['write']['bytes'] == 2000 * 4 and summary['read_window']['count'] == 3
+    assert summary['statistics']['count'] == 2 and summary['read_header']['count'] == 1
+    assert [r.bytes for r in profile.records if r.operation == 'read_window'] == [0, 800, 8000]
+    assert 0.0 <= profile.untracked <= profile.seconds
+    assert [r.raster_operation for r in records] == [r.as_dict() for r in profile.records]
+    assert raster_module._HOOKS == []
+    print("Done!")
+
+def testCache():
+    print("Testing the raster cache:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    test_file = test_dir + 'test.dep'
+    expected = Raster.from_file(test_file)
+    header = Raster.open_header(test_file)
+    cache = raster_module.cache
+    cache.resize(1 << 24)
+    try:
+        for _ in range(2):
+            r = Raster.from_file(test_file)
+            assert list(r._values) == list(expected._values)
+            assert dict((k, v) for k, v in vars(r).items() if k != '_values') == \
+                dict((k, v) for k, v in vars(expected).items() if k != '_values')
+        hits = cache.hits
+        window = Raster.open_header(test_file).read_window(100, 200, 30, 40)
+        assert list(window._values) == list(expected.read_window(100, 200, 30, 40)._values)
+        assert cache.hits > hits and 4000000 < cache.bytes <= cache.max_bytes
+        r.metadata.append('changed')
+        assert Raster.from_file(test_file).metadata == expected.metadata
+
+        # windows from a second file through small tiles, from several threads
+        cache.tile_cells = 1000
+        directory = temporary_directory()
+        file_name = os.path.join(directory, 'cached.dep')
+        values = [float(i % 97) for i in range(60 * 50)]
+        _write_whitebox(file_name, 'float', 'BIG_ENDIAN', 60, 50, values)
+        source = Raster.open_header(file_name)
+        windows = [(y, x, h, w) for y in (-3, 0, 17, 55) for x in (-2, 0, 11, 48) for h, w in ((1, 1), (9, 50), (30, 7))]
+        def check(window):
+            y, x, h, w = window
+            block = source.read_window(y, x, h, w)
+            return all(block[row, col] == (values[(y + row) * 50 + x + col] if 0 <= y + row < 60 and 0 <= x + col < 50
+                                           else source.nodata) for row in range(h) for col in range(w))
+        with ThreadPoolExecutor(4) as executor:
+            assert all(executor.map(check, windows * 3))
+
+        # writes through the Raster drop the cached tiles; other changes give new keys
+        block = source.read_window(20, 10, 5, 5)
+        block[0, 0] = 1000.0
+        source.write_window(block)
+        assert source.read_window(20, 10, 1, 1)[0, 0] == 1000.0
+        values[0] = 500.0
+        _write_whitebox(file_name, 'float', 'BIG_ENDIAN', 60, 50, values + [0.0])
+        assert Raster.from_file(file_name)[0, 0] == 500.0
+
+        # the budget holds with LRU eviction
+        cache.resize(6000)
+        for y in range(0, 60, 4):
+            source.read_window(y, 0, 1, 50)
+        assert cache.bytes <= 6000 and len(cache._entries) == 1
+        cache.resize(0)
+        assert cache.bytes == 0
+    finally:
+        cache.resize(0)
+        cache.tile_cells = 1 << 16
+    print("Done!")
+
+def testRasterStack():
+    print("Testing raster stacks:")
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    base = Raster.from_file(test_dir + 'test.dep').read_window(400, 400, 30, 20)
+    times = [1.0, 2.0, 4.0, 7.0, 8.0, 12.0]
+    bands = [base * (1.0 + (band % 3)) - float(band) for band in range(len(times))]
+    for band in range(len(times)):
+        for col in range(band + 1):
+            bands[band][band, col] = base.nodata
+
+    def reduced(statistic, cells, xs):
+        valid = [(x, z) for x, z in zip(xs, cells) if z != base.nodata]
+        if statistic == 'count':
+            return len(valid)
+        if not valid or (statistic == 'slope' and len(set(x for x, _ in valid)) < 2):
+            return -32768.0 if statistic == 'argmax' else base.nodata
+        if statistic == 'mean':
+            return sum(z for _, z in valid) / len(valid)
+        if statistic == 'max':
+            return max(z for _, z in valid)
+        if statistic == 'argmax':
+            return cells.index(max(z for _, z in valid))
+        mx = sum(x for x, _ in valid) / len(valid)
+        my = sum(z for _, z in valid) / len(valid)
+        return sum((x - mx) * (z - my) for x, z in valid) / sum((x - mx) ** 2 for x, _ in valid)
+
+    directory = temporary_directory()
+    for interleave in ('band', 'pixel'):
+        stack = RasterStack.from_rasters(bands, interleave)
+        file_name = os.path.join(directory, interleave + '.dep')
+        stack.write(file_name)
+        stack = RasterStack.from_file(file_name)
+        assert (len(stack), stack.interleave, stack.rows, stack.columns) == (6, interleave, 30, 20)
+        for band in range(len(stack)):
+            assert list(stack.band(band)._values) == list(bands[band]._values)
+        if interleave == 'band':
+            assert list(Raster.from_file(file_name)._values) == list(bands[0]._values)
+        else:
+            try:
+                Raster.from_file(file_name)
+                assert False
+            except Exception as e:
+                assert 'RasterStack' in str(e)
+
+        for statistic in raster_module.REDUCTIONS:
+            for xs in (None, times):
+                output_file = os.path.join(directory, statistic + '.dep')
+                stack.reduce(statistic, xs, output=output_file, block_rows=7)
+                result = Raster.from_file(output_file)
+                for row in range(result.rows):
+                    for col in range(result.columns):
+                        expected = reduced(statistic, [b[row, col] for b in bands], xs or range(6))
+                        assert abs(result[row, col] - expected) <= 1e-3 * max(1.0, abs(expected))
+            assert stack.reduce(statistic).data_type == ('integer' if statistic in ('argmax', 'count') else 'float')
+
+        # band views and layout conversion share or copy the cells as promised
+        view = stack[2]
+        view[3, 4] = -1.0
+        view += 1.0
+        assert stack.band(2)[3, 4] == 0.0 and stack.band(2)[5, 5] == bands[2][5, 5] + 1.0
+        other = stack.interleaved('pixel' if interleave == 'band' else 'band')
+        assert list(other.band(2)._values) == list(view._values) and other.band(2)[3, 4] == 0.0
+        view[3, 4] = 9.0
+        assert other.band(2)[3, 4] == 0.0
+        shape = (6, 30, 20) if interleave == 'band' else (30, 20, 6)
+        assert tuple(stack.array.shape) == shape
+        assert stack.array[(2, 3, 4) if interleave == 'band' else (3, 4, 2)] == 9.0
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if interleave == 'band' or numpy is not None:
+            band_view = view.array
+            assert tuple(band_view.shape) == (30, 20) and band_view[3, 4] == 9.0
+            band_view[3, 4] = 8.0
+            assert stack.band(2)[3, 4] == 8.0
+        else:
+            try:
+                view.array
+                assert False
+            except Exception as e:
+                assert 'requires NumPy' in str(e)
+    print("Done!")
+
+def filter():
+    test_dir = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + 'test_data' + os.path.sep
+    test_file = test_dir + 'test.dep'
+
+    print('Reading data...')
+    raster = Raster.from_file(test_file, mmap=True)
+
+    # 7 x 7 edge-preserving smoothing, streamed one band of rows at a time
+    print('Filtering and saving data...')
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_file = os.path.join(output_dir, 'filtered.dep')
+        focal.edge_preserving_filter(raster, size=7, threshold=10.0, output=output_file)
 
 if __name__ == '__main__':
     testRaster()
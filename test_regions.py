@@ -0,0 +1,90 @@
+import os, math, random
+from raster import Raster
+from fixtures import make_raster, temporary_directory
+import regions
+
+def _random_raster(rows, columns, classes, nodata=-32768.0, seed=1):
+    """An in-memory raster of random classes 0 to classes - 1 with a few nodata cells
+    """
+    rng = random.Random(seed)
+    return make_raster(rows, columns, lambda row, col: nodata if rng.random() < 0.05
+                       else float(rng.randrange(classes)), nodata)
+
+def _flood_labels(raster, connectivity, by_value, background):
+    """Labels by flood filling from each unlabelled cell in turn, row by row
+    """
+    if connectivity == 8:
+        steps = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+    else:
+        steps = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    labels = {}
+    count = 0
+    for row in range(raster.rows):
+        for col in range(raster.columns):
+            v = raster[row, col]
+            if v in (raster.nodata, background) or (row, col) in labels:
+                continue
+            count += 1
+            labels[row, col] = count
+            stack = [(row, col)]
+            while stack:
+                y, x = stack.pop()
+                for dy, dx in steps:
+                    n = (y + dy, x + dx)
+                    w = raster[n]
+                    if n in labels or w in (raster.nodata, background) or (by_value and w != v):
+                        continue
+                    if 0 <= n[0] < raster.rows and 0 <= n[1] < raster.columns:
+                        labels[n] = count
+                        stack.append(n)
+    return labels, count
+
+def testLabel():
+    print("Testing connected-component labelling:")
+    raster = _random_raster(23, 31, 3)
+    for connectivity in (4, 8):
+        for by_value, background in ((False, 0.0), (True, 0.0), (True, None)):
+            labels, count = regions.label(raster, connectivity, by_value, background, block_rows=4)
+            expected, expected_count = _flood_labels(raster, connectivity, by_value, background)
+            assert count == expected_count and labels._values.typecode == 'i'
+            for row in range(raster.rows):
+                for col in range(raster.columns):
+                    assert labels[row, col] == expected.get((row, col), 0)
+    try:
+        regions.label(raster, 6)
+        assert False
+    except Exception:
+        pass
+    print("Done!")
+
+def testZonalStats():
+    print("Testing zonal statistics:")
+    zones = _random_raster(40, 25, 5, seed=2)
+    values = _random_raster(40, 25, 100, seed=3)
+    expected = {}
+    for row in range(zones.rows):
+        for col in range(zones.columns):
+            if zones[row, col] != zones.nodata and values[row, col] != values.nodata:
+                expected.setdefault(zones[row, col], []).append(values[row, col])
+
+    file_name = os.path.join(temporary_directory(), 'values.dep')
+    values._set_filenames(file_name)
+    values.write()
+    for source in (values, Raster.open_header(file_name)):
+        stats = regions.zonal_stats(zones, source, block_rows=7)
+        assert sorted(stats) == sorted(expected)
+        for zone, cells in expected.items():
+            mean = sum(cells) / len(cells)
+            assert stats[zone]['count'] == len(cells)
+            assert stats[zone]['sum'] == sum(cells)
+            assert abs(stats[zone]['mean'] - mean) < 1e-9
+            assert stats[zone]['min'] == min(cells) and stats[zone]['max'] == max(cells)
+            assert abs(stats[zone]['std'] - math.sqrt(sum((v - mean) ** 2 for v in cells) / len(cells))) < 1e-9
+
+    # per-region statistics of labelled patches
+    labels, count = regions.label(zones, by_value=True, background=None)
+    stats = regions.zonal_stats(labels, values, stats=('count', 'max'))
+    assert set(stats) <= set(range(1, count + 1)) and len(stats) > count // 2
+    assert set(stats[1]) == {'count', 'max'}
+    assert sum(s['count'] for s in stats.values()) == sum(len(cells) for cells in expected.values())
+    print("Done!")